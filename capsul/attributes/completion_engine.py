@@ -787,6 +787,46 @@ class PathCompletionEngine(object):
         '''
         return None
 
+    def attributes_to_paths(self, process, parameters, attributes,
+                            attributes_table):
+        ''' Build paths for several sets of attributes values (process
+        iterations for instance), in one call.
+
+        The default implementation sets each row of the table on the
+        attributes controller, and calls :meth:`attributes_to_path` for each
+        parameter. Specializations may avoid this (see
+        :class:`~capsul.attributes.fom_completion_engine.FomPathCompletionEngine`).
+
+        Parameters
+        ----------
+        process: Process instance
+        parameters: list of str
+            parameters to build paths for
+        attributes: ProcessAttributes instance (Controller)
+            attributes of the process. Values missing in the table rows are
+            taken from it.
+        attributes_table: list of dict
+            attributes values, one dict per paths set
+
+        Returns
+        -------
+        paths: dict
+            {parameter: list of paths}, with one path per row of the table.
+            Paths which cannot be built are None.
+        '''
+        paths = dict((parameter, []) for parameter in parameters)
+        for row in attributes_table:
+            for attribute, value in six.iteritems(row):
+                setattr(attributes, attribute, value)
+            for parameter in parameters:
+                try:
+                    path = self.attributes_to_path(process, parameter,
+                                                   attributes)
+                except Exception:
+                    path = None
+                paths[parameter].append(path)
+        return paths
+
 
 class ProcessCompletionEngineFactory(object):
     '''
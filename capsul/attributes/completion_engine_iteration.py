@@ -16,6 +16,7 @@ Classes
 -----------------------------------------
 '''
 
+from capsul.pipeline.pipeline import Pipeline
 from capsul.pipeline.process_iteration import ProcessIteration
 from capsul.attributes.completion_engine import ProcessCompletionEngine, \
     ProcessCompletionEngineFactory
@@ -139,14 +140,63 @@ class ProcessCompletionEngineIteration(ProcessCompletionEngine):
         self.completion_progress = 0.
         try:
             self.set_parameters(process_inputs)
-            attributes_set = self.get_attribute_values()
-            completion_engine = ProcessCompletionEngine.get_completion_engine(
-                self.process.process, self.name)
-            step_attributes = completion_engine.get_attribute_values()
+            iterative_parameters = self.get_iterations_parameters()
         except AttributeError:
             # ProcessCompletionEngine not implemented for this process:
             # no completion
             return
+        for parameter, values in six.iteritems(iterative_parameters):
+            setattr(self.process, parameter, values)
+
+
+    def get_iterations_attributes(self):
+        ''' Attributes values of each iteration step, as a list of dicts
+        (one per step) holding the iterated attributes values.
+        '''
+        attributes_set = self.get_attribute_values()
+        iterated_attributes = self.get_iterated_attributes()
+        size = max([len(getattr(attributes_set, attribute))
+                    for attribute in iterated_attributes])
+        attributes_table = []
+        for it_step in xrange(size):
+            row = {}
+            for attribute in iterated_attributes:
+                iterated_values = getattr(attributes_set, attribute)
+                step = min(len(iterated_values) - 1, it_step)
+                row[attribute] = iterated_values[step]
+            attributes_table.append(row)
+        return attributes_table
+
+
+    def get_iterations_parameters(self, attributes_table=None):
+        ''' Complete the iterative parameters of all iteration steps.
+
+        When the iterated process is not a pipeline, paths are built in one
+        pass by the path completion engine
+        (:meth:`~capsul.attributes.completion_engine.PathCompletionEngine.attributes_to_paths`),
+        without completing each step on the iterated process. Otherwise each
+        step is completed in turn.
+
+        Parameters
+        ----------
+        attributes_table: list of dict (optional)
+            attributes values of each iteration step (one dict per step).
+            Attributes missing in a row take the value of the iteration
+            attributes. By default the table is built from the iterated
+            attributes lists (see :meth:`get_iterations_attributes`).
+
+        Returns
+        -------
+        parameters: dict
+            {parameter: list of values}, one value per iteration step, for
+            each iterative parameter.
+        '''
+        attributes_set = self.get_attribute_values()
+        completion_engine = ProcessCompletionEngine.get_completion_engine(
+            self.process.process, self.name)
+        step_attributes = completion_engine.get_attribute_values()
+        if attributes_table is None:
+            attributes_table = self.get_iterations_attributes()
         iterated_attributes = self.get_iterated_attributes()
         for attribute in attributes_set.user_traits():
             if attribute not in iterated_attributes:
@@ -156,23 +206,39 @@ class ProcessCompletionEngineIteration(ProcessCompletionEngine):
         for parameter in self.process.regular_parameters:
             parameters[parameter] = getattr(self.process, parameter)
 
-        size = max([len(getattr(attributes_set, attribute))
-                    for attribute in iterated_attributes])
+        size = len(attributes_table)
+        self.completion_progress_total = size
+        iterative_parameters = dict(
+            [(key, []) for key in self.process.iterative_parameters])
+        if self._bulk_completion(completion_engine):
+            completion_engine.set_parameters(parameters)
+            paths = completion_engine.get_path_completion_engine() \
+                .attributes_to_paths(self.process.process,
+                                     list(self.process.iterative_parameters),
+                                     step_attributes, attributes_table)
+            for parameter, values in six.iteritems(iterative_parameters):
+                # keep the given values of steps which cannot be completed
+                given_values = getattr(self.process, parameter)
+                if not isinstance(given_values, list):
+                    given_values = []
+                default = getattr(self.process.process, parameter)
+                for it_step, path in enumerate(paths[parameter]):
+                    if path is None:
+                        if len(given_values) > it_step:
+                            path = given_values[it_step]
+                        else:
+                            path = default
+                    values.append(path)
+            self.capsul_iteration_step = max(size - 1, 0)
+            self.completion_progress = size
+            return iterative_parameters
 
         # complete each step to get iterated parameters.
         # This is generally "too much" but it's difficult to perform a partial
         # completion only on iterated parameters
-
-        iterative_parameters = dict(
-            [(key, []) for key in self.process.iterative_parameters])
-
-        self.completion_progress_total = size
-        for it_step in xrange(size):
+        for it_step, row in enumerate(attributes_table):
             self.capsul_iteration_step = it_step
-            for attribute in iterated_attributes:
-                iterated_values = getattr(attributes_set, attribute)
-                step = min(len(iterated_values) - 1, it_step)
-                value = iterated_values[step]
+            for attribute, value in six.iteritems(row):
                 setattr(step_attributes, attribute, value)
             for parameter in self.process.iterative_parameters:
                 values = getattr(self.process, parameter)
@@ -183,8 +249,23 @@ class ProcessCompletionEngineIteration(ProcessCompletionEngine):
                 value = getattr(self.process.process, parameter)
                 iterative_parameters[parameter].append(value)
             self.completion_progress = it_step + 1
-        for parameter, values in six.iteritems(iterative_parameters):
-            setattr(self.process, parameter, values)
+        return iterative_parameters
+
+
+    def _bulk_completion(self, completion_engine):
+        ''' Tell if the iterations of the process can be completed in one
+        pass: the iterated process is not a pipeline, and its completion
+        engine only builds paths from attributes.
+        '''
+        if isinstance(self.process.process, Pipeline):
+            return False
+        engine_class = type(completion_engine)
+        for method in ('complete_parameters', 'attributes_to_path'):
+            if six.get_unbound_function(getattr(engine_class, method)) \
+                    is not six.get_unbound_function(
+                        getattr(ProcessCompletionEngine, method)):
+                return False
+        return True
 
 
     def complete_iteration_step(self, step):
@@ -38,6 +38,86 @@ from soma.path import split_path
 from soma.sorted_dictionary import SortedDictionary
 
 
+# marker of missing cache entries
+_not_cached = object()
+
+
+def _fom_cache(study_config):
+    ''' Cache of FOM queries results of a StudyConfig. It is cleared by
+    FomConfig when FOMs, formats or directories change.
+    '''
+    modules_data = study_config.modules_data
+    cache = getattr(modules_data, 'fom_cache', None)
+    if cache is None:
+        cache = {}
+        modules_data.fom_cache = cache
+    return cache
+
+
+def _fom_process_name(cache, fom, process):
+    ''' Name of a process in a FOM: its id, name or context name.
+    Raises KeyError if the process is not in the FOM.
+    '''
+    names_search_list = (process.id, process.name,
+                         getattr(process, 'context_name', ''))
+    key = ('name', fom) + names_search_list
+    name = cache.get(key)
+    if name is None:
+        for fname in names_search_list:
+            if fom.patterns.get(fname) is not None:
+                name = fname
+                break
+        else:
+            raise KeyError('Process not found in FOMs amongst %s' \
+                % repr(names_search_list))
+        cache[key] = name
+    return name
+
+
+def _discriminant_attributes(cache, atp, name, parameter):
+    ''' Attributes used by the FOM rules of a process parameter
+    '''
+    key = ('discriminant', atp, name, parameter)
+    attributes = cache.get(key)
+    if attributes is None:
+        attributes = tuple(atp.find_discriminant_attributes(
+            fom_parameter=parameter, fom_process=name))
+        cache[key] = attributes
+    return attributes
+
+
+def _find_path(cache, atp, name, parameter, attributes):
+    ''' First path of a process parameter matching the given attributes
+    values in a FOM (memoized)
+    '''
+    try:
+        key = ('path', atp, name, parameter,
+               tuple(sorted(six.iteritems(attributes))))
+        path_value = cache.get(key, _not_cached)
+    except TypeError:
+        # unhashable attributes values
+        key = None
+        path_value = _not_cached
+    if path_value is not _not_cached:
+        return path_value
+
+    d = dict(attributes)
+    d['fom_process'] = name
+    d['fom_parameter'] = parameter
+    d['fom_format'] = 'fom_preferred'
+    path_value = None
+    for h in atp.find_paths(d):
+        path_value = h[0]
+        # find_paths() is a generator which can sometimes generate
+        # several values (formats). We are only interested in the
+        # first one.
+        break
+
+    if key is not None:
+        cache[key] = path_value
+    return path_value
+
+
 class FomProcessCompletionEngine(ProcessCompletionEngine):
     """
     FOM (File Organization Model) implementation of completion engine.
@@ -334,63 +414,93 @@ class FomPathCompletionEngine(PathCompletionEngine):
         parameter: str
         attributes: ProcessAttributes instance (Controller)
         '''
-        input_fom = process.study_config.modules_data.foms['input']
-        output_fom = process.study_config.modules_data.foms['output']
-        input_atp = process.study_config.modules_data.fom_atp['input']
-        output_atp = process.study_config.modules_data.fom_atp['output']
+        modules_data = process.study_config.modules_data
+        cache = _fom_cache(process.study_config)
 
         #Create completion
         if process.trait(parameter).output:
-            atp = output_atp
-            fom = output_fom
+            atp = modules_data.fom_atp['output']
+            fom = modules_data.foms['output']
         else:
-            atp = input_atp
-            fom = input_fom
-        name = process.id
-        names_search_list = (process.id, process.name,
-                             getattr(process, 'context_name', ''))
-        for fname in names_search_list:
-            fom_patterns = fom.patterns.get(fname)
-            if fom_patterns is not None:
-                name = fname
-                break
-        else:
-            raise KeyError('Process not found in FOMs amongst %s' \
-                % repr(names_search_list))
+            atp = modules_data.fom_atp['input']
+            fom = modules_data.foms['input']
+        name = _fom_process_name(cache, fom, process)
 
         allowed_attributes = set(attributes.user_traits().keys())
         allowed_attributes.discard('parameter')
         allowed_attributes.discard('process_name')
-        #allowed_attributes = set(attributes.get_parameters_attributes()[
-            #parameter].keys())
-        #allowed_attributes.discard('type')
-        #allowed_attributes.discard('generated_by_parameter')
-        #allowed_attributes.discard('generated_by_process')
 
         # Select only the attributes that are discriminant for this
         # parameter otherwise other attibutes can prevent the appropriate
         # rule to match
-        parameter_attributes = atp.find_discriminant_attributes(
-            fom_parameter=parameter, fom_process=name)
+        parameter_attributes = _discriminant_attributes(cache, atp, name,
+                                                        parameter)
         d = dict((i, getattr(attributes, i)) \
             for i in parameter_attributes if i in allowed_attributes)
-        d['fom_process'] = name
-        d['fom_parameter'] = parameter
-        d['fom_format'] = 'fom_preferred'
-        path_value = None
-        #path_values = []
-        #debug = getattr(self, 'debug', None)
-        for h in atp.find_paths(d):  # , debug=debug):
-            path_value = h[0]
-            # find_paths() is a generator which can sometimes generate
-            # several values (formats). We are only interested in the
-            # first one.
-            #path_values.append(h[0])
-            break
+        return _find_path(cache, atp, name, parameter, d)
 
-        #if len(path_values) > 0:
-            #path_value = path_values[0]
-        return path_value
+
+    def attributes_to_paths(self, process, parameters, attributes,
+                            attributes_table):
+        ''' Build paths for several sets of attributes values (process
+        iterations for instance).
+
+        The FOM rules of each parameter are looked up once, and paths are
+        built directly from the table rows: the attributes controller is not
+        modified.
+
+        Parameters
+        ----------
+        process: Process instance
+        parameters: list of str
+        attributes: ProcessAttributes instance (Controller)
+            attributes of the process. Values missing in the table rows are
+            taken from it.
+        attributes_table: list of dict
+            attributes values, one dict per paths set
+
+        Returns
+        -------
+        paths: dict
+            {parameter: list of paths}
+        '''
+        modules_data = process.study_config.modules_data
+        cache = _fom_cache(process.study_config)
+
+        allowed_attributes = set(attributes.user_traits().keys())
+        allowed_attributes.discard('parameter')
+        allowed_attributes.discard('process_name')
+
+        paths = {}
+        for parameter in parameters:
+            values = [None] * len(attributes_table)
+            paths[parameter] = values
+            try:
+                if process.trait(parameter).output:
+                    atp = modules_data.fom_atp['output']
+                    fom = modules_data.foms['output']
+                else:
+                    atp = modules_data.fom_atp['input']
+                    fom = modules_data.foms['input']
+                name = _fom_process_name(cache, fom, process)
+                parameter_attributes = [
+                    i for i in _discriminant_attributes(cache, atp, name,
+                                                        parameter)
+                    if i in allowed_attributes]
+            except Exception:
+                # no FOM rule for this parameter
+                continue
+            defaults = dict((i, getattr(attributes, i))
+                            for i in parameter_attributes)
+            for index, row in enumerate(attributes_table):
+                d = dict((i, row.get(i, defaults[i]))
+                         for i in parameter_attributes)
+                try:
+                    values[index] = _find_path(cache, atp, name, parameter,
+                                               d)
+                except Exception:
+                    pass
+        return paths
 
 
     def open_values_attributes(self, process, parameter):
@@ -455,8 +565,9 @@ class FomProcessCompletionEngineIteration(ProcessCompletionEngineIteration):
             else:
                 atp = input_atp
             parameter_attributes = set([
-                x for x in atp.find_discriminant_attributes(
-                    fom_parameter=parameter, fom_process=name)
+                x for x in _discriminant_attributes(
+                    _fom_cache(subprocess.study_config), atp, name,
+                    parameter)
                 if not x.startswith('fom_')])
             iter_attrib.update(parameter_attributes)
         return iter_attrib
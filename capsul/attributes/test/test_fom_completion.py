@@ -0,0 +1,132 @@
+from __future__ import print_function
+
+import unittest
+
+from traits.api import File, Str
+from soma.controller import Controller
+import soma.fom
+
+from capsul.api import Process
+from capsul.pipeline.process_iteration import ProcessIteration
+from capsul.attributes.completion_engine import ProcessCompletionEngine
+from capsul.study_config.study_config import StudyConfig
+from capsul.attributes.fom_completion_engine import FomPathCompletionEngine
+
+
+class DummyProcess(Process):
+    input_image = File(output=False)
+    output_image = File(output=True)
+
+    def _run_process(self):
+        pass
+
+
+fom_definition = {
+    'fom_name': 'test_fom',
+    'attribute_definitions': {'subject': {'discriminant': True}},
+    'formats': {'NIFTI': 'nii'},
+    'format_lists': {},
+    'shared_patterns': {},
+    'processes': {
+        'DummyProcess': {
+            'input_image': [['input:<subject>/image', 'NIFTI']],
+            'output_image': [['output:<subject>/result', 'NIFTI']],
+        },
+    },
+}
+
+
+class TestFomCompletion(unittest.TestCase):
+
+    def setUp(self):
+        self.study_config = StudyConfig(
+            init_config={'use_fom': True, 'input_fom': '', 'output_fom': '',
+                         'shared_fom': ''},
+            modules=StudyConfig.default_modules
+            + ['BrainVISAConfig', 'FomConfig'])
+        fom = soma.fom.FileOrganizationModels()
+        fom.import_file(fom_definition)
+        atp = soma.fom.AttributesToPaths(
+            fom, selection={}, directories={'input': '/in', 'output': '/out'})
+        self.calls = []
+        find_paths = atp.find_paths
+
+        def counted_find_paths(*args, **kwargs):
+            self.calls.append(args)
+            return find_paths(*args, **kwargs)
+
+        atp.find_paths = counted_find_paths
+        modules_data = self.study_config.modules_data
+        modules_data.foms.update({'input': fom, 'output': fom})
+        modules_data.fom_atp.update({'input': atp, 'output': atp})
+        self.process = DummyProcess()
+        self.process.set_study_config(self.study_config)
+        self.attributes = Controller()
+        self.attributes.add_trait('subject', Str('s1'))
+        self.attributes.add_trait('center', Str('c1'))
+
+    def test_attributes_to_path(self):
+        engine = FomPathCompletionEngine()
+        for i in range(3):
+            self.assertEqual(
+                engine.attributes_to_path(self.process, 'output_image',
+                                          self.attributes),
+                '/out/s1/result.nii')
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(
+            engine.attributes_to_path(self.process, 'input_image',
+                                      self.attributes),
+            '/in/s1/image.nii')
+        # non-discriminant attributes do not change the path
+        self.attributes.center = 'c2'
+        engine.attributes_to_path(self.process, 'output_image',
+                                  self.attributes)
+        self.assertEqual(len(self.calls), 2)
+        self.attributes.subject = 's2'
+        self.assertEqual(
+            engine.attributes_to_path(self.process, 'output_image',
+                                      self.attributes),
+            '/out/s2/result.nii')
+        self.assertEqual(len(self.calls), 3)
+        # configuration changes clear the cache
+        self.study_config.output_directory = '/tmp'
+        engine.attributes_to_path(self.process, 'output_image',
+                                  self.attributes)
+        self.assertEqual(len(self.calls), 4)
+
+    def test_iteration(self):
+        iteration = ProcessIteration(
+            self.process, ['input_image', 'output_image'],
+            study_config=self.study_config)
+        engine = ProcessCompletionEngine.get_completion_engine(iteration)
+        output_image = iteration.process.output_image
+        attributes = engine.get_attribute_values()
+        attributes.subject = ['s1', 's2', 's3']
+        engine.complete_parameters()
+        self.assertEqual(iteration.input_image,
+                         ['/in/s1/image.nii', '/in/s2/image.nii',
+                          '/in/s3/image.nii'])
+        self.assertEqual(iteration.output_image,
+                         ['/out/s1/result.nii', '/out/s2/result.nii',
+                          '/out/s3/result.nii'])
+        self.assertEqual(len(self.calls), 6)
+        # paths are built without completing the iterated process
+        self.assertEqual(iteration.process.output_image, output_image)
+        # bulk completion of a table of attributes
+        paths = engine.get_iterations_parameters(
+            [{'subject': 's1'}, {'subject': 's4'}])
+        self.assertEqual(paths['output_image'],
+                         ['/out/s1/result.nii', '/out/s4/result.nii'])
+        self.assertEqual(len(self.calls), 8)
+
+
+def test():
+    """ Function to execute unitest
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFomCompletion)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("RETURNCODE: ", test())
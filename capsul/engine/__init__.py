@@ -22,7 +22,7 @@ import json
 import os.path as osp
 import re
 
-from traits.api import Undefined
+from traits.api import Undefined, Int
 
 from soma.controller import Controller
 from soma.serialization import to_json, from_json
@@ -53,6 +53,15 @@ class CapsulEngine(Controller):
     
     default_modules = ['capsul.engine.module.spm',
                        'capsul.engine.module.fsl']
+
+    max_local_executions = Int(
+        4,
+        desc='Maximum number of processes or pipelines executed at the same '
+             'time by the local execution backend.')
+    max_executions_history = Int(
+        100,
+        desc='Maximum number of executions records kept in the database by '
+             'the local execution backend.')
         
     def __init__(self, 
                  database_location,
@@ -64,6 +73,8 @@ class CapsulEngine(Controller):
         '''
         super(CapsulEngine, self).__init__()
         
+        self._local_backend = None
+        self._runtime_history = None
         self._database_location = database_location
         self._database = database
 
@@ -109,6 +120,19 @@ class CapsulEngine(Controller):
     def execution_context(self):
         return self._execution_context
 
+    @property
+    def runtime_history(self):
+        '''
+        History of processes executions durations and resources usage
+        (a :py:class:`capsul.engine.runtime_history.RuntimeHistory`), stored
+        in the database. Executions are recorded by StudyConfig.run() when
+        study_config.record_runtime_history is set.
+        '''
+        if self._runtime_history is None:
+            from .runtime_history import RuntimeHistory
+            self._runtime_history = RuntimeHistory(self.database)
+        return self._runtime_history
+
     @execution_context.setter
     def execution_context(self, execution_context):
         self._execution_context = execution_context
@@ -285,59 +309,110 @@ class CapsulEngine(Controller):
                                                           **kwargs)
         return instance
 
-    def start(self, process, history=True):
+    @property
+    def execution_backend(self):
+        '''
+        Backend used to execute processes: the processing engine if one is
+        defined, otherwise a
+        :py:class:`capsul.engine.local_execution.LocalExecutionBackend`
+        created on first use.
+        '''
+        if self._processing_engine is not None:
+            return self._processing_engine
+        if self._local_backend is None:
+            from .local_execution import LocalExecutionBackend
+            self._local_backend = LocalExecutionBackend(
+                self, max_executions=self.max_local_executions,
+                max_history=self.max_executions_history)
+        return self._local_backend
+
+    def start(self, process, history=True, **kwargs):
         '''
         Asynchronously start the exection of a process in the environment
         defined by self.processing_engine. Returns a string that is an uuid
         of the process execution and can be used to get the status of the 
-        execution or wait for its termination.
+        execution or wait for its termination. kwargs are parameters values
+        set on the process before its execution.
         
         if history is True, an entry of the process execution is stored in
-        the database. The content of this entry is to be defined but it will
-        contain the process parameters (to restart the process) and will be 
-        updated on process termination (for instance to store execution time
-        if possible).
+        the database (in the 'executions' JSON value). It contains the
+        process identifier, its parameters, the execution status and the
+        submission, start and end times. It is updated on process
+        termination.
         '''
-        raise NotImplementedError()
+        return self.execution_backend.start(process, history=history,
+                                            **kwargs)
 
     def executions(self):
-        raise NotImplementedError()
+        '''
+        Return the list of executions uuids (executions stored in the
+        database history and executions started in this engine).
+        '''
+        return self.execution_backend.executions()
 
     def interrupt(self, execution_id):
         '''
         Try to stop the execution of a process. Does not wait for the process
-        to be terminated.
+        to be terminated. Processes which are already running are not
+        cancelled: only the nodes of a pipeline which are not started yet
+        are skipped.
         '''
-        raise NotImplementedError()
+        return self.execution_backend.interrupt(execution_id)
     
-    def wait(self, execution_id):
+    def wait(self, execution_id, timeout=None):
         '''
         Wait for the end of a process execution (either normal termination,
-        interruption or error).
+        interruption or error) and return its status. If timeout (in
+        seconds) is given and reached, the current status is returned.
         '''
-        raise NotImplementedError()
+        return self.execution_backend.wait(execution_id, timeout=timeout)
     
     def status(self, execution_id):
         '''
-        Return information about a process execution. The content of this
-        information is still to be defined.
+        Return the status of a process execution: 'not_started', 'running',
+        'done', 'failed' or 'interrupted'.
         '''
-        raise NotImplementedError()
+        return self.execution_backend.status(execution_id)
 
     def detailed_information(self, execution_id):
-        raise NotImplementedError()
+        '''
+        Return a dictionary of information about a process execution:
+        'process', 'parameters', 'status', 'submission_time', 'start_time',
+        'end_time', 'error' and 'traceback'.
+        '''
+        return self.execution_backend.detailed_information(execution_id)
     
-    def call(self, process, history=True):
-        eid = self.start(process, history)
+    def run_async(self, process, **kwargs):
+        '''
+        Execute a process or a pipeline in the current asyncio event loop
+        (Python 3 only)::
+
+            await engine.run_async(pipeline)
+
+        See :meth:`capsul.study_config.study_config.StudyConfig.run_async`.
+        '''
+        return self.study_config.run_async(process, **kwargs)
+
+    def call(self, process, history=True, **kwargs):
+        eid = self.start(process, history, **kwargs)
         return self.wait(eid)
     
-    def check_call(self, process, history=True):
-        eid = self.start(process, history)
+    def check_call(self, process, history=True, **kwargs):
+        eid = self.start(process, history, **kwargs)
         status = self.wait(eid)
         self.raise_for_status(status, eid)
 
     def raise_for_status(self, status, execution_id=None):
-        raise NotImplementedError()
+        '''
+        Raise an ExecutionError if status is not the status of a normally
+        terminated execution.
+        '''
+        if status != 'done':
+            from .local_execution import ExecutionError
+            information = None
+            if execution_id is not None:
+                information = self.detailed_information(execution_id)
+            raise ExecutionError(execution_id, status, information)
         
     
 _populsedb_url_re = re.compile(r'^\w+(\+\w+)?://(.*)')
@@ -382,11 +457,13 @@ def database_factory(database_location):
             engine = PopulseDBEngine(populse_db)
         except ImportError:
             # database is not available, fallback to json
-            if database_location != ':memory':
+            if database_location == ':memory:':
+                engine = JSONDBEngine(None)
+            else:
                 engine_directory = osp.abspath(osp.dirname(database_location))
                 if database_location.endswith('.sqlite'):
                     database_location = database_location[:-6] + 'json'
-            engine = JSONDBEngine(database_location)
+                engine = JSONDBEngine(database_location)
     if engine_directory:
         engine.set_named_directory('capsul_engine', engine_directory)
     return engine
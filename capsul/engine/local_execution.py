@@ -0,0 +1,278 @@
+'''
+Asynchronous execution of processes and pipelines on the local machine.
+
+Classes
+=======
+:class:`ExecutionError`
+-----------------------
+:class:`LocalExecutionBackend`
+------------------------------
+'''
+
+from __future__ import print_function
+
+import logging
+import threading
+import time
+import traceback
+import uuid
+
+import six
+try:
+    import concurrent.futures as futures
+except ImportError:
+    # python 2 without the "futures" backport
+    futures = None
+
+from capsul.study_config.run import ExecutionInterrupted
+from .runtime_history import _json_parameters
+
+logger = logging.getLogger(__name__)
+
+# execution status values
+NOT_STARTED = 'not_started'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+INTERRUPTED = 'interrupted'
+FINAL_STATUS = (DONE, FAILED, INTERRUPTED)
+
+
+class ExecutionError(Exception):
+    '''
+    Error raised by CapsulEngine.raise_for_status() when an execution did
+    not terminate normally.
+
+    Attributes
+    ----------
+    execution_id: str
+        uuid of the execution
+    status: str
+        final status of the execution ('failed' or 'interrupted')
+    information: dict
+        detailed information about the execution (see
+        CapsulEngine.detailed_information())
+    '''
+    def __init__(self, execution_id, status, information=None):
+        message = 'Execution %s %s' % (execution_id, status)
+        if information and information.get('error'):
+            message += ': %s' % information['error']
+        super(ExecutionError, self).__init__(message)
+        self.execution_id = execution_id
+        self.status = status
+        self.information = information
+
+
+class LocalExecutionBackend(object):
+    '''
+    Execute processes in a pool of threads of the current Python process,
+    using StudyConfig.run(). Each execution is identified by an uuid. When
+    history is requested, an execution record is stored in the engine
+    database under the 'executions' JSON value (a dict whose keys are the
+    executions uuids) and updated when the execution status changes. Only
+    the records of the max_history last submitted executions are kept
+    (running ones are never removed).
+
+    The execution context of the engine is activated while at least one
+    execution is running.
+
+    Parameters
+    ----------
+    engine: CapsulEngine (mandatory)
+        the engine used to run processes and to store executions history
+    max_executions: int (optional)
+        maximum number of executions running at the same time. Other
+        submitted executions wait for a free slot.
+    max_history: int (optional)
+        maximum number of executions records kept in the database
+    '''
+
+    def __init__(self, engine, max_executions=4, max_history=100):
+        self.engine = engine
+        self.max_executions = max_executions
+        self.max_history = max_history
+        self._pool = None
+        self._lock = threading.RLock()
+        # {execution_id: record}, for executions started by this backend
+        self._executions = {}
+        self._futures = {}
+        self._stop_events = {}
+        self._history = set()
+        self._running_count = 0
+
+    def _get_pool(self):
+        if self._pool is None:
+            if futures is None:
+                raise RuntimeError('asynchronous executions need the '
+                                   'concurrent.futures module')
+            self._pool = futures.ThreadPoolExecutor(
+                max_workers=self.max_executions)
+        return self._pool
+
+    def _update(self, execution_id, **values):
+        with self._lock:
+            record = self._executions[execution_id]
+            record.update(values)
+            if execution_id in self._history:
+                database = self.engine.database
+                executions = database.json_value('executions') or {}
+                executions[execution_id] = dict(record)
+                if len(executions) > self.max_history:
+                    # forget the oldest terminated executions
+                    terminated = sorted(
+                        (item['submission_time'], eid)
+                        for eid, item in six.iteritems(executions)
+                        if item['status'] in FINAL_STATUS)
+                    for eid in terminated[:len(executions)
+                                          - self.max_history]:
+                        del executions[eid[1]]
+                database.set_json_value('executions', executions)
+                database.commit()
+
+    def start(self, process, history=True, **kwargs):
+        '''
+        Submit the execution of a process or pipeline and return its uuid
+        immediately. kwargs are parameters values set on the process before
+        it is run.
+        '''
+        execution_id = str(uuid.uuid4())
+        for name, value in six.iteritems(kwargs):
+            setattr(process, name, value)
+        record = {
+            'execution_id': execution_id,
+            'process': process.id,
+            'parameters': _json_parameters(process),
+            'status': NOT_STARTED,
+            'submission_time': time.time(),
+            'start_time': None,
+            'end_time': None,
+            'error': None,
+            'traceback': None,
+        }
+        with self._lock:
+            self._executions[execution_id] = record
+            self._stop_events[execution_id] = threading.Event()
+            if history:
+                self._history.add(execution_id)
+            self._update(execution_id)
+            self._futures[execution_id] = self._get_pool().submit(
+                self._run, execution_id, process)
+        return execution_id
+
+    def _run(self, execution_id, process):
+        stop_event = self._stop_events[execution_id]
+        if stop_event.is_set():
+            self._update(execution_id, status=INTERRUPTED,
+                         end_time=time.time())
+            with self._lock:
+                self._stop_events.pop(execution_id, None)
+            return INTERRUPTED
+        self._update(execution_id, status=RUNNING, start_time=time.time())
+        with self._lock:
+            if self._running_count == 0:
+                self.engine.execution_context.__enter__()
+            self._running_count += 1
+        try:
+            self.engine.study_config.run(process, stop_event=stop_event)
+            status = DONE
+            error = None
+            trace = None
+        except ExecutionInterrupted as e:
+            status = INTERRUPTED
+            error = str(e)
+            trace = None
+        except Exception as e:
+            logger.debug('execution %s failed', execution_id, exc_info=True)
+            status = FAILED
+            error = '%s: %s' % (e.__class__.__name__, e)
+            trace = traceback.format_exc()
+        finally:
+            with self._lock:
+                self._running_count -= 1
+                if self._running_count == 0:
+                    self.engine.execution_context.__exit__(None, None, None)
+        self._update(execution_id, status=status, end_time=time.time(),
+                     error=error, traceback=trace)
+        with self._lock:
+            self._stop_events.pop(execution_id, None)
+        return status
+
+    def executions(self):
+        '''
+        List the uuids of executions: the ones stored in the database
+        history, then the ones started without history.
+        '''
+        with self._lock:
+            result = list(self.engine.database.json_value('executions') or {})
+            result.extend(execution_id for execution_id in self._executions
+                          if execution_id not in self._history)
+        return result
+
+    def interrupt(self, execution_id):
+        '''
+        Request the interruption of an execution. A waiting execution is not
+        started, a running pipeline does not start new nodes. Does not wait
+        for the execution to be stopped.
+
+        Processes which are already running cannot be cancelled: they run
+        until their end (a running pipeline stops once its running nodes are
+        done).
+
+        Raises ValueError if the execution is unknown or terminated.
+        '''
+        with self._lock:
+            stop_event = self._stop_events.get(execution_id)
+            if stop_event is None:
+                raise ValueError('Unknown or terminated execution: %s'
+                                 % execution_id)
+            stop_event.set()
+            future = self._futures[execution_id]
+            if future.cancel():
+                self._update(execution_id, status=INTERRUPTED,
+                             end_time=time.time())
+                del self._stop_events[execution_id]
+
+    def wait(self, execution_id, timeout=None):
+        '''
+        Wait for the end of an execution and return its status. If timeout
+        (in seconds) is reached, the current status is returned.
+        '''
+        future = self._futures.get(execution_id)
+        if future is not None:
+            futures.wait([future], timeout=timeout)
+        return self.status(execution_id)
+
+    def detailed_information(self, execution_id):
+        '''
+        Return the execution record (dict): process, parameters, status,
+        submission/start/end times, error and traceback.
+        '''
+        with self._lock:
+            record = self._executions.get(execution_id)
+            if record is None:
+                record = (self.engine.database.json_value('executions')
+                          or {}).get(execution_id)
+                if record is None:
+                    raise ValueError('Unknown execution: %s' % execution_id)
+            return dict(record)
+
+    def status(self, execution_id):
+        '''
+        Return the status of an execution: 'not_started', 'running', 'done',
+        'failed' or 'interrupted'.
+        '''
+        return self.detailed_information(execution_id)['status']
+
+    def shutdown(self, wait=True):
+        '''
+        Stop the threads pool. Executions which are not started are
+        interrupted.
+        '''
+        with self._lock:
+            for execution_id in list(self._stop_events):
+                if self._executions[execution_id]['status'] == NOT_STARTED:
+                    self.interrupt(execution_id)
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=wait)
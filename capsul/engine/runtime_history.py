@@ -0,0 +1,643 @@
+'''
+History of processes executions durations and resources usage, stored in
+the database of a :py:class:`~capsul.engine.CapsulEngine`.
+
+Classes
+=======
+:class:`ResourceMonitor`
+------------------------
+:class:`RuntimeHistory`
+-----------------------
+:class:`ResourceRequests`
+-------------------------
+
+Functions
+=========
+:func:`parameters_hash`
+-----------------------
+:func:`parse_resource_usage`
+----------------------------
+'''
+
+from __future__ import print_function
+
+import hashlib
+import json
+import math
+import sys
+import threading
+import time
+
+import six
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+from traits.api import Undefined
+
+# status of recorded executions
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _json_parameters(process):
+    '''
+    Return process parameters values as a JSON compatible dict. Values which
+    cannot be serialized are stored as their repr().
+    '''
+    parameters = {}
+    for name, value in six.iteritems(process.export_to_dict(
+            exclude_undefined=True)):
+        if value is Undefined:
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            value = repr(value)
+        parameters[name] = value
+    return parameters
+
+
+def parameters_hash(process):
+    '''
+    Return a hash (hexadecimal string) of the parameters values of a
+    process, used to identify executions of a process on the same data.
+    '''
+    parameters = json.dumps(_json_parameters(process), sort_keys=True)
+    return hashlib.sha1(parameters.encode('utf-8')).hexdigest()
+
+
+def _rusage(who):
+    usage = resource.getrusage(who)
+    # ru_maxrss is in kilobytes, except on MacOS
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+    return (usage.ru_utime + usage.ru_stime, usage.ru_maxrss * rss_unit,
+            usage.ru_inblock * 512, usage.ru_oublock * 512)
+
+
+class ResourceMonitor(object):
+    '''
+    Context manager measuring the resources used by the code it runs. When
+    it exits, its ``measures`` attribute is a dict with the following items:
+
+    - start_time: time of the start of the execution (seconds since epoch)
+    - wall_time: elapsed time, in seconds
+    - cpu_time: user + system CPU time of the current thread (when the
+      system allows it, otherwise of the current process) and of the
+      terminated child processes, in seconds
+    - peak_rss: highest resident memory size of the child processes
+      terminated during the execution, in bytes. The system only gives a
+      high-water mark of all the terminated children, so it is None when
+      the execution does not raise it, and for code running in the current
+      process, whose high-water mark includes the memory used before.
+    - io_read_bytes, io_write_bytes: bytes read from and written to storage
+      devices by the current thread (or process) and child processes
+
+    Values which cannot be measured on the system are None. Child processes
+    of other threads running at the same time are also accounted.
+    '''
+
+    def __init__(self):
+        self.measures = None
+
+    @staticmethod
+    def _usage():
+        if resource is None:
+            cpu = (getattr(time, 'process_time', None) or time.clock)()
+            return (cpu, None, None, None)
+        self_usage = _rusage(getattr(resource, 'RUSAGE_THREAD',
+                                     resource.RUSAGE_SELF))
+        children_usage = _rusage(resource.RUSAGE_CHILDREN)
+        return (self_usage[0] + children_usage[0],
+                children_usage[1],
+                self_usage[2] + children_usage[2],
+                self_usage[3] + children_usage[3])
+
+    def __enter__(self):
+        self._start = self._usage()
+        self._start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time = time.time() - self._start_time
+        end = self._usage()
+        start = self._start
+        if end[1] is None or end[1] <= start[1]:
+            peak_rss = None
+        else:
+            peak_rss = end[1]
+        self.measures = {
+            'start_time': self._start_time,
+            'wall_time': wall_time,
+            'cpu_time': end[0] - start[0],
+            'peak_rss': peak_rss,
+            'io_read_bytes': None if end[2] is None else end[2] - start[2],
+            'io_write_bytes': None if end[3] is None else end[3] - start[3],
+        }
+        return False
+
+
+class RuntimeHistory(object):
+    '''
+    Records of processes executions, stored in a CapsulEngine database under
+    the 'runtime_history' JSON value. Records are grouped by process
+    identifier and by hash of the process parameters (see
+    :func:`parameters_hash`). Each record is a dict with the measures of a
+    :class:`ResourceMonitor` and the following items:
+
+    - status: 'done' or 'failed'
+    - error: error message of failed executions
+    - exit_value: exit code of soma-workflow jobs
+    - iterations: number of iterations run by the execution, when it runs
+      several iterations of the process at once (measures are then divided
+      by this number)
+
+    Records are kept in memory and written to the database by
+    :meth:`save`. Only the last max_records records of each process and
+    parameters are kept.
+
+    The recorded durations may be used to estimate the cost of jobs in
+    workflows::
+
+        history = engine.runtime_history
+        workflow = workflow_from_pipeline(
+            pipeline, critical_path_priorities=True,
+            process_costs=history.estimated_duration)
+
+    Parameters
+    ----------
+    database: DatabaseEngine (mandatory)
+        the engine database
+    max_records: int (optional)
+        maximum number of records kept for each process and parameters
+    '''
+
+    json_value_name = 'runtime_history'
+
+    def __init__(self, database, max_records=20):
+        self.database = database
+        self.max_records = max_records
+        self._lock = threading.RLock()
+        self._history = None
+        self._modified = False
+
+    def _get_history(self):
+        if self._history is None:
+            self._history = self.database.json_value(self.json_value_name) \
+                or {}
+        return self._history
+
+    def add_record(self, process_id, parameters_hash, record):
+        '''
+        Add an execution record of a process.
+        '''
+        with self._lock:
+            records = self._get_history().setdefault(
+                process_id, {}).setdefault(parameters_hash or '', [])
+            records.append(record)
+            del records[:-self.max_records]
+            self._modified = True
+
+    def record(self, process, measures, status=DONE, error=None,
+               iterations=1, parameters=None):
+        '''
+        Record the execution of a process.
+
+        Parameters
+        ----------
+        process: Process (mandatory)
+            the executed process
+        measures: dict (mandatory)
+            measures of a :class:`ResourceMonitor`
+        status: str (optional)
+            'done' or 'failed'
+        error: str (optional)
+            error message
+        iterations: int (optional)
+            number of iterations run by the execution: measures are
+            divided by this number and recorded for each of the iterations
+        parameters: list of str (optional)
+            hashes of the parameters of each iteration, defaults to the
+            hash of the current process parameters.
+        '''
+        record = dict(measures)
+        record['status'] = status
+        record['error'] = error
+        if iterations > 1:
+            for name in ('wall_time', 'cpu_time', 'io_read_bytes',
+                         'io_write_bytes'):
+                if record.get(name) is not None:
+                    record[name] = record[name] / float(iterations)
+            record['iterations'] = iterations
+        if parameters is None:
+            parameters = [parameters_hash(process)] * iterations
+        for phash in parameters:
+            self.add_record(process.id, phash, record)
+
+    def record_workflow(self, controller, workflow_id, workflow,
+                        job_processes):
+        '''
+        Record the executions of the jobs of a soma-workflow workflow, once
+        it is finished. Durations and exit status are given by
+        soma-workflow. CPU time and peak memory are taken from the resource
+        usage reported by the computing resource scheduler, when it reports
+        them (see :func:`parse_resource_usage`), I/O are unknown.
+
+        Parameters
+        ----------
+        controller: WorkflowController (mandatory)
+            the controller the workflow has been submitted to
+        workflow_id: int (mandatory)
+            the submitted workflow identifier
+        workflow: Workflow (mandatory)
+            the submitted workflow
+        job_processes: dict (mandatory)
+            {job: (process id, parameters hash, iterations)}, as filled by
+            :func:`~capsul.pipeline.pipeline_workflow.workflow_from_pipeline`
+        '''
+        engine_workflow = controller.workflow(workflow_id)
+        # submitted jobs are in the same order as the client ones
+        job_ids = {}
+        for job, engine_job in zip(workflow.jobs, engine_workflow.jobs):
+            if job in job_processes:
+                job_ids[engine_workflow.job_mapping[engine_job].job_id] = job
+        elements_status = controller.workflow_elements_status(workflow_id)
+        for job_status in elements_status[0]:
+            job = job_ids.get(job_status[0])
+            if job is None:
+                continue
+            exit_info = job_status[3]
+            start_time, end_time = job_status[4][1:3]
+            if exit_info is None or start_time is None or end_time is None:
+                # not run
+                continue
+            process_id, phash, iterations = job_processes[job]
+            exit_status, exit_value, signal, resource_usage = exit_info[:4]
+            record = {
+                'start_time': time.mktime(start_time.timetuple()),
+                'wall_time': (end_time - start_time).total_seconds(),
+                'cpu_time': None,
+                'peak_rss': None,
+                'io_read_bytes': None,
+                'io_write_bytes': None,
+                'exit_value': exit_value,
+            }
+            if resource_usage:
+                usage = parse_resource_usage(resource_usage)
+                record['resource_usage'] = usage.pop('resource_usage')
+                record.update(usage)
+            if exit_status == 'finished_regularly' and exit_value == 0:
+                record['status'] = DONE
+                record['error'] = None
+            else:
+                record['status'] = FAILED
+                record['error'] = '%s (exit value: %s, signal: %s)' \
+                    % (exit_status, exit_value, signal)
+            if iterations > 1:
+                record['wall_time'] /= float(iterations)
+                if record['cpu_time'] is not None:
+                    record['cpu_time'] /= float(iterations)
+                record['iterations'] = iterations
+            self.add_record(process_id, phash, record)
+
+    def save(self):
+        '''
+        Write the records to the database and commit it.
+        '''
+        with self._lock:
+            if self._modified:
+                self.database.set_json_value(self.json_value_name,
+                                             self._get_history())
+                self.database.commit()
+                self._modified = False
+
+    def clear(self, process_id=None):
+        '''
+        Remove the records of a process, or all records.
+        '''
+        with self._lock:
+            if process_id is None:
+                self._history = {}
+            else:
+                self._get_history().pop(process_id, None)
+            self._modified = True
+
+    def records(self, process_id=None, parameters_hash=None, status=None):
+        '''
+        Return the list of records (dicts) of the given process (or all
+        processes), parameters hash and status. Each returned record also
+        contains its process_id and parameters_hash.
+        '''
+        result = []
+        with self._lock:
+            history = self._get_history()
+            if process_id is None:
+                process_ids = sorted(history)
+            else:
+                process_ids = [process_id]
+            for pid in process_ids:
+                for phash, records in six.iteritems(history.get(pid, {})):
+                    if parameters_hash is not None \
+                            and phash != parameters_hash:
+                        continue
+                    for record in records:
+                        if status is not None \
+                                and record['status'] != status:
+                            continue
+                        record = dict(record)
+                        record['process_id'] = pid
+                        record['parameters_hash'] = phash
+                        result.append(record)
+        result.sort(key=lambda record: record['start_time'])
+        return result
+
+    def statistics(self, process_id, parameters_hash=None):
+        '''
+        Summarize the records of a process (and parameters hash). Returns a
+        dict with the number of executions (count) and of failures (failed),
+        the mean, median and maximum wall times, the mean CPU time and the
+        maximum peak memory of successful executions (None when unknown).
+        '''
+        records = self.records(process_id, parameters_hash)
+        done = [record for record in records if record['status'] == DONE]
+
+        def values(name):
+            return sorted(record[name] for record in done
+                          if record.get(name) is not None)
+
+        wall_times = values('wall_time')
+        cpu_times = values('cpu_time')
+        peak_rss = values('peak_rss')
+        return {
+            'count': len(records),
+            'failed': len(records) - len(done),
+            'mean_wall_time': (sum(wall_times) / len(wall_times)
+                               if wall_times else None),
+            'median_wall_time': _median(wall_times),
+            'max_wall_time': wall_times[-1] if wall_times else None,
+            'mean_cpu_time': (sum(cpu_times) / len(cpu_times)
+                              if cpu_times else None),
+            'max_peak_rss': peak_rss[-1] if peak_rss else None,
+        }
+
+    def estimated_duration(self, process, default=None):
+        '''
+        Estimate the duration of a process execution: the median duration of
+        its successful executions with the same parameters, or of all its
+        successful executions if it has never run with these parameters.
+
+        Parameters
+        ----------
+        process: Process or str (mandatory)
+            process instance, or process identifier
+        default: float (optional)
+            value returned if the process has no recorded execution
+        '''
+        if isinstance(process, six.string_types):
+            process_id = process
+            phash = None
+        else:
+            process_id = process.id
+            phash = parameters_hash(process)
+        with self._lock:
+            history = self._get_history().get(process_id)
+            if not history:
+                return default
+            if phash is not None and phash in history:
+                groups = [history[phash]]
+            else:
+                groups = list(six.itervalues(history))
+            wall_times = sorted(record['wall_time'] for records in groups
+                                for record in records
+                                if record['status'] == DONE
+                                and record.get('wall_time') is not None)
+        duration = _median(wall_times)
+        if duration is None and phash is not None:
+            return self.estimated_duration(process_id, default)
+        if duration is None:
+            return default
+        return duration
+
+
+class ResourceRequests(object):
+    '''
+    Computing resources requests of soma-workflow jobs (native
+    specification of the cluster scheduler) derived from the recorded
+    executions of their processes, so that jobs request the walltime and
+    memory they actually need::
+
+        requests = ResourceRequests(engine.runtime_history, scheduler='slurm',
+                                    defaults={'wall_time': 3600})
+        workflow = workflow_from_pipeline(pipeline, resource_requests=requests)
+
+    For each process, the requested wall time, peak memory and number of
+    CPUs (CPU time / wall time) are a percentile of the values of its
+    successful executions with the same parameters (or of all its
+    successful executions if it has never run with these parameters),
+    multiplied by a safety margin. Peak memory is known for jobs run on a
+    cluster whose scheduler reports it (see
+    :meth:`RuntimeHistory.record_workflow`) and for local executions of
+    command line processes (see :class:`ResourceMonitor`). Values which have
+    not been recorded are taken from the defaults. Processes which have a ``native_specification``
+    attribute keep it.
+
+    Parameters
+    ----------
+    history: RuntimeHistory (mandatory)
+        the runtime history
+    scheduler: str (optional)
+        'slurm' or 'pbs', formats of the native specification
+    percentile: float (optional)
+        percentile (between 0 and 100) of the recorded values
+    margin: float (optional)
+        factor applied to the recorded values
+    min_wall_time: float (optional)
+        minimum requested wall time, in seconds
+    defaults: dict (optional)
+        requests used when no execution has been recorded: wall_time (in
+        seconds), memory (in bytes), cpus
+    '''
+
+    # scheduler: (prefix, separator, formats)
+    schedulers = {
+        'slurm': ('', ' ', (('wall_time', '--time=%s'),
+                            ('memory', '--mem=%dM'),
+                            ('cpus', '--cpus-per-task=%d'))),
+        'pbs': ('-l ', ',', (('wall_time', 'walltime=%s'),
+                             ('memory', 'mem=%dmb'),
+                             ('cpus', 'ncpus=%d'))),
+    }
+
+    def __init__(self, history, scheduler='slurm', percentile=90.,
+                 margin=1.5, min_wall_time=60., defaults=None):
+        if scheduler not in self.schedulers:
+            raise ValueError('unknown scheduler: %s' % scheduler)
+        self.history = history
+        self.scheduler = scheduler
+        self.percentile = percentile
+        self.margin = margin
+        self.min_wall_time = min_wall_time
+        self.defaults = dict(defaults or {})
+
+    def requests(self, process, iterations=1):
+        '''
+        Resources requests of a job running the given process: a dict with
+        wall_time (in seconds), memory (in bytes) and cpus items, some of
+        which may be missing if they are unknown. Durations are multiplied
+        by the number of iterations run by the job.
+        '''
+        done = self.history.records(process.id, status=DONE)
+        if iterations == 1:
+            phash = parameters_hash(process)
+            same_parameters = [record for record in done
+                               if record['parameters_hash'] == phash]
+            if same_parameters:
+                done = same_parameters
+
+        def value(name):
+            return _percentile(sorted(record[name] for record in done
+                                      if record.get(name) is not None),
+                               self.percentile)
+
+        requests = dict(self.defaults)
+        wall_time = value('wall_time')
+        if wall_time is not None:
+            requests['wall_time'] = max(wall_time * self.margin * iterations,
+                                        self.min_wall_time)
+        memory = value('peak_rss')
+        if memory is not None:
+            requests['memory'] = memory * self.margin
+        cpus = _percentile(
+            sorted(record['cpu_time'] / record['wall_time']
+                   for record in done
+                   if record.get('cpu_time') is not None
+                   and record.get('wall_time')),
+            self.percentile)
+        if cpus is not None:
+            requests['cpus'] = max(1, int(math.ceil(cpus - 0.1)))
+        return requests
+
+    def native_specification(self, process, iterations=1):
+        '''
+        Native specification of a job running the given process, or None
+        if no resources request is known.
+        '''
+        requests = self.requests(process, iterations)
+        prefix, separator, formats = self.schedulers[self.scheduler]
+        items = []
+        for name, format in formats:
+            value = requests.get(name)
+            if value is None:
+                continue
+            if name == 'wall_time':
+                value = int(math.ceil(value))
+                value = '%d:%02d:%02d' % (value // 3600, value // 60 % 60,
+                                          value % 60)
+            elif name == 'memory':
+                value = int(math.ceil(value / 1048576.))
+            items.append(format % value)
+        if not items:
+            return None
+        return prefix + separator.join(items)
+
+    __call__ = native_specification
+
+
+def parse_resource_usage(resource_usage):
+    '''
+    Parse the resource usage of a job reported by soma-workflow: a string of
+    space separated "name=value" items, whose names and formats depend on the
+    scheduler (slurm, PBS, DRMAA implementations...).
+
+    Returns a dict with cpu_time (in seconds) and peak_rss (in bytes) items,
+    None when they are not reported, and a resource_usage item with all the
+    reported values, as strings. CPU time is read from the cput, cpu_time or
+    cpu items, as seconds or [days-]hours:minutes:seconds. Peak memory is read
+    from the maxrss, ru_maxrss or mem items, in kilobytes unless they have a
+    unit suffix (K, M, G, T, with an optional B).
+    '''
+    if isinstance(resource_usage, bytes):
+        resource_usage = resource_usage.decode('utf-8', 'replace')
+    if isinstance(resource_usage, six.string_types):
+        resource_usage = resource_usage.split()
+    usage = dict(item.split('=', 1) for item in resource_usage
+                 if '=' in item)
+    cpu_time = None
+    for name in ('cput', 'cpu_time', 'cpu'):
+        if name in usage:
+            cpu_time = _parse_duration(usage[name])
+            if cpu_time is not None:
+                break
+    peak_rss = None
+    for name in ('maxrss', 'ru_maxrss', 'mem'):
+        if name in usage:
+            peak_rss = _parse_memory(usage[name])
+            if peak_rss is not None:
+                break
+    return {'cpu_time': cpu_time, 'peak_rss': peak_rss,
+            'resource_usage': usage}
+
+
+def _parse_duration(value):
+    ''' Seconds of a "[days-][[hours:]minutes:]seconds" duration, None if
+    it cannot be parsed
+    '''
+    days = 0
+    if '-' in value:
+        days, value = value.split('-', 1)
+    try:
+        seconds = 0.
+        for item in value.split(':'):
+            seconds = seconds * 60 + float(item)
+        return int(days) * 86400 + seconds
+    except ValueError:
+        return None
+
+
+_memory_units = {'': 1024, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3,
+                 't': 1024 ** 4}
+
+
+def _parse_memory(value):
+    ''' Bytes of a memory size in kilobytes or with a unit suffix, None if
+    it cannot be parsed
+    '''
+    value = value.strip().lower()
+    if value.endswith('b'):
+        value = value[:-1]
+    unit = ''
+    if value[-1:] in _memory_units:
+        unit = value[-1]
+        value = value[:-1]
+    try:
+        return int(float(value) * _memory_units[unit])
+    except ValueError:
+        return None
+
+
+def _percentile(values, percentile):
+    ''' Percentile (linear interpolation) of a sorted list, None if it is
+    empty
+    '''
+    if not values:
+        return None
+    position = (len(values) - 1) * percentile / 100.
+    index = int(position)
+    if index + 1 >= len(values):
+        return values[-1]
+    return values[index] + (values[index + 1] - values[index]) \
+        * (position - index)
+
+
+def _median(values):
+    ''' Median of a sorted list, None if it is empty
+    '''
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.
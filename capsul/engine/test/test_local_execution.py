@@ -0,0 +1,135 @@
+from __future__ import print_function
+
+import unittest
+import tempfile
+import threading
+import time
+import os
+
+from traits.api import Float, Bool
+
+from capsul.api import Process, Pipeline, capsul_engine
+from capsul.engine.local_execution import ExecutionError
+
+
+class Sleep(Process):
+    ''' Wait until its event is set or its delay is over.
+    '''
+    a = Float(output=False)
+    fail = Bool(False, output=False, optional=True)
+    b = Float(output=True)
+
+    def _run_process(self):
+        Sleep.event.wait(self.a)
+        if self.fail:
+            raise RuntimeError('failure requested')
+        self.b = self.a
+
+
+class SleepPipeline(Pipeline):
+    ''' Chain of two Sleep processes.
+    '''
+    def pipeline_definition(self):
+        self.add_process('sleep1', Sleep)
+        self.add_process('sleep2', Sleep)
+        self.add_link('sleep1.b->sleep2.a')
+        self.export_parameter('sleep1', 'a')
+        self.export_parameter('sleep2', 'b')
+
+
+class TestLocalExecution(unittest.TestCase):
+
+    def setUp(self):
+        Sleep.event = threading.Event()
+        self.database = tempfile.mktemp(suffix='.json')
+        self.engine = capsul_engine(self.database)
+        self.engine.study_config.use_soma_workflow = False
+
+    def tearDown(self):
+        Sleep.event.set()
+        self.engine.execution_backend.shutdown()
+        del self.engine
+        if os.path.exists(self.database):
+            os.remove(self.database)
+
+    def test_start_wait(self):
+        processes = [self.engine.get_process_instance(Sleep)
+                     for i in range(3)]
+        t0 = time.time()
+        eids = [self.engine.start(process, a=0.3) for process in processes]
+        # start returns immediately
+        self.assertTrue(time.time() - t0 < 0.2)
+        self.assertEqual(len(set(eids)), 3)
+        for eid in eids:
+            self.assertEqual(self.engine.wait(eid), 'done')
+        # executions run concurrently
+        self.assertTrue(time.time() - t0 < 0.8)
+        self.assertEqual(processes[0].b, 0.3)
+        info = self.engine.detailed_information(eids[0])
+        self.assertEqual(info['process'], processes[0].id)
+        self.assertEqual(info['parameters']['a'], 0.3)
+        self.assertTrue(info['start_time'] <= info['end_time'])
+
+    def test_failure(self):
+        process = self.engine.get_process_instance(Sleep)
+        eid = self.engine.start(process, a=0., fail=True)
+        self.assertEqual(self.engine.wait(eid), 'failed')
+        self.assertTrue('failure requested'
+                        in self.engine.detailed_information(eid)['error'])
+        self.assertRaises(ExecutionError, self.engine.raise_for_status,
+                          'failed', eid)
+        self.assertRaises(ExecutionError, self.engine.check_call, process,
+                          a=0., fail=True)
+        self.assertEqual(self.engine.call(process, fail=False), 'done')
+
+    def test_interrupt(self):
+        pipeline = self.engine.get_process_instance(SleepPipeline)
+        eid = self.engine.start(pipeline, a=10.)
+        while self.engine.status(eid) == 'not_started':
+            time.sleep(0.01)
+        self.assertEqual(self.engine.status(eid), 'running')
+        self.engine.interrupt(eid)
+        self.assertEqual(self.engine.wait(eid, timeout=0.1), 'running')
+        Sleep.event.set()
+        self.assertEqual(self.engine.wait(eid), 'interrupted')
+        # the second node has not been run
+        self.assertEqual(pipeline.nodes['sleep2'].process.b, 0.)
+        # a terminated execution cannot be interrupted
+        self.assertRaises(ValueError, self.engine.interrupt, eid)
+
+    def test_history(self):
+        process = self.engine.get_process_instance(Sleep)
+        eid = self.engine.start(process, a=0.)
+        eid_no_history = self.engine.start(process, history=False, a=0.)
+        self.engine.wait(eid)
+        self.engine.wait(eid_no_history)
+        self.assertEqual(set(self.engine.executions()),
+                         set([eid, eid_no_history]))
+        engine2 = capsul_engine(self.database)
+        self.assertEqual(engine2.executions(), [eid])
+        self.assertEqual(engine2.status(eid), 'done')
+        self.assertRaises(ValueError, engine2.status, eid_no_history)
+
+    def test_history_size(self):
+        self.engine.execution_backend.max_history = 3
+        process = self.engine.get_process_instance(Sleep)
+        eids = []
+        for i in range(5):
+            eids.append(self.engine.start(process, a=0.))
+            self.engine.wait(eids[-1])
+        # only the last executions are kept in the database
+        self.assertEqual(
+            sorted(self.engine.database.json_value('executions')),
+            sorted(eids[-3:]))
+
+
+def test():
+    """ Function to execute unitest.
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestLocalExecution)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("RETURNCODE: ", test())
@@ -0,0 +1,274 @@
+from __future__ import print_function
+
+import unittest
+import tempfile
+import os
+import sys
+import subprocess
+import datetime
+
+from traits.api import Float, Bool
+
+from capsul.api import Process, Pipeline, capsul_engine
+from capsul.engine.runtime_history import (parameters_hash, ResourceMonitor,
+                                           RuntimeHistory, ResourceRequests,
+                                           parse_resource_usage)
+from capsul.pipeline import pipeline_workflow
+
+
+class Compute(Process):
+    ''' Burn some CPU time.
+    '''
+    a = Float(output=False)
+    fail = Bool(False, output=False, optional=True)
+    b = Float(output=True)
+
+    def _run_process(self):
+        if self.fail:
+            raise RuntimeError('failure requested')
+        total = 0.
+        for i in range(int(self.a)):
+            total += i
+        self.b = total
+
+
+class ComputePipeline(Pipeline):
+    ''' Chain of two Compute processes.
+    '''
+    def pipeline_definition(self):
+        self.add_process('compute1', Compute)
+        self.add_process('compute2', Compute)
+        self.add_link('compute1.b->compute2.a')
+        self.export_parameter('compute1', 'a')
+        self.export_parameter('compute2', 'b')
+
+
+class ClusterController(object):
+    ''' Soma-workflow controller of a finished workflow, whose jobs resource
+    usages are reported by a cluster scheduler.
+    '''
+    def __init__(self, workflow, resource_usage):
+        self.jobs = list(workflow.jobs)
+        self.job_mapping = dict(
+            (job, type('EngineJob', (object,), {'job_id': i})())
+            for i, job in enumerate(self.jobs))
+        self.resource_usage = resource_usage
+
+    def workflow(self, workflow_id):
+        return self
+
+    def workflow_elements_status(self, workflow_id):
+        start = datetime.datetime(2020, 1, 1, 12)
+        end = start + datetime.timedelta(seconds=100)
+        return ([(i, 'done', None,
+                  ('finished_regularly', 0, None, self.resource_usage),
+                  (start, start, end))
+                 for i in range(len(self.jobs))], [], [])
+
+
+class TestRuntimeHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.database = tempfile.mktemp(suffix='.json')
+        self.engine = capsul_engine(self.database)
+        self.study_config = self.engine.study_config
+        self.study_config.use_soma_workflow = False
+
+    def tearDown(self):
+        del self.study_config
+        del self.engine
+        if os.path.exists(self.database):
+            os.remove(self.database)
+
+    def test_monitor(self):
+        with ResourceMonitor() as monitor:
+            sum(range(100000))
+        measures = monitor.measures
+        self.assertTrue(measures['wall_time'] >= 0.)
+        self.assertTrue(measures['cpu_time'] >= 0.)
+        self.assertEqual(
+            sorted(measures),
+            ['cpu_time', 'io_read_bytes', 'io_write_bytes', 'peak_rss',
+             'start_time', 'wall_time'])
+        # the memory of the current process is not measured
+        self.assertIs(measures['peak_rss'], None)
+
+    def test_monitor_without_resource(self):
+        # systems without the resource module (Windows)
+        from capsul.engine import runtime_history
+        resource = runtime_history.resource
+        runtime_history.resource = None
+        try:
+            with ResourceMonitor() as monitor:
+                sum(range(100000))
+        finally:
+            runtime_history.resource = resource
+        self.assertTrue(monitor.measures['cpu_time'] >= 0.)
+        self.assertIs(monitor.measures['peak_rss'], None)
+
+    @unittest.skipIf(sys.platform.startswith('win'),
+                     'child processes memory is not measured on Windows')
+    def test_monitor_child_process(self):
+        size = 300 * 1048576
+        with ResourceMonitor() as monitor:
+            subprocess.check_call(
+                [sys.executable, '-c', 'b = b"x" * %d' % size])
+        self.assertTrue(monitor.measures['peak_rss'] >= size)
+
+    def test_parse_resource_usage(self):
+        # slurm
+        usage = parse_resource_usage(
+            'cput=1-00:01:02.5 mem=2G vmem=3G walltime=01:00:00 ncpus=1 ')
+        self.assertEqual(usage['cpu_time'], 86462.5)
+        self.assertEqual(usage['peak_rss'], 2 * 1024 ** 3)
+        self.assertEqual(usage['resource_usage']['ncpus'], '1')
+        # PBS
+        usage = parse_resource_usage('cput=00:01:30 mem=2048kb')
+        self.assertEqual((usage['cpu_time'], usage['peak_rss']),
+                         (90., 2048 * 1024))
+        # DRMAA
+        usage = parse_resource_usage(b'cpu=12.5 ru_maxrss=1000 maxvmem=0')
+        self.assertEqual((usage['cpu_time'], usage['peak_rss']),
+                         (12.5, 1024000))
+        usage = parse_resource_usage('mem=unknown')
+        self.assertEqual((usage['cpu_time'], usage['peak_rss']),
+                         (None, None))
+
+    def test_record_runs(self):
+        process = self.engine.get_process_instance(Compute)
+        self.study_config.run(process, a=1000.)
+        self.study_config.run(process, a=1000.)
+        self.assertRaises(RuntimeError, self.study_config.run, process,
+                          a=10., fail=True)
+        history = self.engine.runtime_history
+        records = history.records(process.id)
+        self.assertEqual([record['status'] for record in records],
+                         ['done', 'done', 'failed'])
+        self.assertTrue('failure requested' in records[-1]['error'])
+        process.fail = False
+        process.a = 1000.
+        phash = parameters_hash(process)
+        self.assertEqual(len(history.records(process.id, phash)), 2)
+        statistics = history.statistics(process.id)
+        self.assertEqual(statistics['count'], 3)
+        self.assertEqual(statistics['failed'], 1)
+        self.assertTrue(statistics['max_wall_time']
+                        >= statistics['median_wall_time'])
+        self.assertEqual(history.estimated_duration(process),
+                         statistics['median_wall_time'])
+        self.assertEqual(history.estimated_duration('unknown', 3.), 3.)
+        # records are saved in the database
+        engine2 = capsul_engine(self.database)
+        self.assertEqual(len(engine2.runtime_history.records(process.id)), 3)
+
+    def test_pipeline(self):
+        pipeline = self.engine.get_process_instance(ComputePipeline)
+        self.study_config.run(pipeline, a=100.)
+        history = self.engine.runtime_history
+        self.assertEqual(len(history.records(Compute().id)), 2)
+        # the pipeline itself is not recorded, only its processes
+        self.assertEqual(len(history.records()), 2)
+        # recording can be disabled
+        self.study_config.record_runtime_history = False
+        self.study_config.run(pipeline, a=100.)
+        self.assertEqual(len(history.records()), 2)
+
+    def test_max_records(self):
+        history = RuntimeHistory(self.engine.database, max_records=3)
+        process = Compute()
+        for i in range(5):
+            history.record(process, {'start_time': float(i),
+                                     'wall_time': float(i)})
+        self.assertEqual([record['wall_time']
+                          for record in history.records(process.id)],
+                         [2., 3., 4.])
+        # measures of several iterations run at once
+        history.clear()
+        history.record(process, {'start_time': 0., 'wall_time': 6.},
+                       iterations=3, parameters=['a', 'b', 'c'])
+        self.assertEqual([(record['parameters_hash'], record['wall_time'])
+                          for record in history.records(process.id)],
+                         [('a', 2.), ('b', 2.), ('c', 2.)])
+
+    def test_workflow_jobs(self):
+        pipeline = self.engine.get_process_instance(ComputePipeline)
+        pipeline.a = 10.
+        job_processes = {}
+        workflow = pipeline_workflow.workflow_from_pipeline(
+            pipeline, create_directories=False, job_processes=job_processes)
+        jobs = [job for job in workflow.jobs if job.command]
+        self.assertEqual(len(jobs), 2)
+        for job in jobs:
+            process_id, phash, iterations = job_processes[job]
+            self.assertEqual(process_id, Compute().id)
+            self.assertEqual(
+                phash, parameters_hash(pipeline.nodes[job.name].process))
+            self.assertEqual(iterations, 1)
+
+    def test_resource_requests(self):
+        history = self.engine.runtime_history
+        process = Compute()
+        requests = ResourceRequests(history, percentile=50., margin=2.,
+                                    min_wall_time=10.,
+                                    defaults={'wall_time': 7200.})
+        self.assertEqual(requests.requests(process), {'wall_time': 7200.})
+        self.assertEqual(requests(process), '--time=2:00:00')
+        for wall_time in (100., 300., 200.):
+            history.record(process, {'start_time': 0.,
+                                     'wall_time': wall_time,
+                                     'cpu_time': wall_time * 1.9,
+                                     'peak_rss': 100 * 1048576})
+        self.assertEqual(requests.requests(process),
+                         {'wall_time': 400., 'memory': 200 * 1048576,
+                          'cpus': 2})
+        self.assertEqual(requests(process),
+                         '--time=0:06:40 --mem=200M --cpus-per-task=2')
+        self.assertEqual(requests(process, 20),
+                         '--time=2:13:20 --mem=200M --cpus-per-task=2')
+        requests.scheduler = 'pbs'
+        self.assertEqual(requests(process),
+                         '-l walltime=0:06:40,mem=200mb,ncpus=2')
+        self.assertRaises(ValueError, ResourceRequests, history, 'lsf')
+        # jobs of a workflow
+        pipeline = self.engine.get_process_instance(ComputePipeline)
+        pipeline.nodes['compute2'].process.native_specification = '-p long'
+        workflow = pipeline_workflow.workflow_from_pipeline(
+            pipeline, create_directories=False, resource_requests=requests)
+        specs = dict((job.name, job.native_specification)
+                     for job in workflow.jobs)
+        self.assertEqual(specs, {
+            'compute1': '-l walltime=0:06:40,mem=200mb,ncpus=2',
+            'compute2': '-p long'})
+
+    def test_cluster_resource_requests(self):
+        history = self.engine.runtime_history
+        pipeline = self.engine.get_process_instance(ComputePipeline)
+        job_processes = {}
+        workflow = pipeline_workflow.workflow_from_pipeline(
+            pipeline, create_directories=False, job_processes=job_processes)
+        controller = ClusterController(
+            workflow, 'cput=00:03:10 mem=102400kb vmem=2gb ncpus=2 ')
+        history.record_workflow(controller, 1, workflow, job_processes)
+        records = history.records(Compute().id)
+        self.assertEqual(len(records), 2)
+        self.assertEqual([(record['wall_time'], record['cpu_time'],
+                           record['peak_rss']) for record in records],
+                         [(100., 190., 100 * 1048576)] * 2)
+        requests = ResourceRequests(history, scheduler='pbs', margin=2.)
+        self.assertEqual(requests.requests(pipeline.nodes['compute1'].process),
+                         {'wall_time': 200., 'memory': 200 * 1048576,
+                          'cpus': 2})
+        self.assertEqual(requests(pipeline.nodes['compute1'].process),
+                         '-l walltime=0:03:20,mem=200mb,ncpus=2')
+
+
+def test():
+    """ Function to execute unitest.
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestRuntimeHistory)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("RETURNCODE: ", test())
@@ -0,0 +1,138 @@
+from __future__ import print_function
+
+import unittest
+import subprocess
+import tempfile
+import shutil
+import sys
+import os
+
+from traits.api import File, Bool
+
+from capsul.api import Process, Pipeline
+from capsul.engine.worker_pool import WorkerPool, pool_commandline
+from capsul.pipeline import pipeline_workflow
+
+
+class WriteFile(Process):
+    ''' Write the process id of the python interpreter in a file.
+    '''
+    output = File(output=True)
+    fail = Bool(False, output=False, optional=True)
+
+    def _run_process(self):
+        if self.fail:
+            raise RuntimeError('failure requested')
+        with open(self.output, 'w') as f:
+            f.write(str(os.getpid()))
+        print('written:', self.output)
+
+
+class WriteOutputs(Process):
+    ''' Write on the standard and error outputs file descriptors, and in
+    a child process.
+    '''
+    output = File(output=True)
+
+    def _run_process(self):
+        os.write(1, b'fd output\n')
+        os.write(2, b'fd error\n')
+        subprocess.check_call([sys.executable, '-c',
+                               'print("child output")'])
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='capsul_test_pool')
+        self.pool = WorkerPool(max_workers=1)
+
+    def tearDown(self):
+        self.pool.shutdown()
+        shutil.rmtree(self.tmp_dir)
+
+    def run_process(self, process, **kwargs):
+        for name, value in kwargs.items():
+            setattr(process, name, value)
+        commandline = self.pool.commandline(process.get_commandline())
+        # use the current python interpreter
+        commandline[0] = sys.executable
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        job = subprocess.Popen(commandline, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=env,
+                               cwd=self.tmp_dir)
+        out, err = job.communicate()
+        return job.returncode, out.decode(), err.decode()
+
+    def test_run(self):
+        process = WriteFile()
+        outputs = [os.path.join(self.tmp_dir, 'out%d' % i) for i in range(2)]
+        pids = []
+        for output in outputs:
+            status, out, err = self.run_process(process, output=output)
+            self.assertEqual(status, 0, err)
+            self.assertIn('written: %s' % output, out)
+            with open(output) as f:
+                pids.append(f.read())
+        # both jobs have run in the same worker
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[0], str(os.getpid()))
+        # failure
+        status, out, err = self.run_process(process, fail=True)
+        self.assertEqual(status, 1)
+        self.assertIn('failure requested', err)
+
+    def test_outputs(self):
+        # outputs written on the file descriptors are returned to the client
+        status, out, err = self.run_process(WriteOutputs())
+        self.assertEqual(status, 0, err)
+        self.assertIn('fd output', out)
+        self.assertIn('child output', out)
+        self.assertIn('fd error', err)
+        # and are not captured any longer once the job is done
+        status, out, err = self.run_process(WriteFile(),
+                                            output=os.path.join(
+                                                self.tmp_dir, 'out'))
+        self.assertNotIn('fd output', out)
+
+    def test_fallback(self):
+        # the pool is not reachable: the client runs the job itself
+        process = WriteFile()
+        process.output = os.path.join(self.tmp_dir, 'out')
+        commandline = pool_commandline(
+            process.get_commandline(), os.path.join(self.tmp_dir, 'socket'),
+            os.path.join(self.tmp_dir, 'key'))
+        commandline[0] = sys.executable
+        status = subprocess.call(
+            commandline,
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        self.assertEqual(status, 0)
+        with open(process.output) as f:
+            self.assertNotEqual(f.read(), str(os.getpid()))
+
+    def test_workflow(self):
+        self.assertEqual(pool_commandline(['ls', '-l'], 'a', 'k'),
+                         ['ls', '-l'])
+        pipeline = Pipeline()
+        pipeline.add_process('write', WriteFile)
+        pipeline.autoexport_nodes_parameters()
+        pipeline.output = os.path.join(self.tmp_dir, 'out')
+        workflow = pipeline_workflow.workflow_from_pipeline(
+            pipeline, create_directories=False, worker_pool=self.pool)
+        job = workflow.jobs[0]
+        self.assertEqual(job.command[3:5],
+                         [self.pool.address, self.pool.key_file])
+        self.assertIn('WriteFile', job.command[5])
+
+
+def test():
+    """ Function to execute unitest.
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestWorkerPool)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("RETURNCODE: ", test())
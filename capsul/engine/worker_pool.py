@@ -0,0 +1,417 @@
+'''
+Pool of long-lived python worker processes running the python command
+lines of processes, to avoid starting a new python interpreter and
+importing capsul for each job.
+
+The python command lines of processes (``python -c <code> <arguments>``,
+see :meth:`~capsul.process.process.Process.get_commandline`) are replaced
+by the command line of a small client, which only uses the python standard
+library: it sends the code and its arguments to the pool, which executes
+it in one of its workers, and exits with the execution status. If the pool
+cannot be reached, the client executes the code itself::
+
+    with WorkerPool(max_workers=4) as pool:
+        workflow = workflow_from_pipeline(pipeline, worker_pool=pool)
+        controller, wf_id = workflow_run(pipeline.name, workflow,
+                                         study_config)
+
+A pool may also be started on a cluster node, listening on a network
+address::
+
+    python -m capsul.engine.worker_pool --address node1:8642 \\
+        --key-file ~/.capsul_worker_key --workers 16
+
+Clients authenticate using the key stored in the key file, which must be
+readable from the computing nodes running the jobs.
+
+Classes
+=======
+:class:`WorkerPool`
+-------------------
+
+Functions
+=========
+:func:`pool_commandline`
+------------------------
+'''
+
+from __future__ import print_function
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import traceback
+from multiprocessing.connection import Listener, Client
+
+import six
+try:
+    import concurrent.futures as futures
+except ImportError:
+    # python 2 without the "futures" backport
+    futures = None
+
+logger = logging.getLogger(__name__)
+
+# code of the client run in the jobs: it must only use the standard library,
+# in order to start quickly. Arguments: address, key file, python code and
+# the arguments of the code.
+_client_code = (
+    "import sys, os\n"
+    "from multiprocessing.connection import Client\n"
+    "address, key_file, code = sys.argv[1:4]\n"
+    "if not address.startswith('/') and ':' in address:\n"
+    "    host, port = address.rsplit(':', 1)\n"
+    "    address = (host, int(port))\n"
+    "try:\n"
+    "    with open(key_file, 'rb') as f:\n"
+    "        connection = Client(address, authkey=f.read())\n"
+    "except Exception:\n"
+    "    connection = None\n"
+    "if connection is None:\n"
+    "    sys.argv = ['-c'] + sys.argv[4:]\n"
+    "    exec(compile(code, '<string>', 'exec'), {'__name__': '__main__'})\n"
+    "else:\n"
+    "    connection.send((code, sys.argv[4:], os.getcwd(),"
+    " dict(os.environ)))\n"
+    "    out, err, status = connection.recv()\n"
+    "    sys.stdout.write(out)\n"
+    "    sys.stderr.write(err)\n"
+    "    sys.exit(status)\n")
+
+
+def pool_commandline(commandline, address, key_file):
+    '''
+    Convert a python command line (``python -c <code> <arguments>``) into a
+    command line running the code in a worker pool. Other command lines are
+    returned unchanged.
+
+    Parameters
+    ----------
+    commandline: list
+        the command line. Arguments after the code may be any objects
+        (temporary paths or file transfers of soma-workflow for instance),
+        they are kept as they are.
+    address: str
+        address of the pool: unix socket path or "host:port"
+    key_file: str
+        file containing the authentication key of the pool
+    '''
+    if len(commandline) < 3 or commandline[1] != '-c' \
+            or not os.path.basename(
+                str(commandline[0])).startswith('python'):
+        return commandline
+    return [commandline[0], '-c', _client_code, address, key_file] \
+        + list(commandline[2:])
+
+
+def _exit_status(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def _run_code(code, args, cwd, environ):
+    ''' Execute python code in a worker as in ``python -c code args``, in
+    the given working directory and environment. Returns the standard
+    output, the error output and the exit status.
+
+    The standard and error outputs file descriptors are redirected to
+    temporary files during the execution, so that the outputs of child
+    processes and of C extensions are also captured.
+    '''
+    outputs = [tempfile.TemporaryFile(), tempfile.TemporaryFile()]
+    saved = (sys.argv, sys.stdout, sys.stderr, os.getcwd(),
+             dict(os.environ))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = [os.dup(1), os.dup(2)]
+    job_streams = []
+    status = 0
+    try:
+        os.dup2(outputs[0].fileno(), 1)
+        os.dup2(outputs[1].fileno(), 2)
+        # the worker sys.stdout / sys.stderr may not write in the file
+        # descriptors (if they have been replaced in its parent process)
+        job_streams = [os.fdopen(os.dup(fd), 'w', 1) for fd in (1, 2)]
+        sys.stdout, sys.stderr = job_streams
+        sys.argv = ['-c'] + list(args)
+        os.environ.clear()
+        os.environ.update(environ)
+        try:
+            os.chdir(cwd)
+            exec(compile(code, '<string>', 'exec'), {'__name__': '__main__'})
+        except SystemExit as e:
+            status = _exit_status(e.code)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+    finally:
+        # the job may have replaced sys.stdout / sys.stderr
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        for stream in job_streams:
+            try:
+                stream.close()
+            except Exception:
+                pass
+        sys.argv, sys.stdout, sys.stderr = saved[:3]
+        for fd, saved_fd in zip((1, 2), saved_fds):
+            os.dup2(saved_fd, fd)
+            os.close(saved_fd)
+        os.chdir(saved[3])
+        os.environ.clear()
+        os.environ.update(saved[4])
+    result = []
+    for output in outputs:
+        output.seek(0)
+        result.append(output.read().decode('utf-8', 'replace'))
+        output.close()
+    return result[0], result[1], status
+
+
+def _preload(modules):
+    for module in modules:
+        __import__(module)
+
+
+def _run_job(preload, code, args, cwd, environ):
+    ''' Run a job in a worker (see :func:`_run_code`), after importing the
+    preloaded modules. Workers import them when they start on python >= 3.7
+    (executors initializer), and in their first job otherwise.
+    '''
+    _preload(preload)
+    return _run_code(code, args, cwd, environ)
+
+
+class WorkerPool(object):
+    '''
+    Pool of python worker processes executing the python command lines of
+    jobs sent by clients (see :func:`pool_commandline`). Each worker
+    executes one job at a time; modules imported by a job stay loaded for
+    the next ones.
+
+    Parameters
+    ----------
+    max_workers: int (optional)
+        number of worker processes, defaults to the number of CPUs
+    address: str or tuple (optional)
+        address to listen on: a unix socket path, "host:port" or
+        (host, port). By default a unix socket is created in a temporary
+        directory.
+    key_file: str (optional)
+        file containing the authentication key of clients. If it does not
+        exist, a random key is written in it. By default, a file is created
+        in a temporary directory.
+    preload: list of str (optional)
+        modules imported by each worker when it starts (on python < 3.7,
+        workers import them while running their first job)
+    '''
+
+    def __init__(self, max_workers=None, address=None, key_file=None,
+                 preload=('capsul.api', )):
+        self.max_workers = max_workers
+        self.preload = list(preload or ())
+        self._tmp_dir = None
+        if isinstance(address, six.string_types) \
+                and not address.startswith('/') and ':' in address:
+            host, port = address.rsplit(':', 1)
+            address = (host, int(port))
+        if key_file is None \
+                or (address is None and sys.platform != 'win32'):
+            self._tmp_dir = tempfile.mkdtemp(prefix='capsul_workers_')
+        if key_file is None:
+            key_file = os.path.join(self._tmp_dir, 'key')
+        if address is None and sys.platform != 'win32':
+            address = os.path.join(self._tmp_dir, 'socket')
+        self.key_file = key_file
+        self._authkey = self._read_key(key_file)
+        self._requested_address = address
+        self._listener = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closing = False
+
+    @staticmethod
+    def _read_key(key_file):
+        if not os.path.exists(key_file):
+            old_umask = os.umask(0o077)
+            try:
+                with open(key_file, 'wb') as f:
+                    f.write(os.urandom(32))
+            finally:
+                os.umask(old_umask)
+        with open(key_file, 'rb') as f:
+            return f.read()
+
+    @property
+    def address(self):
+        '''
+        Address clients connect to, as a string (unix socket path or
+        "host:port"), or None if the pool is not started.
+        '''
+        if self._listener is None:
+            return None
+        address = self._listener.address
+        if isinstance(address, tuple):
+            return '%s:%d' % address
+        return address
+
+    def start(self):
+        '''
+        Start listening to clients. Workers are started when they are
+        needed.
+        '''
+        if self._listener is not None:
+            return
+        if futures is None:
+            raise RuntimeError('the worker pool needs the '
+                               'concurrent.futures module')
+        self._closing = False
+        self._listener = Listener(self._requested_address,
+                                  authkey=self._authkey)
+        self._executor = self._new_executor()
+        self._thread = threading.Thread(target=self._accept_loop)
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info('capsul worker pool listening on %s' % self.address)
+
+    @property
+    def _job_preload(self):
+        # modules imported by jobs, when workers cannot import them when
+        # they start
+        if sys.version_info[:2] >= (3, 7):
+            return []
+        return self.preload
+
+    def _new_executor(self):
+        kwargs = {}
+        if self.preload and sys.version_info[:2] >= (3, 7):
+            kwargs = {'initializer': _preload, 'initargs': (self.preload, )}
+        return futures.ProcessPoolExecutor(max_workers=self.max_workers,
+                                           **kwargs)
+
+    def _accept_loop(self):
+        while not self._closing:
+            try:
+                connection = self._listener.accept()
+            except Exception as e:
+                if self._closing:
+                    break
+                # failed authentication, or broken connection
+                logger.warning('capsul worker pool: rejected client: %s'
+                               % e)
+                continue
+            if self._closing:
+                connection.close()
+                break
+            thread = threading.Thread(target=self._serve,
+                                      args=(connection, ))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, connection):
+        try:
+            request = connection.recv()
+            with self._lock:
+                executor = self._executor
+            try:
+                result = executor.submit(_run_job, self._job_preload,
+                                         *request).result()
+            except Exception as e:
+                # a worker has crashed: the executor cannot be used anymore
+                with self._lock:
+                    if self._executor is executor and not self._closing:
+                        self._executor = self._new_executor()
+                        executor.shutdown(wait=False)
+                result = ('', 'capsul worker pool: %s: %s\n'
+                          % (e.__class__.__name__, e), 1)
+            connection.send(result)
+        except (EOFError, IOError, OSError):
+            # the client has gone
+            pass
+        finally:
+            connection.close()
+
+    def commandline(self, commandline):
+        '''
+        Convert a python command line to run it in this pool (see
+        :func:`pool_commandline`).
+        '''
+        if self._listener is None:
+            self.start()
+        return pool_commandline(commandline, self.address, self.key_file)
+
+    def shutdown(self, wait=True):
+        '''
+        Stop listening to clients and stop the workers. Running jobs are
+        completed if wait is True.
+        '''
+        if self._listener is None:
+            return
+        self._closing = True
+        # wake up the thread waiting for connections
+        try:
+            Client(self._listener.address, authkey=self._authkey).close()
+        except Exception:
+            pass
+        self._thread.join()
+        self._listener.close()
+        self._listener = None
+        self._executor.shutdown(wait=wait)
+        self._executor = None
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+
+def main(argv=None):
+    ''' Run a worker pool until it is interrupted.
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Run a pool of capsul python workers executing the '
+        'jobs of workflows.')
+    parser.add_argument('--address', required=True,
+                        help='address to listen on: "host:port", or unix '
+                        'socket path')
+    parser.add_argument('--key-file', required=True,
+                        help='file containing the authentication key, '
+                        'created if it does not exist')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: number '
+                        'of CPUs)')
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    pool = WorkerPool(max_workers=options.workers, address=options.address,
+                      key_file=os.path.expanduser(options.key_file))
+    pool.start()
+    try:
+        while True:
+            pool._thread.join(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -22,8 +22,9 @@ import logging
 from copy import deepcopy
 import tempfile
 import os
-import shutil
 import six
+from contextlib import contextmanager
+from collections import deque
 from soma.utils.weak_proxy import weak_proxy, get_ref
 
 # Define the logger
@@ -48,13 +49,21 @@ from .pipeline_nodes import ProcessNode
 from .pipeline_nodes import PipelineNode
 from .pipeline_nodes import Switch
 from .pipeline_nodes import OptionalOutputSwitch
+from .temporary_files import remove_temporary_path
 
 # Soma import
 from soma.controller import Controller
 from soma.controller import ControllerTrait
-from soma.sorted_dictionary import SortedDictionary
+from soma.sorted_dictionary import SortedDictionary, OrderedDict
 from soma.utils.functiontools import SomaPartial
 
+
+def _new_temporary_file(suffix):
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+
 class Pipeline(Process):
     """ Pipeline containing Process nodes, and links between node parameters.
 
@@ -148,10 +157,14 @@ class Pipeline(Process):
         a list of odered nodes that can be executed
     `workflow_repr`: str
         a string representation of the workflow list <node_i>-><node_i+1>
+    `last_activation_changes`: dict
+        nodes and plugs whose activation has changed during the last
+        activations update (see :py:meth:`update_nodes_and_plugs_activation`)
 
     Methods
     -------
     pipeline_definition
+    construction_transaction
     add_trait
     add_process
     add_switch
@@ -222,13 +235,27 @@ class Pipeline(Process):
         #########################################################
             
             
+        # Nodes whose activation has to be re-evaluated and forward
+        # activation states used by incremental activation updates
+        self._activation_dirty_nodes = set()
+        self._forward_activations = None
+        self.last_activation_changes = {'nodes': {}, 'plugs': {}}
+        # Workflow graphs and ordered nodes computed for the current
+        # structure of the pipeline (see workflow_graph)
+        self._workflow_cache = {}
         self.pipeline_node = PipelineNode(self, '', self)
         self.nodes[''] = self.pipeline_node
         self.do_not_export = set()
         self.parent_pipeline = None
         self._disable_update_nodes_and_plugs_activation = 1
         self._must_update_nodes_and_plugs_activation = False
-        self.pipeline_definition()
+        # Construction transactions state (see construction_transaction)
+        self._construction_level = 0
+        self._pending_link_values = []
+        self._pending_switches = OrderedDict()
+
+        with self.construction_transaction():
+            self.pipeline_definition()
 
         self.workflow_repr = ""
         self.workflow_list = []
@@ -305,8 +332,9 @@ class Pipeline(Process):
             optional = bool(trait.optional)
             plug = Plug(output=output, optional=optional)
             self.pipeline_node.plugs[name] = plug
-            plug.on_trait_change(self.update_nodes_and_plugs_activation,
+            plug.on_trait_change(self.pipeline_node._on_enabled_change,
                                  'enabled')
+            self._mark_activation_dirty(self.pipeline_node)
 
     def remove_trait(self, name):
         """ Remove a trait to the pipeline
@@ -333,6 +361,7 @@ class Pipeline(Process):
             for link in links_to_remove:
                 self.remove_link(link)
             del self.pipeline_node.plugs[name]
+            self._mark_activation_dirty(self.pipeline_node)
 
         # Remove the trait
         super(Pipeline, self).remove_trait(name)
@@ -429,6 +458,7 @@ class Pipeline(Process):
         else:
             node = ProcessNode(self, name, process)
         self.nodes[name] = node
+        self._mark_activation_dirty(node)
 
         # If a default value is given to a parameter, change the corresponding
         # plug so that it gets activated even if not linked
@@ -568,6 +598,7 @@ class Pipeline(Process):
         node = Switch(self, name, inputs, outputs, make_optional=make_optional,
                       output_types=output_types)
         self.nodes[name] = node
+        self._mark_activation_dirty(node)
 
         # Export the switch controller to the pipeline node
         if export_switch:
@@ -637,6 +668,7 @@ class Pipeline(Process):
         # Create the node
         node = OptionalOutputSwitch(self, name, input, output)
         self.nodes[name] = node
+        self._mark_activation_dirty(node)
 
         self._set_subprocess_context_name(node, name)
 
@@ -674,6 +706,7 @@ class Pipeline(Process):
                 "could not build a Node of type '%s' with the given parameters"
                 % node_type)
         self.nodes[name] = node
+        self._mark_activation_dirty(node)
 
         # Change plug default properties
         for parameter_name in node.plugs:
@@ -793,15 +826,21 @@ class Pipeline(Process):
                              "plug: {0}".format(link))
 
         # Propagate the plug value from source to destination
-        value = source_node.get_plug_value(source_plug_name)
-        if value is not None:
-            dest_node.set_plug_value(dest_plug_name, value)
+        if self._construction_level:
+            self._pending_link_values.append((source_node, source_plug_name,
+                                              dest_node, dest_plug_name))
+        else:
+            value = source_node.get_plug_value(source_plug_name)
+            if value is not None:
+                dest_node.set_plug_value(dest_plug_name, value)
 
         # Update plugs memory of the pipeline
         source_plug.links_to.add((dest_node_name, dest_plug_name, dest_node,
                                   dest_plug, weak_link))
         dest_plug.links_from.add((source_node_name, source_plug_name,
                                   source_node, source_plug, weak_link))
+        self._mark_activation_dirty(source_node)
+        self._mark_activation_dirty(dest_node)
 
         # Set a connected_output property
         if (isinstance(dest_node, ProcessNode) and
@@ -816,8 +855,11 @@ class Pipeline(Process):
             source_trait = source_node.get_trait(source_plug_name)
             dest_trait = dest_node.trait(dest_plug_name)
             dest_trait.desc = source_trait.desc
-            dest_node._switch_changed(getattr(dest_node, "switch"),
-                                      getattr(dest_node, "switch"))
+            if self._construction_level:
+                self._pending_switches[dest_node] = None
+            else:
+                dest_node._switch_changed(getattr(dest_node, "switch"),
+                                          getattr(dest_node, "switch"))
 
         # Observer
         source_node.connect(source_plug_name, dest_node, dest_plug_name)
@@ -850,6 +892,8 @@ class Pipeline(Process):
                                       source_node, source_plug, True))
         dest_plug.links_from.discard((source_node_name, source_plug_name,
                                       source_node, source_plug, False))
+        self._mark_activation_dirty(source_node)
+        self._mark_activation_dirty(dest_node)
 
         # Set a connected_output property
         if (isinstance(dest_node, ProcessNode) and
@@ -1126,6 +1170,57 @@ class Pipeline(Process):
                         plugs_deactivated.append((plug_name, plug))
         return plugs_deactivated
 
+    @contextmanager
+    def construction_transaction(self):
+        """ Context manager used to build or modify the pipeline structure
+        with many :py:meth:`add_link`, :py:meth:`export_parameter` or
+        :py:meth:`add_switch` calls.
+
+        Within the transaction, values propagation through new links,
+        switches refresh and nodes activation updates are not done at each
+        call but queued. They are applied once, in the order of the calls,
+        when the outermost transaction ends. :py:meth:`pipeline_definition`
+        is always called in a transaction, so this is only needed to modify
+        an existing pipeline.
+
+        Examples
+        --------
+        >>> with pipeline.construction_transaction():
+        ...     pipeline.add_process('node1', 'my_module.MyProcess1')
+        ...     pipeline.add_process('node2', 'my_module.MyProcess2')
+        ...     pipeline.add_link('node1.output->node2.input')
+        """
+        self._construction_level += 1
+        self.delay_update_nodes_and_plugs_activation()
+        try:
+            yield self
+            if self._construction_level == 1:
+                self._commit_construction()
+        finally:
+            self._construction_level -= 1
+            if self._construction_level == 0:
+                del self._pending_link_values[:]
+                self._pending_switches.clear()
+            self.restore_update_nodes_and_plugs_activation()
+
+    def _commit_construction(self):
+        """ Apply operations queued during a construction transaction: values
+        propagation through links, then switches refresh.
+        """
+        while self._pending_link_values or self._pending_switches:
+            pending_link_values = self._pending_link_values
+            self._pending_link_values = []
+            for source_node, source_plug_name, dest_node, dest_plug_name \
+                    in pending_link_values:
+                value = source_node.get_plug_value(source_plug_name)
+                if value is not None:
+                    dest_node.set_plug_value(dest_plug_name, value)
+            pending_switches = list(self._pending_switches)
+            self._pending_switches.clear()
+            for switch in pending_switches:
+                switch._switch_changed(getattr(switch, "switch"),
+                                       getattr(switch, "switch"))
+
     def delay_update_nodes_and_plugs_activation(self):
         if self.parent_pipeline is not None:
             # Only the top level pipeline can manage activations
@@ -1145,51 +1240,72 @@ class Pipeline(Process):
                 self._must_update_nodes_and_plugs_activation:
             self.update_nodes_and_plugs_activation()
 
-    def update_nodes_and_plugs_activation(self):
-        """ Reset all nodes and plugs activations according to the current
-        state of the pipeline (i.e. switch selection, nodes disabled, etc.).
-        Activations are set according to the following rules.
+    def _mark_activation_dirty(self, node):
+        """ Record that a node activation may have changed (because it has
+        been added, enabled or disabled, linked or unlinked, or because
+        one of its plugs has been enabled or disabled). The next call to
+        :py:meth:`update_nodes_and_plugs_activation` will only re-evaluate
+        the part of the pipeline which may be affected by these changes.
+
+        Parameters
+        ----------
+        node: Node (mandatory)
+            the node to re-evaluate
         """
-        if not hasattr(self, 'parent_pipeline'):
-            # self is being initialized (the call comes from self.__init__).
-            return
-        if self.parent_pipeline is not None:
+        self._invalidate_workflow_cache()
+        parent_pipeline = getattr(self, 'parent_pipeline', None)
+        if parent_pipeline is not None:
             # Only the top level pipeline can manage activations
-            self.parent_pipeline.update_nodes_and_plugs_activation()
-            return
-        if self._disable_update_nodes_and_plugs_activation:
-            self._must_update_nodes_and_plugs_activation = True
+            parent_pipeline._mark_activation_dirty(node)
             return
+        self._activation_dirty_nodes.add(node)
 
-        self._disable_update_nodes_and_plugs_activation += 1
-
-        debug = getattr(self, '_debug_activations', None)
-        if debug:
-            debug = open(debug, 'w')
-            print(self.id, file=debug)
-
-        # Remember all links that are inactive (i.e. at least one of the two
-        # plugs is inactive) in order to execute a callback if they become
-        # active (see at the end of this method)
-        inactive_links = []
-        for node in self.all_nodes():
-            for source_plug_name, source_plug in six.iteritems(node.plugs):
-                for nn, pn, n, p, weak_link in source_plug.links_to:
-                    if not source_plug.activated or not p.activated:
-                        inactive_links.append((node, source_plug_name,
-                                               source_plug, n, pn, p))
-
-        # Initialization : deactivate all nodes and their plugs
-        for node in self.all_nodes():
-            node.activated = False
-            for plug_name, plug in six.iteritems(node.plugs):
-                plug.activated = False
+    def _invalidate_workflow_cache(self):
+        """ Forget the workflow graphs and ordered nodes of the pipeline and
+        of its parent pipelines (whose graphs contain the pipeline graph).
+        They will be computed again by the next call to
+        :py:meth:`workflow_graph` or :py:meth:`workflow_ordered_nodes`.
+        """
+        pipeline = self
+        while pipeline is not None:
+            cache = getattr(pipeline, '_workflow_cache', None)
+            if cache:
+                cache.clear()
+            pipeline = getattr(pipeline, 'parent_pipeline', None)
+
+    @staticmethod
+    def _node_activation_state(node):
+        """ Get the activation state of a node and of its plugs as a tuple
+        (node_activated, {plug_name: plug_activated})
+        """
+        return (node.activated,
+                dict((plug_name, plug.activated)
+                     for plug_name, plug in six.iteritems(node.plugs)))
+
+    @staticmethod
+    def _set_node_activation_state(node, state):
+        """ Restore the activation state of a node and of its plugs from a
+        tuple given by :py:meth:`_node_activation_state`. Raises a KeyError
+        if a plug of the node is not part of the state.
+        """
+        node_activated, plugs_activated = state
+        for plug_name, plug in six.iteritems(node.plugs):
+            plug.activated = plugs_activated[plug_name]
+        node.activated = node_activated
 
-        # Forward activation : try to activate nodes (and their input plugs)
-        # and propagate activations neighbours of activated plugs
+    def _propagate_activation(self, nodes_to_check, debug, region=None):
+        """ Forward activation: try to activate nodes (and their input plugs)
+        and propagate activations to neighbours of activated plugs.
 
-        # Starts iterations with all nodes
-        nodes_to_check = set(self.all_nodes())
+        Parameters
+        ----------
+        nodes_to_check: set (mandatory)
+            nodes to check at the first iteration
+        debug: file or None (mandatory)
+            file where activation steps are logged
+        region: set (optional)
+            if given, propagation is restricted to nodes in this set
+        """
         iteration = 1
         while nodes_to_check:
             new_nodes_to_check = set()
@@ -1201,7 +1317,8 @@ class Pipeline(Process):
                             iteration, node.full_name, plug_name), file=debug)
                     for nn, pn, n, p, weak_link in \
                             plug.links_to.union(plug.links_from):
-                        if not weak_link and p.enabled:
+                        if not weak_link and p.enabled \
+                                and (region is None or n in region):
                             new_nodes_to_check.add(n)
                 if (not node_activated) and node.activated:
                     if debug:
@@ -1210,9 +1327,29 @@ class Pipeline(Process):
             nodes_to_check = new_nodes_to_check
             iteration += 1
 
-        # Backward deactivation : deactivate plugs that should not been
-        # activated and propagate deactivation to neighbouring plugs
-        nodes_to_check = set(self.all_nodes())
+    def _propagate_deactivation(self, nodes_to_check, debug, old_states):
+        """ Backward deactivation: deactivate plugs that should not been
+        activated and propagate deactivation to neighbouring plugs.
+
+        Parameters
+        ----------
+        nodes_to_check: set (mandatory)
+            nodes to check at the first iteration
+        debug: file or None (mandatory)
+            file where activation steps are logged
+        old_states: dict (mandatory)
+            activation states of nodes before the update. The state of
+            neighbouring nodes reached by the propagation is recorded there
+            before they are modified.
+        """
+        def check_neighbours(plug):
+            for nn, pn, n, p, weak_link in \
+                    plug.links_from.union(plug.links_to):
+                if p.activated:
+                    if n not in old_states:
+                        old_states[n] = self._node_activation_state(n)
+                    new_nodes_to_check.add(n)
+
         iteration = 1
         while nodes_to_check:
             new_nodes_to_check = set()
@@ -1227,34 +1364,252 @@ class Pipeline(Process):
                             print('%d-%s:%s' % (
                                 iteration, node.full_name, plug_name),
                                 file=debug)
-                        for nn, pn, n, p, weak_link in \
-                                plug.links_from.union(plug.links_to):
-                            if p.activated:
-                                new_nodes_to_check.add(n)
-                    if not node.activated:
-                        # If the node has been deactivated, force deactivation
-                        # of all plugs that are still active and propagate
-                        # this deactivation to neighbours
-                        if node_activated and debug:
-                            print('%d-%s' % (iteration, node.full_name),
-                                  file=debug)
-                        for plug_name, plug in six.iteritems(node.plugs):
-                            if plug.activated:
-                                plug.activated = False
-                                if debug:
-                                    print('%d=%s:%s' % (
-                                        iteration, node.full_name, plug_name),
-                                        file=debug)
-                                for nn, pn, n, p, weak_link in \
-                                        plug.links_from.union(plug.links_to):
-                                    if p.activated:
-                                        new_nodes_to_check.add(n)
+                        check_neighbours(plug)
+                if not node.activated:
+                    # If the node has been deactivated, force deactivation
+                    # of all plugs that are still active and propagate
+                    # this deactivation to neighbours
+                    if node_activated and debug:
+                        print('%d-%s' % (iteration, node.full_name),
+                              file=debug)
+                    for plug_name, plug in six.iteritems(node.plugs):
+                        if plug.activated:
+                            plug.activated = False
+                            if debug:
+                                print('%d=%s:%s' % (
+                                    iteration, node.full_name, plug_name),
+                                    file=debug)
+                            check_neighbours(plug)
             nodes_to_check = new_nodes_to_check
             iteration += 1
 
+    def _full_nodes_and_plugs_activation(self, nodes, old_states, debug):
+        """ Compute activations of all nodes of the pipeline from scratch.
+
+        Parameters
+        ----------
+        nodes: list (mandatory)
+            all the pipeline nodes, as given by :py:meth:`all_nodes`
+        old_states: dict (mandatory)
+            activation states of nodes before the update, completed by this
+            method
+        debug: file or None (mandatory)
+            file where activation steps are logged
+        """
+        for node in nodes:
+            if node not in old_states:
+                old_states[node] = self._node_activation_state(node)
+
+        # Initialization : deactivate all nodes and their plugs
+        for node in nodes:
+            node.activated = False
+            for plug_name, plug in six.iteritems(node.plugs):
+                plug.activated = False
+
+        # Forward activation starts iterations with all nodes
+        self._propagate_activation(set(nodes), debug)
+
+        # Keep the forward activation state, it is the starting point of
+        # incremental updates
+        self._forward_activations = dict(
+            (node, self._node_activation_state(node)) for node in nodes)
+
+        # Backward deactivation starts iterations with all nodes
+        self._propagate_deactivation(set(nodes), debug, old_states)
+
+    def _incremental_nodes_and_plugs_activation(self, dirty_nodes,
+                                                old_states, debug):
+        """ Update activations of the part of the pipeline that may be
+        affected by changes on the given nodes.
+
+        Activations are the result of a forward activation fixpoint followed
+        by a backward deactivation fixpoint. Only nodes downstream of the
+        changed nodes can get a different forward activation state, so the
+        forward fixpoint is computed again only on them. Then the backward
+        deactivation is started again from their forward state, plus the
+        forward state of neighbouring nodes that have been deactivated
+        (since the reason of their deactivation may have gone). Other nodes
+        keep their activation state unless the deactivation propagates to
+        them.
+
+        The result is the same as :py:meth:`_full_nodes_and_plugs_activation`.
+        A KeyError is raised if the forward state of a node is not known,
+        in this case a full update must be done.
+
+        Parameters
+        ----------
+        dirty_nodes: set (mandatory)
+            nodes whose state has changed
+        old_states: dict (mandatory)
+            activation states of nodes before the update, completed by this
+            method
+        debug: file or None (mandatory)
+            file where activation steps are logged
+        """
+        forward_activations = self._forward_activations
+
+        # Nodes whose forward activation may change : the changed nodes and
+        # all nodes that depend on them through an input plug
+        region = set(dirty_nodes)
+        todo = list(dirty_nodes)
+        while todo:
+            node = todo.pop()
+            for plug in six.itervalues(node.plugs):
+                for nn, pn, n, p, weak_link in plug.links_to:
+                    if not p.output and n not in region:
+                        region.add(n)
+                        todo.append(n)
+
+        # Nodes outside of the region feeding the region input plugs
+        boundary = set()
+        for node in region:
+            for plug in six.itervalues(node.plugs):
+                if plug.output:
+                    continue
+                for nn, pn, n, p, weak_link in plug.links_from:
+                    if n not in region:
+                        boundary.add(n)
+        boundary_states = [(node, forward_activations[node])
+                           for node in boundary]
+
+        # Forward activation on the region, using the forward state of the
+        # boundary nodes
+        for node in region.union(boundary):
+            old_states[node] = self._node_activation_state(node)
+        for node, state in boundary_states:
+            self._set_node_activation_state(node, state)
+        for node in region:
+            node.activated = False
+            for plug in six.itervalues(node.plugs):
+                plug.activated = False
+        self._propagate_activation(set(region), debug, region=region)
+        for node in region:
+            forward_activations[node] = self._node_activation_state(node)
+
+        # Neighbouring nodes that have been (partially) deactivated may be
+        # reactivated : restore their forward state.
+        restored = region.union(boundary)
+        todo = list(restored)
+        while todo:
+            node = todo.pop()
+            for plug in six.itervalues(node.plugs):
+                for links in (plug.links_to, plug.links_from):
+                    for nn, pn, n, p, weak_link in links:
+                        if n in restored:
+                            continue
+                        state = self._node_activation_state(n)
+                        if state != forward_activations[n]:
+                            old_states[n] = state
+                            self._set_node_activation_state(
+                                n, forward_activations[n])
+                            restored.add(n)
+                            todo.append(n)
+
+        # Backward deactivation on restored nodes and their neighbours
+        nodes_to_check = set(restored)
+        for node in restored:
+            for plug in six.itervalues(node.plugs):
+                for links in (plug.links_to, plug.links_from):
+                    for nn, pn, n, p, weak_link in links:
+                        if n not in nodes_to_check:
+                            if n not in old_states:
+                                old_states[n] = \
+                                    self._node_activation_state(n)
+                            nodes_to_check.add(n)
+        self._propagate_deactivation(nodes_to_check, debug, old_states)
+
+    def update_nodes_and_plugs_activation(self):
+        """ Reset all nodes and plugs activations according to the current
+        state of the pipeline (i.e. switch selection, nodes disabled, etc.).
+        Activations are set according to the following rules.
+
+        If changes on nodes have been recorded since the last update (see
+        :py:meth:`_mark_activation_dirty`), only the part of the pipeline
+        which may be affected by these changes is evaluated again. Otherwise
+        all activations are computed from scratch. Setting the
+        ``_check_incremental_activations`` attribute to True makes each
+        incremental update checked against a full computation.
+
+        Nodes and plugs whose activation has changed are reported in
+        ``last_activation_changes``, a dictionary with two items: ``nodes``
+        maps nodes full names to their new activation state and ``plugs``
+        maps (node full name, plug name) tuples to their new activation
+        state.
+        """
+        if not hasattr(self, 'parent_pipeline'):
+            # self is being initialized (the call comes from self.__init__).
+            return
+        if self.parent_pipeline is not None:
+            # Only the top level pipeline can manage activations
+            self.parent_pipeline.update_nodes_and_plugs_activation()
+            return
+        if self._disable_update_nodes_and_plugs_activation:
+            self._must_update_nodes_and_plugs_activation = True
+            return
+
+        self._disable_update_nodes_and_plugs_activation += 1
+
+        debug = getattr(self, '_debug_activations', None)
+        if debug:
+            debug = open(debug, 'w')
+            print(self.id, file=debug)
+
+        all_nodes = list(self.all_nodes())
+        dirty_nodes = self._activation_dirty_nodes
+        self._activation_dirty_nodes = set()
+        # activation state of nodes before the update, for all nodes that
+        # may have been modified
+        old_states = {}
+        incremental = False
+        if dirty_nodes and self._forward_activations is not None:
+            # Ignore nodes that have been removed or that are not inserted
+            # yet in the pipeline
+            dirty_nodes.intersection_update(all_nodes)
+            try:
+                self._incremental_nodes_and_plugs_activation(
+                    dirty_nodes, old_states, debug)
+                incremental = True
+            except KeyError:
+                # Some nodes have not been evaluated yet
+                pass
+        if not incremental:
+            self._full_nodes_and_plugs_activation(all_nodes, old_states,
+                                                  debug)
+
+        differences = None
+        if incremental and getattr(self, '_check_incremental_activations',
+                                   False):
+            state = self.pipeline_state()
+            self._full_nodes_and_plugs_activation(all_nodes, old_states,
+                                                  debug)
+            differences = self.compare_to_state(state)
+
+        # Record changes and links that have become active
+        changed_nodes = {}
+        changed_plugs = {}
+        activated_links = set()
+        for node, (node_activated, plugs_activated) in \
+                six.iteritems(old_states):
+            if node.activated != node_activated:
+                changed_nodes[node.full_name] = node.activated
+            for plug_name, plug in six.iteritems(node.plugs):
+                if plug.activated == plugs_activated.get(plug_name, False):
+                    continue
+                changed_plugs[(node.full_name, plug_name)] = plug.activated
+                if not plug.activated:
+                    continue
+                for nn, pn, n, p, weak_link in plug.links_to:
+                    if p.activated:
+                        activated_links.add((node, plug_name, n, pn))
+                for nn, pn, n, p, weak_link in plug.links_from:
+                    if p.activated:
+                        activated_links.add((n, pn, node, plug_name))
+        self.last_activation_changes = {'nodes': changed_nodes,
+                                        'plugs': changed_plugs}
+
         # Update processes to hide or show their traits according to the
         # corresponding plug activation
-        for node in self.all_nodes():
+        for node in old_states:
             if isinstance(node, ProcessNode):
                 traits_changed = False
                 for plug_name, plug in six.iteritems(node.plugs):
@@ -1271,18 +1626,24 @@ class Pipeline(Process):
                     node.process.user_traits_changed = True
 
         # Execute a callback for all links that have become active.
-        for node, source_plug_name, source_plug, n, pn, p in inactive_links:
-            if (source_plug.activated and p.activated):
-                value = node.get_plug_value(source_plug_name)
-                node._callbacks[(source_plug_name, n, pn)](value)
+        for node, source_plug_name, n, pn in activated_links:
+            value = node.get_plug_value(source_plug_name)
+            node._callbacks[(source_plug_name, n, pn)](value)
 
-        # Refresh views relying on plugs and nodes selection
-        for node in self.all_nodes():
+        # Refresh views relying on plugs and nodes selection, and forget
+        # workflow graphs
+        for node in all_nodes:
             if isinstance(node, PipelineNode):
+                node.process._workflow_cache.clear()
                 node.process.selection_changed = True
 
         self._disable_update_nodes_and_plugs_activation -= 1
 
+        if differences:
+            raise ValueError(
+                'Incremental activations differ from a full update:\n%s'
+                % '\n'.join(differences))
+
     def workflow_graph(self, remove_disabled_steps=True,
                        remove_disabled_nodes=True):
         """ Generate a workflow graph
@@ -1300,6 +1661,27 @@ class Pipeline(Process):
             When set, disabled nodes will not be included in the workflow
             graph.
             Default: True
+
+        The graph is cached for the current structure of the pipeline
+        (nodes, links, activations and steps state), so that repeated calls
+        on an unchanged pipeline do not build it again. It is thus shared
+        between callers and must not be modified.
+        """
+        key = ('graph', remove_disabled_steps, remove_disabled_nodes)
+        if remove_disabled_steps:
+            steps = getattr(self, 'pipeline_steps', None)
+            if steps is not None:
+                key += tuple(sorted(six.iteritems(steps.export_to_dict())))
+        graph = self._workflow_cache.get(key)
+        if graph is None:
+            graph = self._build_workflow_graph(remove_disabled_steps,
+                                               remove_disabled_nodes)
+            self._workflow_cache[key] = graph
+        return graph
+
+    def _build_workflow_graph(self, remove_disabled_steps,
+                              remove_disabled_nodes):
+        """ Build the graph returned by :py:meth:`workflow_graph`
         """
 
         def insert(pipeline, node_name, plug, dependencies):
@@ -1393,8 +1775,12 @@ class Pipeline(Process):
             in the workflow graph.
             Default: True
         """
-        # Create a graph and a list of graph node edges
         graph = self.workflow_graph(remove_disabled_steps)
+        key = ('ordered_nodes', remove_disabled_steps)
+        cached = self._workflow_cache.get(key)
+        if cached is not None and cached[0] is graph:
+            self.workflow_repr = cached[1]
+            return list(cached[2])
 
         # Start the topologival sort
         ordered_list = graph.topological_sort()
@@ -1422,10 +1808,13 @@ class Pipeline(Process):
         # Generate the final workflow by flattenin graphs structures
         workflow_list = []
         walk_workflow(ordered_list, workflow_list)
+        self._workflow_cache[key] = (graph, self.workflow_repr,
+                                     list(workflow_list))
 
         return workflow_list
 
-    def _check_temporary_files_for_node(self, node, temp_files):
+    def _check_temporary_files_for_node(self, node, temp_files,
+                                        temporary_files_manager=None):
         """ Check temporary outputs and allocate files for them.
 
         Temporary files or directories will be appended to the temp_files list,
@@ -1443,6 +1832,10 @@ class Pipeline(Process):
         temp_files: list
             list of temporary files for the pipeline execution. The list will
             be modified (completed).
+        temporary_files_manager: TemporaryFilesManager (optional)
+            if given, temporary files are created by this manager (see
+            :class:`capsul.pipeline.temporary_files.TemporaryFilesManager`),
+            otherwise in the default temporary directory.
         """
         process = getattr(node, 'process', None)
         if process is not None and isinstance(process, NipypeProcess):
@@ -1450,6 +1843,15 @@ class Pipeline(Process):
             # file names
             return
 
+        if temporary_files_manager is not None:
+            size_hint = temporary_files_manager.size_hint(node)
+            new_file = lambda suffix: temporary_files_manager.new_file(
+                suffix, size_hint)
+            new_directory = temporary_files_manager.new_directory
+        else:
+            new_file = _new_temporary_file
+            new_directory = lambda: tempfile.mkdtemp(suffix='capsul_run')
+
         for plug_name, plug in six.iteritems(node.plugs):
             value = node.get_plug_value(plug_name)
             if not plug.activated or not plug.enabled:
@@ -1481,7 +1883,7 @@ class Pipeline(Process):
                     tmpdirs = []
                     for i in range(len(value)):
                         if value[i] in ('', traits.Undefined):
-                            tmpdir = tempfile.mkdtemp(suffix='capsul_run')
+                            tmpdir = new_directory()
                             new_value.append(tmpdir)
                             tmpdirs.append(tmpdir)
                         else:
@@ -1497,17 +1899,16 @@ class Pipeline(Process):
                         suffix = 'capsul'
                     for i in range(len(value)):
                         if value[i] in ('', traits.Undefined):
-                            tmpfile = tempfile.mkstemp(suffix=suffix)
-                            tmpfiles.append(tmpfile[1])
-                            os.close(tmpfile[0])
-                            new_value.append(tmpfile[1])
+                            tmpfile = new_file(suffix)
+                            tmpfiles.append(tmpfile)
+                            new_value.append(tmpfile)
                         else:
                             new_value.append(value[i])
                     node.set_plug_value(plug_name, new_value)
                     temp_files.append((node, plug_name, tmpfiles, value))
             else:
                 if trait.trait_type is traits.Directory:
-                    tmpdir = tempfile.mkdtemp(suffix='capsul_run')
+                    tmpdir = new_directory()
                     temp_files.append((node, plug_name, tmpdir, value))
                     node.set_plug_value(plug_name, tmpdir)
                 else:
@@ -1515,10 +1916,9 @@ class Pipeline(Process):
                         suffix = 'capsul' + trait.allowed_extensions[0]
                     else:
                         suffix = 'capsul'
-                    tmpfile = tempfile.mkstemp(suffix=suffix)
-                    node.set_plug_value(plug_name, tmpfile[1])
-                    os.close(tmpfile[0])
-                    temp_files.append((node, plug_name, tmpfile[1], value))
+                    tmpfile = new_file(suffix)
+                    node.set_plug_value(plug_name, tmpfile)
+                    temp_files.append((node, plug_name, tmpfile, value))
 
     def _free_temporary_files(self, temp_files):
         """ Delete and reset temp files after the pipeline execution.
@@ -1532,23 +1932,7 @@ class Pipeline(Process):
             if not isinstance(tmpfiles, list):
                 tmpfiles = [tmpfiles]
             for tmpfile in tmpfiles:
-                if os.path.isdir(tmpfile):
-                    try:
-                        shutil.rmtree(tmpfile)
-                    except:
-                        pass
-                else:
-                    try:
-                        os.unlink(tmpfile)
-                    except:
-                        pass
-                # handle additional files (.hdr, .minf...)
-                # TODO
-                if os.path.exists(tmpfile + '.minf'):
-                    try:
-                        os.unlink(tmpfile + '.minf')
-                    except:
-                        pass
+                remove_temporary_path(tmpfile)
 
     def _run_process(self):
         '''
@@ -1572,18 +1956,19 @@ class Pipeline(Process):
         """
         empty_params = []
         # walk all activated nodes, recursively
-        nodes = [(node_name, node)
-                 for node_name, node in six.iteritems(self.nodes)
-                 if node_name != '' and node.enabled and node.activated]
+        nodes = deque([(node_name, node)
+                       for node_name, node in six.iteritems(self.nodes)
+                       if node_name != '' and node.enabled
+                       and node.activated])
         while nodes:
-            node_name, node = nodes.pop(0)
+            node_name, node = nodes.popleft()
             if hasattr(node, 'process'):
                 process = node.process
                 if isinstance(process, Pipeline):
-                    nodes += [(cnode_name, cnode)
+                    nodes.extend([(cnode_name, cnode)
                         for cnode_name, cnode in six.iteritems(process.nodes)
                         if cnode_name != '' and cnode.enabled
-                        and cnode.activated]
+                        and cnode.activated])
             else:
                 process = node
             # check output plugs; input ones don't work with generated
@@ -2041,12 +2426,14 @@ class Pipeline(Process):
         self.pipeline_steps.add_trait(step_name, Bool(nodes=nodes))
         trait = self.pipeline_steps.trait(step_name)
         setattr(self.pipeline_steps, step_name, enabled)
+        self._invalidate_workflow_cache()
 
     def remove_pipeline_step(self, step_name):
         '''Remove the given step
         '''
         if 'pipeline_steps' in self.user_traits():
             self.pipeline_steps.remove_trait(step_name)
+            self._invalidate_workflow_cache()
 
     def disabled_pipeline_steps_nodes(self):
         '''List nodes disabled for runtime execution
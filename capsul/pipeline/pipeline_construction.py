@@ -158,7 +158,10 @@ class ConstructedPipeline(Pipeline):
     """
     Base class of all pipelines created with PipelineConstructor. It redefines
     pipeline_definition in order to "replay", at each instanciation, the method
-    calls previously recorded with the PipelineConstructor.
+    calls previously recorded with the PipelineConstructor. As any
+    pipeline_definition, calls are replayed within a construction transaction
+    (see :py:meth:`Pipeline.construction_transaction`), so links values
+    propagation, switches refresh and activations are done only once.
     """
     def pipeline_definition(self):
         """
@@ -194,12 +194,19 @@ class Node(Controller):
             # update plugs list
             self.plugs[plug_name] = plug
             # add an event on plug to validate the pipeline
-            plug.on_trait_change(pipeline.update_nodes_and_plugs_activation,
-                                 "enabled")
+            plug.on_trait_change(self._on_enabled_change, "enabled")
 
         # add an event on the Node instance traits to validate the pipeline
-        self.on_trait_change(pipeline.update_nodes_and_plugs_activation,
-                             "enabled")
+        self.on_trait_change(self._on_enabled_change, "enabled")
+
+    def _on_enabled_change(self):
+        """ Callback called when the node or one of its plugs is enabled or
+        disabled: the node is marked as needing an activation update, then
+        the pipeline activations are updated.
+        """
+        self.pipeline._mark_activation_dirty(self)
+        self.pipeline.update_nodes_and_plugs_activation()
+
     @property
     def process(self):
         return get_ref(self._process)
@@ -59,6 +59,7 @@ import sys
 import json
 from datetime import date, time, datetime
 import io
+from collections import deque
 
 # Define the logger
 logger = logging.getLogger(__name__)
@@ -1048,7 +1049,7 @@ def get_output_directories(process):
     '''
     all_dirs = set()
     root_dirs = {}
-    nodes = [(process, '', root_dirs)]
+    nodes = deque([(process, '', root_dirs)])
     disabled_nodes = set()
     if isinstance(process, Pipeline):
         disabled_nodes = set(process.disabled_pipeline_steps_nodes())
@@ -1056,7 +1057,7 @@ def get_output_directories(process):
         disabled_nodes = set(process.process.disabled_pipeline_steps_nodes())
 
     while nodes:
-        node, node_name, dirs = nodes.pop(0)
+        node, node_name, dirs = nodes.popleft()
         plugs = getattr(node, 'plugs', None)
         if plugs is None:
             plugs = node.user_traits()
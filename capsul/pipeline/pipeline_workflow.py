@@ -17,6 +17,10 @@ Functions
 =========
 :func:`workflow_from_pipeline`
 ------------------------------
+:func:`workflow_critical_path`
+------------------------------
+:func:`set_critical_path_priorities`
+------------------------------------
 :func:`workflow_run`
 --------------------
 """
@@ -25,21 +29,28 @@ from __future__ import print_function
 import os
 import socket
 import sys
+import logging
 import six
+from collections import deque
 
 import soma_workflow.client as swclient
 
 from capsul.pipeline.pipeline import Pipeline, Switch
+from capsul.pipeline.pipeline_nodes import ProcessNode
 from capsul.pipeline import pipeline_tools
 from capsul.process.process import Process
-from capsul.pipeline.topological_sort import Graph
-from traits.api import Directory, Undefined, File, Str, Any, List
+from capsul.pipeline.topological_sort import Graph, GraphNode
+from traits.api import Directory, Undefined, File, Str, Any, List, \
+    TraitError
 from soma.sorted_dictionary import OrderedDict
 from .process_iteration import ProcessIteration
 from capsul.attributes import completion_engine_iteration
 from capsul.attributes.completion_engine import ProcessCompletionEngine
 
 
+# Define the logger
+logger = logging.getLogger(__name__)
+
 if sys.version_info[0] >= 3:
     xrange = range
     def six_values(container):
@@ -50,7 +61,10 @@ else:
 
 
 def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
-                           jobs_priority=0, create_directories=True):
+                           jobs_priority=0, create_directories=True,
+                           stream=None, critical_path_priorities=False,
+                           process_costs=None, job_processes=None,
+                           resource_requests=None, worker_pool=None):
     """ Create a soma-workflow workflow from a Capsul Pipeline
 
     Parameters
@@ -74,11 +88,51 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
     create_directories: bool (optional, default: True)
         if set, needed output directories (which will contain output files)
         will be created in a first job, which all other ones depend on.
+    stream: WorkflowStreamWriter (optional)
+        if given, the jobs of each iteration are written to the stream as
+        soon as the iteration is built instead of being kept in memory, and
+        the workflow is not built. See
+        :mod:`capsul.pipeline.pipeline_workflow_stream`.
+    critical_path_priorities: bool (optional, default: False)
+        if set, jobs priorities are raised above jobs_priority according to
+        the estimated duration of the longest chain of jobs they start (see
+        :func:`set_critical_path_priorities`), so that long chains of jobs
+        are started first. The estimated makespan of the workflow is logged.
+        Not used if stream is given.
+    process_costs: dict or callable (optional)
+        estimated durations of processes, in seconds, used when
+        critical_path_priorities is set. Either a dict whose keys are
+        processes identifiers (Process.id) or names, or a function taking a
+        process and returning its duration, or None if it is unknown. When
+        the duration of a process is not given, its ``estimated_duration``
+        attribute is used if it exists, otherwise its jobs have a cost of 1.
+        Jobs running several iterations cost the duration of one iteration
+        times the number of iterations.
+    job_processes: dict (optional)
+        if given, it is filled with {job: (process id, parameters hash,
+        iterations)} for each process job, where parameters hash identifies
+        the process parameters values of the job (see
+        :func:`capsul.engine.runtime_history.parameters_hash`, None for jobs
+        running several iterations), and iterations is the number of
+        iterations the job runs. This allows to record jobs executions in
+        the runtime history.
+    resource_requests: callable (optional)
+        function taking a process and the number of iterations run by its
+        job, and returning the native specification (cluster resources
+        requests) of the job, or None. Processes which have a
+        ``native_specification`` attribute keep it. See
+        :class:`capsul.engine.runtime_history.ResourceRequests`, which
+        derives the requests from recorded executions.
+    worker_pool: WorkerPool (optional)
+        if given, python jobs are run by the long-lived python workers of
+        the pool instead of starting a new python interpreter each (see
+        :class:`capsul.engine.worker_pool.WorkerPool`). The pool must be
+        running while the workflow is executed.
 
     Returns
     -------
     workflow: Workflow
-        a soma-workflow workflow
+        a soma-workflow workflow, or None if stream is given
     """
 
     class TempFile(str):
@@ -176,9 +230,27 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
                 return item
         return None
 
+    def _item_transfer(path, trait):
+        # FileTransfer of a path of an iteration run in a job running
+        # several ones, shared by all the jobs using this path
+        if not isinstance(path, six.string_types) \
+                or not isinstance(trait.trait_type, (File, Directory)):
+            return None
+        transfer = items_transfers.get(path)
+        if transfer is None:
+            for tpath in swf_paths[0]:
+                if path.startswith(os.path.join(tpath, '')):
+                    transfer = swclient.FileTransfer(
+                        is_input=not trait.output, client_path=path,
+                        client_paths=_files_group(path, merged_formats))
+                    items_transfers[path] = transfer
+                    break
+        return transfer
+
     def build_job(process, temp_map={}, shared_map={}, transfers=[{}, {}],
                   shared_paths={}, forbidden_temp=set(), name='', priority=0,
-                  step_name=''):
+                  step_name='', commandline=None, iterations=1,
+                  parameters_list=None):
         """ Create a soma-workflow Job from a Capsul Process
 
         Parameters
@@ -200,27 +272,46 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
             priority assigned to the job
         step_name: str (optional)
             the step name will be stored in the job user_storage variable
+        commandline: list of str (optional)
+            the job command, defaults to process.get_commandline()
+        iterations: int (optional)
+            number of iterations of the process run by the job
+        parameters_list: list of dict (optional)
+            parameters values of each iteration run by the job, when it runs
+            several ones (see :meth:`~capsul.process.process.Process.get_batch_commandline`).
+            Their paths are translated, and their temporary files and file
+            transfers are referenced by the job. By default the current
+            values of the process parameters are used.
 
         Returns
         -------
         job: Job
             a soma-workflow Job instance that will execute the CAPSUL process
         """
-        def _replace_in_list(rlist, temp_map):
+        def _replace_in_list(rlist, temp_map, shared_map):
+            # temporary and shared paths are substituted in a single pass
             for i, item in enumerate(rlist):
-                if item in temp_map:
-                    value = temp_map[item]
-                    value = value.__class__(value)
-                    if hasattr(item, 'pattern'):
-                        # temp case (differs from shared case)
-                        value.pattern = item.pattern
-                    rlist[i] = value
-                elif isinstance(item, (list, tuple)):
+                if isinstance(item, (list, tuple)):
                     deeperlist = list(item)
-                    _replace_in_list(deeperlist, temp_map)
+                    _replace_in_list(deeperlist, temp_map, shared_map)
                     rlist[i] = deeperlist
                 elif item is Undefined:
                     rlist[i] = ''
+                elif isinstance(item, TempFile):
+                    value = temp_map.get(item)
+                    if value is not None:
+                        # duplicate swf temp and copy pattern into it
+                        value = value.__class__(value)
+                        value.pattern = item.pattern
+                        rlist[i] = value
+                else:
+                    try:
+                        value = shared_map.get(item)
+                    except TypeError:
+                        # unhashable item
+                        continue
+                    if value is not None:
+                        rlist[i] = value.__class__(value)
 
         def _replace_transfers(rlist, process, itransfers, otransfers):
             param_name = None
@@ -252,9 +343,21 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
         # check for special modified paths in parameters
         input_replaced_paths = []
         output_replaced_paths = []
-        for param_name, parameter in six.iteritems(process.user_traits()):
-            if param_name not in ('nodes_activation', 'selection_changed'):
-                value = getattr(process, param_name)
+        # file transfers of the iterations run by the job: {path: transfer}
+        job_transfers = {}
+        if parameters_list is None:
+            # current values of the process parameters
+            parameters_list = [None]
+        for parameters in parameters_list:
+            for param_name, parameter in six.iteritems(process.user_traits()):
+                if param_name in ('nodes_activation', 'selection_changed'):
+                    continue
+                if parameters is None:
+                    value = getattr(process, param_name)
+                elif param_name in parameters:
+                    value = parameters[param_name]
+                else:
+                    continue
                 if isinstance(value, list):
                     values = value
                 else:
@@ -274,35 +377,56 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
                                     'in the workflkow: %s.%s'
                                     % (job_name, param_name))
                             input_replaced_paths.append(tval)
-                    else:
+                        continue
+                    if shared_paths:
                         _translated_path(value, shared_map, shared_paths,
                                         parameter)
+                    if parameters is not None:
+                        transfer = _item_transfer(value, parameter)
+                        if transfer is not None:
+                            job_transfers[value] = (transfer,
+                                                    bool(parameter.output))
 
         # Get the process command line
-        process_cmdline = process.get_commandline()
+        if commandline is None:
+            process_cmdline = process.get_commandline()
+        else:
+            process_cmdline = list(commandline)
         # and replace in commandline
         iproc_transfers = transfers[0].get(process, {})
         oproc_transfers = transfers[1].get(process, {})
         #proc_transfers = dict(iproc_transfers)
         #proc_transfers.update(oproc_transfers)
-        _replace_in_list(process_cmdline, temp_map)
-        _replace_in_list(process_cmdline, shared_map)
-        _replace_transfers(
-            process_cmdline, process, iproc_transfers, oproc_transfers)
+        _replace_in_list(process_cmdline, temp_map, shared_map)
+        if iproc_transfers or oproc_transfers:
+            _replace_transfers(
+                process_cmdline, process, iproc_transfers, oproc_transfers)
+        if job_transfers:
+            # paths of the iterations follow the python code
+            for i, item in enumerate(process_cmdline[3:]):
+                if isinstance(item, six.string_types) \
+                        and item in job_transfers:
+                    process_cmdline[i + 3] = job_transfers[item][0]
+        if worker_pool is not None:
+            process_cmdline = worker_pool.commandline(process_cmdline)
 
         # handle native specification (cluster-specific specs as in
         # soma-workflow)
         native_spec = getattr(process, 'native_specification', None)
+        if native_spec is None and resource_requests is not None:
+            native_spec = resource_requests(process, iterations)
         # Return the soma-workflow job
         job = swclient.Job(
             name=job_name,
             command=process_cmdline,
             referenced_input_files
                 =input_replaced_paths \
-                    + [x[0] for x in iproc_transfers.values()],
+                    + [x[0] for x in iproc_transfers.values()]
+                    + [x[0] for x in job_transfers.values() if not x[1]],
             referenced_output_files
                 =output_replaced_paths \
-                    + [x[0] for x in oproc_transfers.values()],
+                    + [x[0] for x in oproc_transfers.values()]
+                    + [x[0] for x in job_transfers.values() if x[1]],
             priority=priority,
             native_specification=native_spec)
         # handle parallel job info (as in soma-workflow)
@@ -311,6 +435,15 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
             job.parallel_job_info = parallel_job_info
         if step_name:
             job.user_storage = step_name
+        if job_costs is not None:
+            cost = _process_cost(process, process_costs)
+            if cost is not None:
+                job_costs[job] = cost * iterations
+        if job_processes is not None:
+            job_processes[job] = (
+                process.id,
+                parameters_hash(process) if iterations == 1 else None,
+                iterations)
         return job
 
     def build_group(name, jobs):
@@ -331,16 +464,39 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
         return swclient.Group(jobs, name=name)
 
     def get_jobs(group, groups):
-        gqueue = list(group.elements)
+        gqueue = deque(group.elements)
         jobs = []
         while gqueue:
-            group_or_job = gqueue.pop(0)
+            group_or_job = gqueue.popleft()
             if group_or_job in groups:
-                gqueue += group_or_job.elements
+                gqueue.extend(group_or_job.elements)
             else:
                 jobs.append(group_or_job)
         return jobs
 
+    def set_temporary_value(node, plug_name, value):
+        ''' Set a temporary value (or restore an empty one) on a node plug
+        and on the plugs linked to it. Trait notifications, which are most of
+        the cost of iterations over sub-pipelines, are avoided when only the
+        links callbacks would be notified.
+        '''
+        if (node, plug_name) not in linked_plugs:
+            linked_plugs[(node, plug_name)] = _linked_plugs(node, plug_name)
+        plugs = linked_plugs[(node, plug_name)]
+        if plugs is None:
+            if hasattr(node, 'process'):
+                process = node.process
+            else:
+                process = node
+            setattr(process, plug_name, value)
+            return
+        for process, name in plugs:
+            try:
+                process.trait_setq(**{name: value})
+            except TraitError:
+                # as for links values callbacks
+                pass
+
     def assign_temporary_filenames(pipeline, count_start=0):
         ''' Find and temporarily assign necessary temporary file names'''
         temp_filenames = pipeline.find_empty_parameters()
@@ -377,17 +533,22 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
                 values.append(tmp_file)
             # set a TempFile value to identify the params / value
             if is_list:
-                setattr(process, plug_name, values)
+                set_temporary_value(node, plug_name, values)
             else:
-                setattr(process, plug_name, values[0])
+                set_temporary_value(node, plug_name, values[0])
         return temp_map
 
     def restore_empty_filenames(temporary_map):
       ''' Set back Undefined values to temporarily assigned file names (using
       assign_temporary_filenames()
       '''
+      done = set()
       for tmp_file, item in six.iteritems(temporary_map):
           node, plug_name = item[1:3]
+          if (node, plug_name) in done:
+              # several temp items can be part of the same list
+              continue
+          done.add((node, plug_name))
           if hasattr(node, 'process'):
               process = node.process
           else:
@@ -397,14 +558,11 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
               # FIXME TODO: only restore values in list which correspond to
               # a temporary.
               # Problem: they are sometimes transformed into strings
-              # FIXME: several temp items can be part of the same list,
-              # so this assignment is likely to be done several times.
-              # It could probably be optimized.
               # WARNING: we set "" values instead of Undefined because they may
               # be mandatory
-              setattr(process, plug_name, [''] * len(value))
+              set_temporary_value(node, plug_name, [''] * len(value))
           else:
-              setattr(process, plug_name, Undefined)
+              set_temporary_value(node, plug_name, Undefined)
 
     def _get_swf_paths(study_config):
         computing_resource = getattr(
@@ -505,9 +663,9 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
         in_transfers = {}
         out_transfers = {}
         transfers = [in_transfers, out_transfers]
-        todo_nodes = [pipeline.pipeline_node]
+        todo_nodes = deque([pipeline.pipeline_node])
         while todo_nodes:
-            node = todo_nodes.pop(0)
+            node = todo_nodes.popleft()
             if hasattr(node, 'process'):
                 process = node.process
             else:
@@ -537,11 +695,11 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
                                                 transfer_item)
                             break
             if hasattr(process, 'nodes'):
-                todo_nodes += [sub_node
-                               for name, sub_node
-                                  in six.iteritems(process.nodes)
-                               if name != ''
-                                  and not isinstance(sub_node, Switch)]
+                todo_nodes.extend([sub_node
+                                   for name, sub_node
+                                      in six.iteritems(process.nodes)
+                                   if name != ''
+                                      and not isinstance(sub_node, Switch)])
         return transfers
 
     def _expand_nodes(nodes):
@@ -552,10 +710,10 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
         -------
         set of leaf nodes.
         '''
-        nodes_list = list(nodes)
+        nodes_list = deque(nodes)
         expanded_nodes = set()
         while nodes_list:
-            node = nodes_list.pop(0)
+            node = nodes_list.popleft()
             if not hasattr(node, 'process'):
                 continue # switch or something
             if isinstance(node.process, Pipeline):
@@ -753,6 +911,43 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
                                                          parameter))
             for parameter, value in six.iteritems(outputs):
                 setattr(it_process, parameter, value)
+        elif it_process.get_batch_size() > 1:
+            # one job per batch of iterations
+            process = it_process.process
+            batch_size = it_process.get_batch_size()
+            iterations = it_process.iteration_parameters(size)
+            set_iterative_outputs(it_process, iterations)
+            for start in xrange(0, size, batch_size):
+                batch = iterations[start:start + batch_size]
+                job = build_job(
+                    process, temp_map, shared_map, transfers, shared_paths,
+                    forbidden_temp=remove_temp,
+                    name='%s_%d-%d' % (process.name, start,
+                                       start + len(batch) - 1),
+                    priority=jobs_priority, step_name=step_name,
+                    commandline=process.get_batch_commandline(batch),
+                    iterations=len(batch), parameters_list=batch)
+                jobs[(process, start)] = job
+                root_jobs[(process, start)] = job
+        elif it_process.chunk_size and it_process.chunk_size > 1:
+            # one job per chunk of iterations
+            process = it_process.process
+            chunk_size = it_process.chunk_size
+            iterations = it_process.iteration_parameters(size)
+            set_iterative_outputs(it_process, iterations)
+            for start in xrange(0, size, chunk_size):
+                chunk = iterations[start:start + chunk_size]
+                job = build_job(
+                    process, temp_map, shared_map, transfers, shared_paths,
+                    forbidden_temp=remove_temp,
+                    name='%s_%d-%d' % (process.name, start,
+                                       start + len(chunk) - 1),
+                    priority=jobs_priority, step_name=step_name,
+                    commandline=it_process.get_chunk_commandline(chunk,
+                                                                 start),
+                    iterations=len(chunk), parameters_list=chunk)
+                jobs[(process, start)] = job
+                root_jobs[(process, start)] = job
         else:
             for iteration in xrange(size):
                 for parameter in it_process.iterative_parameters:
@@ -769,6 +964,18 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
                         temp_map, shared_map, transfers,
                         shared_paths, disabled_nodes, remove_temp, steps,
                         study_config, iteration)
+                if stream is not None:
+                    # write the iteration jobs and only keep placeholders
+                    # for its root jobs
+                    sub_root_jobs = OrderedDict(zip(
+                        sub_root_jobs.keys(),
+                        stream.write_block(six_values(sub_jobs),
+                                           sub_dependencies,
+                                           six_values(sub_groups),
+                                           six_values(sub_root_jobs))))
+                    sub_jobs = {}
+                    sub_dependencies = set()
+                    sub_groups = {}
                 jobs.update(dict([((p, iteration), j)
                                   for p, j in six.iteritems(sub_jobs)]))
                 dependencies.update(sub_dependencies)
@@ -778,6 +985,16 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
         return (jobs, dependencies, groups, root_jobs)
 
 
+    def set_iterative_outputs(it_process, iterations):
+        # iterative outputs of the iteration process, as completed for each
+        # iteration
+        for parameter in it_process.iterative_parameters:
+            if it_process.trait(parameter).output:
+                setattr(it_process, parameter,
+                        [parameters.get(parameter, Undefined)
+                         for parameters in iterations])
+
+
     def complete_iteration(it_process, iteration):
         completion_engine = ProcessCompletionEngine.get_completion_engine(
             it_process)
@@ -900,37 +1117,38 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
                 groups.update(sub_groups)
                 dependencies.update(sub_deps)
 
-        # Add dependencies between a source job and destination jobs
-        for node_name, node in six.iteritems(graph._nodes):
-            # Source job
+        # Jobs or groups of each graph node, computed once for each node
+        nodes_jobs = {}
+
+        def get_node_jobs(node):
+            if node.name in nodes_jobs:
+                return nodes_jobs[node.name]
             if isinstance(node.meta, list):
-                if isinstance(node.meta[0].process, ProcessIteration):
-                    sjobs = groups.get(node.meta[0].process)
-                    if not sjobs:
-                        continue # disabled
-                elif node.meta[0].process in jobs:
-                    sjobs = [jobs[node.meta[0].process]]
+                process = node.meta[0].process
+                if isinstance(process, ProcessIteration):
+                    node_jobs = groups.get(process) # None if disabled
+                elif process in jobs:
+                    node_jobs = [jobs[process]]
                 else:
-                    continue # disabled node
+                    node_jobs = None # disabled node
             else:
-                sjobs = [groups[node.meta]]
+                node_jobs = [groups[node.meta]]
+            nodes_jobs[node.name] = node_jobs
+            return node_jobs
+
+        # Add dependencies between a source job and destination jobs
+        for node_name, node in six.iteritems(graph._nodes):
+            # Source job
+            sjobs = get_node_jobs(node)
+            if not sjobs:
+                continue
             # Destination jobs
             for dnode in node.links_to:
-                if isinstance(dnode.meta, list):
-                    if isinstance(dnode.meta[0].process, ProcessIteration):
-                        djobs = groups.get(dnode.meta[0].process)
-                        if not djobs:
-                            continue # disabled
-                    elif dnode.meta[0].process in jobs:
-                        djobs = [jobs[dnode.meta[0].process]]
-                    else:
-                        continue # disabled node
-                else:
-                    djobs = groups[dnode.meta]
-                    if not isinstance(djobs, list):
-                        djobs = [djobs]
-                for djob in djobs:
-                    dependencies.update([(sjob, djob) for sjob in sjobs])
+                djobs = get_node_jobs(dnode)
+                if not djobs:
+                    continue
+                dependencies.update([(sjob, djob) for djob in djobs
+                                     for sjob in sjobs])
 
         # sort root jobs/groups
         root_jobs_list = []
@@ -993,6 +1211,14 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
     if study_config is None:
         study_config = pipeline.get_study_config()
 
+    if job_processes is not None:
+        from capsul.engine.runtime_history import parameters_hash
+
+    # {job: estimated duration}
+    job_costs = None
+    if critical_path_priorities and stream is None:
+        job_costs = {}
+
     if not isinstance(pipeline, Pipeline):
         # "pipeline" is actally a single process (or should, if it is not a
         # pipeline). Get it into a pipeine (with a single node) to make the
@@ -1002,12 +1228,17 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
         new_pipeline.add_process('main', pipeline)
         new_pipeline.autoexport_nodes_parameters()
         pipeline = new_pipeline
+    # plugs linked to the temporary values plugs (see set_temporary_value)
+    linked_plugs = {}
     temp_map = assign_temporary_filenames(pipeline)
     temp_subst_list = [(x1, x2[0]) for x1, x2 in six.iteritems(temp_map)]
     temp_subst_map = dict(temp_subst_list)
     shared_map = {}
 
     swf_paths = _get_swf_paths(study_config)
+    # FileTransfer objects of the iterations run in jobs running several
+    # iterations (see build_job): {path: transfer}
+    items_transfers = {}
     transfers = _get_transfers(pipeline, swf_paths[0], merged_formats)
     #print('disabling nodes:', disabled_nodes)
     # get complete list of disabled leaf nodes
@@ -1031,6 +1262,8 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
         dirs_job = _create_directories_job(
             pipeline, shared_map=shared_map, shared_paths=swf_paths[1],
             transfer_paths=swf_paths[0])
+        if stream is not None and dirs_job is not None:
+            dirs_job = stream.write_initial_job(dirs_job)
 
     # build steps map
     steps = {}
@@ -1046,13 +1279,23 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
         (jobs, dependencies, groups, root_jobs) = workflow_from_graph(
             graph, temp_subst_map, shared_map, transfers, swf_paths[1],
             disabled_nodes=disabled_nodes, forbidden_temp=remove_temp,
-            steps=steps, study_config=study_config)
+            jobs_priority=jobs_priority, steps=steps,
+            study_config=study_config)
     finally:
         restore_empty_filenames(temp_map)
 
     all_jobs = six_values(jobs)
     root_jobs = six_values(root_jobs)
 
+    if stream is not None:
+        # write the remaining jobs
+        if create_directories and dirs_job is not None:
+            root_jobs.insert(0, dirs_job)
+        root_jobs = stream.write_block(all_jobs, dependencies,
+                                       six_values(groups), root_jobs)
+        stream.write_workflow(pipeline.name, root_jobs)
+        return None
+
     # if directories have to be created, all other primary jobs will depend
     # on this first one
     if create_directories and dirs_job is not None:
@@ -1070,9 +1313,184 @@ def workflow_from_pipeline(pipeline, study_config=None, disabled_nodes=None,
         root_group=root_jobs,
         name=pipeline.name)
 
+    if job_costs is not None:
+        report = set_critical_path_priorities(workflow, job_costs,
+                                              base_priority=jobs_priority)
+        logger.info('workflow %s: estimated makespan: %g, total cost: %g, '
+                    'critical path: %d jobs'
+                    % (pipeline.name, report['makespan'],
+                       report['total_cost'], len(report['critical_path'])))
+
     return workflow
 
 
+def _only_link_notifiers(process, plug_name, links):
+    ''' True if the callbacks notified when a process parameter is set are
+    exactly the given links callbacks. This reads traits notifiers lists,
+    which are not part of the public traits API: if they cannot be read or
+    do not hold the links callbacks as they used to, False is returned, so
+    that values are set with notifications.
+    '''
+    if not links:
+        # no link callback to recognize the notifiers list
+        return False
+    try:
+        if process._notifiers(True):
+            return False
+        handlers = [getattr(notifier, 'handler', None) for notifier
+                    in process._trait(plug_name, 0)._notifiers(True)]
+    except (AttributeError, TypeError):
+        return False
+    callbacks = [link[2] for link in links]
+    return len(handlers) == len(callbacks) \
+        and set(map(id, handlers)) == set(map(id, callbacks))
+
+
+def _linked_plugs(node, plug_name):
+    ''' Plugs reached by a value set on a node plug through the pipeline
+    links, as a list of (process, plug_name), including the node plug itself.
+    None if other callbacks than the links ones would be notified on the way
+    (process callbacks, switches, sub-pipelines...), or if it cannot be
+    checked (see :func:`_only_link_notifiers`): the value has then to be set
+    with notifications.
+    '''
+    plugs = []
+    done = set()
+    todo = deque([(node, plug_name)])
+    while todo:
+        node, plug_name = todo.popleft()
+        if (node, plug_name) in done:
+            continue
+        done.add((node, plug_name))
+        if type(node) is not ProcessNode \
+                or isinstance(node.process, Pipeline):
+            return None
+        process = node.process
+        links = [(key[1], key[2], callback)
+                 for key, callback in six.iteritems(node._callbacks)
+                 if key[0] == plug_name]
+        if not _only_link_notifiers(process, plug_name, links):
+            return None
+        plugs.append((process, plug_name))
+        todo.extend([link[:2] for link in links])
+    return plugs
+
+
+def _process_cost(process, process_costs):
+    ''' Estimated duration of a process (see workflow_from_pipeline), or None
+    '''
+    cost = None
+    if callable(process_costs):
+        cost = process_costs(process)
+    elif process_costs:
+        for key in (getattr(process, 'id', None), process.name):
+            cost = process_costs.get(key)
+            if cost is not None:
+                break
+    if cost is None:
+        cost = getattr(process, 'estimated_duration', None)
+    return cost
+
+
+def workflow_critical_path(workflow, job_costs, default_cost=1.):
+    ''' Estimate the duration of a workflow from the costs of its jobs.
+
+    The makespan of the workflow cannot be shorter than its critical path:
+    the chain of dependent jobs with the highest total cost. Barrier jobs
+    have no cost.
+
+    Parameters
+    ----------
+    workflow: Workflow (mandatory)
+        soma-workflow workflow
+    job_costs: dict or callable (mandatory)
+        estimated durations of jobs, either a dict {job: duration} or a
+        function taking a job and returning its duration (or None if it is
+        unknown)
+    default_cost: float (optional)
+        duration of jobs which are not in job_costs
+
+    Returns
+    -------
+    report: dict
+        with the following items:
+
+        - makespan: estimated duration of the workflow with unlimited
+          resources (the cost of the critical path)
+        - total_cost: sum of the costs of jobs, i.e. the duration of the
+          workflow run sequentially
+        - critical_path: list of jobs of the critical path, in execution
+          order
+        - lengths: {job: cost of the longest chain of jobs starting with
+          this job}
+    '''
+    graph = Graph()
+    jobs = workflow.jobs
+    job_indices = {}
+    for i, job in enumerate(jobs):
+        job_indices[job] = i
+        graph.add_node(GraphNode(i, job))
+    for from_job, to_job in workflow.dependencies:
+        graph.add_link(job_indices[from_job], job_indices[to_job])
+
+    if callable(job_costs):
+        get_cost = job_costs
+    else:
+        get_cost = job_costs.get
+    costs = {}
+    for i, job in enumerate(jobs):
+        if isinstance(job, swclient.BarrierJob):
+            cost = 0.
+        else:
+            cost = get_cost(job)
+            if cost is None:
+                cost = default_cost
+        costs[i] = cost
+
+    lengths = graph.critical_path_lengths(costs)
+    makespan, path = graph.critical_path(costs)
+    return {'makespan': makespan,
+            'total_cost': sum(six.itervalues(costs)),
+            'critical_path': [jobs[i] for i in path],
+            'lengths': dict((jobs[i], length)
+                            for i, length in six.iteritems(lengths))}
+
+
+def set_critical_path_priorities(workflow, job_costs, base_priority=0,
+                                 default_cost=1.):
+    ''' Set the priorities of the workflow jobs according to the cost of the
+    longest chain of jobs they start: jobs which delay the end of the
+    workflow the most are run first when jobs compete for resources.
+
+    Priorities are base_priority plus the rank of the job chain cost among
+    the costs of all jobs chains, so jobs at the end of the workflow keep
+    base_priority.
+
+    Parameters
+    ----------
+    workflow: Workflow (mandatory)
+        soma-workflow workflow, modified in place
+    job_costs: dict or callable (mandatory)
+        estimated durations of jobs, see :func:`workflow_critical_path`
+    base_priority: int (optional)
+        lowest priority
+    default_cost: float (optional)
+        duration of jobs which are not in job_costs
+
+    Returns
+    -------
+    report: dict
+        the workflow estimated durations, see :func:`workflow_critical_path`
+    '''
+    report = workflow_critical_path(workflow, job_costs, default_cost)
+    lengths = report['lengths']
+    ranks = dict((length, rank) for rank, length
+                 in enumerate(sorted(set(six.itervalues(lengths)))))
+    for job, length in six.iteritems(lengths):
+        job.priority = base_priority + ranks[length]
+    return report
+
+
 def workflow_run(workflow_name, workflow, study_config):
     """ Create a soma-workflow controller and submit a workflow
 
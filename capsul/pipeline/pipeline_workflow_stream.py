@@ -0,0 +1,537 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+"""Streaming export of Capsul pipelines into soma-workflow workflows.
+
+:func:`~capsul.pipeline.pipeline_workflow.workflow_from_pipeline` keeps all
+the jobs, dependencies and groups of a workflow in memory. For very large
+iterations, :func:`write_workflow_stream` writes the jobs of each iteration
+to a file as soon as the iteration is built, so that the memory used during
+the generation does not grow with the number of iterations.
+
+The stream is a JSON lines file: each line is a record which is a dict with
+a "type" key:
+
+* "file_transfer", "shared_resource_path", "temporary_path", "option_path":
+  a soma-workflow special path, with its "id" and its serialized "path";
+* "job": a soma-workflow job, with its "id" and its serialized "job", where
+  special paths are given by their ids;
+* "group": a group of jobs, with its "id", "name" and "elements" ids;
+* "dependencies": a list of "items", (source id, destination id) pairs, ids
+  being jobs or groups ids;
+* "workflow": the last record, with the workflow "name" and "root_group"
+  elements ids.
+
+Elements are always written before the records which reference them.
+
+Standard use case::
+
+    write_workflow_stream(pipeline, 'workflow.jsonl')
+    # whole workflow
+    workflow = read_workflow_stream('workflow.jsonl')
+    # or submission by chunks of at most 10000 jobs
+    submit_workflow_stream('workflow.jsonl', study_config, max_jobs=10000)
+
+Classes
+=======
+:class:`WorkflowStreamWriter`
+-----------------------------
+
+Functions
+=========
+:func:`write_workflow_stream`
+-----------------------------
+:func:`read_workflow_stream`
+----------------------------
+:func:`workflow_stream_chunks`
+------------------------------
+:func:`submit_workflow_stream`
+------------------------------
+"""
+
+from __future__ import print_function
+import json
+import importlib
+import six
+from collections import deque
+
+import soma_workflow.client as swclient
+from soma_workflow import client_types
+from soma_workflow.utils import to_json, from_json
+
+
+# special paths records types and classes
+_path_types = (
+    ('file_transfer', swclient.FileTransfer),
+    ('shared_resource_path', swclient.SharedResourcePath),
+    ('temporary_path', swclient.TemporaryPath),
+    ('option_path', swclient.OptionPath),
+)
+_path_classes = dict(_path_types)
+_path_index = dict((path_type, i)
+                   for i, (path_type, path_class) in enumerate(_path_types))
+
+
+class _StreamedElement(object):
+    ''' Stands for a job or a group which has already been written in a
+    workflow stream.
+    '''
+    def __init__(self, ident, name):
+        self.id = ident
+        self.name = name
+
+
+class _IdMap(dict):
+    ''' Objects ids dict recording the keys which have been added, used to
+    write the special paths records as soon as they are referenced.
+    '''
+    def __init__(self):
+        super(_IdMap, self).__init__()
+        self.new_keys = []
+
+    def __setitem__(self, key, value):
+        super(_IdMap, self).__setitem__(key, value)
+        self.new_keys.append(key)
+
+
+class WorkflowStreamWriter(object):
+    ''' Writes a workflow to a stream (JSON lines file) by blocks of jobs.
+
+    Written jobs and groups are replaced by lightweight placeholders, which
+    can be used as elements of groups and dependencies written later. See
+    the module documentation for the records format.
+
+    Attributes
+    ----------
+    `job_count`: int
+        number of jobs written in the stream.
+    '''
+
+    def __init__(self, fileobj):
+        ''' Initialize the WorkflowStreamWriter class.
+
+        Parameters
+        ----------
+        fileobj: file object
+            the opened (text) file to write to.
+        '''
+        self.file = fileobj
+        self.job_count = 0
+        self._id_generator = client_types.IdGenerator()
+        self._path_ids = [_IdMap() for path_type in _path_types]
+        self._initial_job = None
+
+    def _write(self, record):
+        self.file.write(json.dumps(to_json(record)))
+        self.file.write('\n')
+
+    def _write_job(self, job):
+        ident = self._id_generator.generate_id()
+        job_dict = job.to_dict(self._id_generator, *self._path_ids)
+        # write the special paths used by the job before it
+        for (path_type, path_class), ids in zip(_path_types, self._path_ids):
+            for path in ids.new_keys:
+                if path_type == 'option_path':
+                    path_dict = path.to_dict(self._id_generator,
+                                             *self._path_ids)
+                else:
+                    path_dict = path.to_dict()
+                self._write({'type': path_type, 'id': ids[path],
+                             'path': path_dict})
+            del ids.new_keys[:]
+        self._write({'type': 'job', 'id': ident, 'job': job_dict})
+        self.job_count += 1
+        return ident
+
+    def write_initial_job(self, job):
+        ''' Write a job which all the jobs without dependencies in each
+        block will depend on (typically the output directories creation
+        job). It must be written before any block.
+
+        Returns
+        -------
+        placeholder: job placeholder
+        '''
+        self._initial_job = self._write_job(job)
+        return _StreamedElement(self._initial_job, job.name)
+
+    def write_block(self, jobs, dependencies, groups, elements):
+        ''' Write a block of jobs, groups and dependencies.
+
+        Parameters
+        ----------
+        jobs: iterable
+            jobs of the block (placeholders are allowed)
+        dependencies: iterable
+            (source, destination) pairs of jobs, groups or placeholders
+        groups: iterable
+            groups of the block, or lists of groups
+        elements: iterable
+            jobs or groups which are used outside of the block
+
+        Returns
+        -------
+        placeholders: list
+            the placeholders of elements, in the same order.
+        '''
+        ids = {}
+        block_jobs = []
+
+        def element_id(element):
+            if isinstance(element, _StreamedElement):
+                return element.id
+            ident = ids.get(element)
+            if ident is None:
+                if isinstance(element, swclient.Group):
+                    elements_ids = [element_id(item)
+                                    for item in element.elements]
+                    ident = self._id_generator.generate_id()
+                    self._write({'type': 'group', 'id': ident,
+                                 'name': element.name,
+                                 'elements': elements_ids})
+                else:
+                    ident = self._write_job(element)
+                    block_jobs.append(ident)
+                ids[element] = ident
+            return ident
+
+        for job in jobs:
+            element_id(job)
+        for group in groups:
+            if isinstance(group, list):
+                for item in group:
+                    element_id(item)
+            else:
+                element_id(group)
+        items = [(element_id(source), element_id(dest))
+                 for source, dest in dependencies]
+        if self._initial_job is not None:
+            dependent = set(dest for source, dest in items)
+            items += [(self._initial_job, ident) for ident in block_jobs
+                      if ident not in dependent]
+        if items:
+            self._write({'type': 'dependencies', 'items': items})
+        return [_StreamedElement(element_id(element), element.name)
+                for element in elements]
+
+    def write_workflow(self, name, root_group):
+        ''' Write the final workflow record. Jobs and groups of the root
+        group are normally placeholders returned by :meth:`write_block`:
+        other ones are written first.
+        '''
+        root_group = self.write_block([], [], [], root_group)
+        self._write({'type': 'workflow', 'name': name,
+                     'root_group': [element.id for element in root_group]})
+
+
+def write_workflow_stream(pipeline, filename, study_config=None,
+                          disabled_nodes=None, jobs_priority=0,
+                          create_directories=True):
+    """ Write the soma-workflow workflow of a pipeline to a JSON lines file,
+    iteration by iteration.
+
+    Parameters are the same as in
+    :func:`~capsul.pipeline.pipeline_workflow.workflow_from_pipeline`.
+
+    Returns
+    -------
+    job_count: int
+        the number of written jobs
+    """
+    from capsul.pipeline.pipeline_workflow import workflow_from_pipeline
+
+    with open(filename, 'w') as f:
+        writer = WorkflowStreamWriter(f)
+        workflow_from_pipeline(
+            pipeline, study_config=study_config,
+            disabled_nodes=disabled_nodes, jobs_priority=jobs_priority,
+            create_directories=create_directories, stream=writer)
+    return writer.job_count
+
+
+def _iter_records(filename):
+    ''' Iterate over the records of a workflow stream, as (offset, record)
+    pairs.
+    '''
+    with open(filename, 'rb') as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            yield offset, from_json(json.loads(line.decode('utf-8')))
+
+
+def _build_path(record, paths):
+    path_class = _path_classes[record['type']]
+    if record['type'] == 'option_path':
+        return path_class.from_dict(record['path'], *paths)
+    return path_class.from_dict(record['path'])
+
+
+def _build_job(job_dict, paths):
+    cls_name = job_dict.get('class', 'soma_workflow.client_types.Job')
+    module_name, class_name = cls_name.rsplit('.', 1)
+    job_class = getattr(importlib.import_module(module_name), class_name)
+    return job_class.from_dict(job_dict, *paths)
+
+
+def read_workflow_stream(filename):
+    """ Load a workflow written by :func:`write_workflow_stream`.
+
+    Returns
+    -------
+    workflow: Workflow
+        the soma-workflow workflow
+    """
+    paths = [{} for path_type in _path_types]
+    elements = {}
+    jobs = []
+    dependencies = []
+    workflow = None
+    for offset, record in _iter_records(filename):
+        record_type = record['type']
+        if record_type == 'job':
+            job = _build_job(record['job'], paths)
+            elements[record['id']] = job
+            jobs.append(job)
+        elif record_type == 'group':
+            elements[record['id']] = swclient.Group(
+                [elements[i] for i in record['elements']],
+                name=record['name'])
+        elif record_type == 'dependencies':
+            dependencies += [(elements[source], elements[dest])
+                             for source, dest in record['items']]
+        elif record_type == 'workflow':
+            workflow = swclient.Workflow(
+                jobs=jobs, dependencies=dependencies,
+                root_group=[elements[i] for i in record['root_group']],
+                name=record['name'])
+        else:
+            paths[_path_index[record_type]][record['id']] \
+                = _build_path(record, paths)
+    if workflow is None:
+        raise ValueError('Incomplete workflow stream: %s' % filename)
+    return workflow
+
+
+def _referenced_ids(value, ids):
+    ''' Collect the special paths ids referenced in a serialized job.
+    '''
+    if isinstance(value, tuple) and len(value) == 2 and value[0] == '<id>':
+        ids.add(value[1])
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _referenced_ids(item, ids)
+    elif isinstance(value, dict):
+        for item in six.itervalues(value):
+            _referenced_ids(item, ids)
+
+
+def workflow_stream_chunks(filename, max_jobs=10000):
+    """ Split a workflow written by :func:`write_workflow_stream` into
+    several workflows of at most max_jobs jobs, which must be run one after
+    the other.
+
+    Chunks follow the dependencies order. Jobs using the same temporary
+    file are always in the same chunk (temporary files are deleted at the
+    end of each workflow), thus a chunk may exceed max_jobs if more jobs
+    share temporaries. Groups and dependencies are kept inside each chunk.
+
+    Only jobs offsets in the file, ids and dependencies are kept in memory
+    for the whole workflow: the jobs of each chunk are loaded when the chunk
+    is built.
+
+    Yields
+    ------
+    workflow: Workflow
+        the soma-workflow workflow of each chunk
+    """
+    paths = [{} for path_type in _path_types]
+    job_offsets = {}
+    group_elements = {}
+    group_names = {}
+    dependencies = []
+    root_group = []
+    name = None
+    # union-find of jobs sharing temporary files
+    parent = {}
+    temp_users = {}
+
+    def find(ident):
+        root = ident
+        while parent[root] != root:
+            root = parent[root]
+        while parent[ident] != root:
+            parent[ident], ident = root, parent[ident]
+        return root
+
+    for offset, record in _iter_records(filename):
+        record_type = record['type']
+        if record_type == 'job':
+            ident = record['id']
+            job_offsets[ident] = offset
+            parent[ident] = ident
+            used_ids = set()
+            _referenced_ids(record['job'], used_ids)
+            for temp_id in used_ids.intersection(
+                    paths[_path_index['temporary_path']]):
+                other = temp_users.setdefault(temp_id, ident)
+                parent[find(ident)] = find(other)
+        elif record_type == 'group':
+            group_elements[record['id']] = record['elements']
+            group_names[record['id']] = record['name']
+        elif record_type == 'dependencies':
+            dependencies += [tuple(item) for item in record['items']]
+        elif record_type == 'workflow':
+            root_group = record['root_group']
+            name = record['name']
+        else:
+            paths[_path_index[record_type]][record['id']] \
+                = _build_path(record, paths)
+    temp_users = None
+
+    # graph of units (jobs sharing temporaries) and groups: a group has a
+    # start node (preceding its elements) and an end node (following them)
+    units = {}
+    for ident in sorted(job_offsets):
+        units.setdefault(find(ident), []).append(ident)
+    successors = {}
+    in_degree = {}
+
+    def start_node(ident):
+        if ident in group_elements:
+            return ('start', ident)
+        return find(ident)
+
+    def end_node(ident):
+        if ident in group_elements:
+            return ('end', ident)
+        return find(ident)
+
+    def add_edge(source, dest):
+        if source != dest:
+            successors.setdefault(source, []).append(dest)
+            in_degree[dest] = in_degree.get(dest, 0) + 1
+
+    for group, elements in six.iteritems(group_elements):
+        for element in elements:
+            add_edge(('start', group), start_node(element))
+            add_edge(end_node(element), ('end', group))
+    for source, dest in dependencies:
+        add_edge(end_node(source), start_node(dest))
+
+    nodes = list(units) + [(kind, group) for group in group_elements
+                           for kind in ('start', 'end')]
+    ready = deque(node for node in nodes if not in_degree.get(node))
+    chunk = []
+    placed = set()
+    while ready:
+        node = ready.popleft()
+        if node in units:
+            if chunk and len(chunk) + len(units[node]) > max_jobs:
+                yield _chunk_workflow(filename, chunk, job_offsets, paths,
+                                      group_elements, group_names,
+                                      dependencies, root_group, name)
+                chunk = []
+            chunk += units[node]
+            placed.add(node)
+        for successor in successors.get(node, []):
+            in_degree[successor] -= 1
+            if in_degree[successor] == 0:
+                ready.append(successor)
+    # units which depend on each other through jobs sharing temporaries
+    # cannot be ordered: they all go in the last chunk, which keeps their
+    # dependencies
+    for unit, unit_jobs in six.iteritems(units):
+        if unit not in placed:
+            chunk += unit_jobs
+    if chunk:
+        yield _chunk_workflow(filename, chunk, job_offsets, paths,
+                              group_elements, group_names, dependencies,
+                              root_group, name)
+
+
+def _chunk_workflow(filename, chunk, job_offsets, paths, group_elements,
+                    group_names, dependencies, root_group, name):
+    ''' Build the workflow of a chunk of jobs.
+    '''
+    elements = {}
+    jobs = []
+    with open(filename, 'rb') as f:
+        for ident in sorted(chunk):
+            f.seek(job_offsets[ident])
+            record = from_json(json.loads(f.readline().decode('utf-8')))
+            job = _build_job(record['job'], paths)
+            elements[ident] = job
+            jobs.append(job)
+
+    def restricted(ident):
+        # job or group restricted to the chunk jobs, None if empty
+        if ident in elements:
+            return elements[ident]
+        if ident not in group_elements:
+            return None # job of another chunk
+        items = [restricted(item) for item in group_elements[ident]]
+        items = [item for item in items if item is not None]
+        if items:
+            group = swclient.Group(items, name=group_names[ident])
+        else:
+            group = None
+        elements[ident] = group
+        return group
+
+    chunk_dependencies = []
+    for source, dest in dependencies:
+        source = restricted(source)
+        dest = restricted(dest)
+        if source is not None and dest is not None:
+            chunk_dependencies.append((source, dest))
+    root = [restricted(ident) for ident in root_group]
+    return swclient.Workflow(
+        jobs=jobs, dependencies=chunk_dependencies,
+        root_group=[element for element in root if element is not None],
+        name=name)
+
+
+def submit_workflow_stream(filename, study_config, max_jobs=10000,
+                           name=None):
+    """ Run a workflow written by :func:`write_workflow_stream` by chunks of
+    at most max_jobs jobs (see :func:`workflow_stream_chunks`), each chunk
+    being submitted when the previous one has succeeded.
+
+    Parameters
+    ----------
+    filename: str (mandatory)
+        the workflow stream file
+    study_config: StudyConfig (mandatory)
+        contains needed configuration through the SomaWorkflowConfig module
+    max_jobs: int (optional)
+        maximum number of jobs of each submitted workflow
+    name: str (optional)
+        workflows names prefix, defaults to the workflow name
+
+    Returns
+    -------
+    workflows_ids: list
+        ids of the submitted workflows
+    """
+    from capsul.pipeline.pipeline_workflow import workflow_run
+
+    workflows_ids = []
+    for i, workflow in enumerate(workflow_stream_chunks(filename,
+                                                        max_jobs)):
+        workflow_name = '%s_%d' % (name or workflow.name, i)
+        controller, wf_id = workflow_run(workflow_name, workflow,
+                                         study_config)
+        workflows_ids.append(wf_id)
+        failed = swclient.Helper.list_failed_jobs(wf_id, controller)
+        if failed:
+            raise RuntimeError('Workflow %s failed: %d failed jobs'
+                               % (workflow_name, len(failed)))
+    return workflows_ids
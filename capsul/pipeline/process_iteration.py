@@ -14,11 +14,21 @@ Classes
 =======
 :class:`ProcessIteration`
 -------------------------
+:class:`IterationError`
+-----------------------
 '''
 
+import os
 import sys
+import logging
+import multiprocessing
 import six
 from traits.api import List, Undefined
+try:
+    import concurrent.futures as futures
+except ImportError:
+    # python 2 without the "futures" backport
+    futures = None
 
 from capsul.process.process import Process
 from capsul.study_config.process_instance import get_process_instance
@@ -29,10 +39,244 @@ from traits.api import File, Directory
 if sys.version_info[0] >= 3:
     xrange = range
 
+# Define the logger
+logger = logging.getLogger(__name__)
+
+
+class IterationError(Exception):
+    ''' Error raised when some iterations of a parallel
+    :class:`ProcessIteration` execution failed. The other iterations have
+    been executed and their outputs are set.
+
+    Attributes
+    ----------
+    errors: dict
+        {iteration index: exception} for each failed iteration
+    '''
+    def __init__(self, errors):
+        super(IterationError, self).__init__(
+            '%d iteration(s) failed: %s'
+            % (len(errors),
+               ', '.join('%d (%s)' % (iteration, errors[iteration])
+                         for iteration in sorted(errors))))
+        self.errors = errors
+
+
+def _iteration_process(process_type, study_config):
+    ''' Build a new instance of an iterated process.
+
+    study_config is either a StudyConfig instance or, when the iteration runs
+    in another process, a tuple (modules, configuration dict) used to build
+    one.
+    '''
+    if isinstance(study_config, tuple):
+        from capsul.study_config.study_config import StudyConfig
+        modules, config = study_config
+        study_config = StudyConfig(init_config=config, modules=modules)
+    return get_process_instance(process_type, study_config=study_config)
+
+
+def _run_iteration(process_type, parameters, outputs, study_config):
+    ''' Execute one iteration of a parallel :class:`ProcessIteration` in a
+    new instance of the iterated process, and return the values of its
+    iterative outputs.
+    '''
+    process = _iteration_process(process_type, study_config)
+    for name, value in six.iteritems(parameters):
+        setattr(process, name, value)
+    process()
+    return dict((name, getattr(process, name)) for name in outputs)
+
+
+def _run_batch(process_type, parameters_list, outputs, study_config):
+    ''' Execute a batch of iterations of a :class:`ProcessIteration` in a
+    single call of the iterated process
+    :meth:`~capsul.process.process.Process._run_process_batch` method, and
+    return the list of the values of their iterative outputs.
+    '''
+    process = _iteration_process(process_type, study_config)
+    results = process._run_process_batch(parameters_list)
+    if results is None:
+        results = [{}] * len(parameters_list)
+    if len(results) != len(parameters_list):
+        raise ValueError('_run_process_batch() of %s returned %d results '
+                         'for %d items' % (process.id, len(results),
+                                           len(parameters_list)))
+    return [dict((name, result.get(name, parameters.get(name, Undefined)))
+                 for name in outputs)
+            for parameters, result in zip(parameters_list, results)]
+
+
+def _execute_iterations(process_type, iterations, outputs, study_config,
+                        max_workers=1, parallel_mode='process', batch_size=1,
+                        report=None):
+    ''' Execute iterations of a process, possibly by batches, in a pool of
+    workers (or sequentially in the calling thread if max_workers is 1 or if
+    the concurrent.futures module is not available).
+
+    Parameters
+    ----------
+    process_type: Process class or identifier
+        the iterated process
+    iterations: list of dict
+        parameters of each iteration
+    outputs: list of str
+        iterative outputs to gather
+    study_config: StudyConfig or tuple
+        see :func:`_iteration_process`
+    max_workers: int
+        number of workers
+    parallel_mode: str
+        'process' or 'thread' pool
+    batch_size: int
+        if greater than 1, the process batch protocol is used
+    report: callable (optional)
+        called as report(index, error) when each iteration is finished,
+        error being None for successful iterations.
+
+    Returns
+    -------
+    results: list
+        for each iteration, the dict of its outputs values, or None if it
+        failed
+    errors: dict
+        {iteration index: exception} for each failed iteration
+    '''
+    size = len(iterations)
+    results = [None] * size
+    errors = {}
+
+    def collect(batch, result, error):
+        if error is not None:
+            for iteration in batch:
+                errors[iteration] = error
+                if report is not None:
+                    report(iteration, error)
+            return
+        if batch_size == 1:
+            result = [result]
+        for iteration, item in zip(batch, result):
+            results[iteration] = item
+            if report is not None:
+                report(iteration, None)
+
+    # (indices of the iterations, function, arguments) of each call
+    calls = []
+    if batch_size > 1:
+        for start in xrange(0, size, batch_size):
+            batch = list(xrange(start, min(start + batch_size, size)))
+            calls.append((batch, _run_batch,
+                          (process_type, [iterations[i] for i in batch],
+                           outputs, study_config)))
+    else:
+        for iteration, parameters in enumerate(iterations):
+            calls.append(([iteration], _run_iteration,
+                          (process_type, parameters, outputs,
+                           study_config)))
+
+    if max_workers == 1 or futures is None:
+        # sequential execution in the calling thread
+        for batch, function, args in calls:
+            try:
+                result = function(*args)
+            except Exception as e:
+                collect(batch, None, e)
+            else:
+                collect(batch, result, None)
+        return results, errors
+
+    if parallel_mode == 'process':
+        executor = futures.ProcessPoolExecutor(max_workers=max_workers)
+    else:
+        executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+    with executor:
+        # {future: indices of the iterations it executes}
+        running = dict((executor.submit(function, *args), batch)
+                       for batch, function, args in calls)
+        for future in futures.as_completed(running):
+            try:
+                result = future.result()
+            except Exception as e:
+                collect(running[future], None, e)
+            else:
+                collect(running[future], result, None)
+    return results, errors
+
+
+def run_iterations(process_type, parameters_list, first_iteration=0,
+                   max_workers=1, parallel_mode='process'):
+    ''' Execute a chunk of iterations of a process, each one in a new
+    instance of the process. This is what the jobs of chunked iterations run
+    in workflows (see :class:`ProcessIteration` chunk_size).
+
+    The status of each iteration is printed on the standard output, as a
+    line "capsul iteration <index>: done" or "capsul iteration <index>:
+    failed: <error>", where index counts from first_iteration. An
+    :class:`IterationError` is raised at the end if some iterations failed.
+    '''
+    def report(index, error):
+        if error is None:
+            print('capsul iteration %d: done' % (first_iteration + index))
+        else:
+            print('capsul iteration %d: failed: %s'
+                  % (first_iteration + index, error))
+        sys.stdout.flush()
+
+    if not max_workers:
+        max_workers = multiprocessing.cpu_count()
+    results, errors = _execute_iterations(
+        process_type, parameters_list, [], None, max_workers, parallel_mode,
+        report=report)
+    if errors:
+        raise IterationError(dict((first_iteration + index, error)
+                                  for index, error in six.iteritems(errors)))
+
+
 class ProcessIteration(Process):
+    ''' Process iterating another process over lists of parameters values.
+
+    Iterations are executed sequentially on a single instance of the
+    iterated process, unless max_workers is different from 1: iterations
+    are then completed sequentially (see :meth:`complete_iteration`) and
+    executed in parallel, each one in a new instance of the iterated
+    process built from its class or identifier, in a pool of processes
+    (parallel_mode='process', the process must be importable and its
+    parameters picklable) or of threads (parallel_mode='thread'). The
+    iterative outputs are gathered in the iterations order, and failures are
+    reported by an :class:`IterationError` once all iterations are done.
+
+    If batch_size is greater than 1 and the iterated process implements the
+    batch protocol (see
+    :meth:`~capsul.process.process.Process._run_process_batch`), iterations
+    are grouped in batches of batch_size items, each batch being processed
+    in a single call (or a single job in a workflow).
+
+    In workflows (see
+    :func:`~capsul.pipeline.pipeline_workflow.workflow_from_pipeline`), each
+    iteration is a job, or a group of jobs when the iterated process is a
+    pipeline. If chunk_size is greater than 1, chunk_size consecutive
+    iterations are grouped in a single job instead, which runs them using
+    max_workers workers (see :func:`run_iterations`), so that very large
+    iterations do not produce too many jobs.
+    '''
+    parallel_modes = ('process', 'thread')
+
     def __init__(self, process, iterative_parameters, study_config=None,
-                 context_name=None):
+                 context_name=None, max_workers=1, parallel_mode='process',
+                 batch_size=None, chunk_size=None):
         super(ProcessIteration, self).__init__()
+        if parallel_mode not in self.parallel_modes:
+            raise ValueError('Unknown parallel mode: %s' % parallel_mode)
+        # maximum number of iterations running at the same time, 0 means the
+        # number of processors
+        self.max_workers = max_workers
+        self.parallel_mode = parallel_mode
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        if isinstance(process, Process):
+            self._process_type = process.__class__
+        else:
+            self._process_type = process
 
         if self.study_config is None and hasattr(Process, '_study_config'):
             study_config = study_cmod.default_study_config()
@@ -217,7 +461,19 @@ class ProcessIteration(Process):
 
         for parameter in self.regular_parameters:
             setattr(self.process, parameter, getattr(self, parameter))
-        if no_output_value:
+        max_workers = self.max_workers
+        if not max_workers:
+            max_workers = multiprocessing.cpu_count()
+        parallel = (max_workers != 1 or self.get_batch_size() > 1) \
+            and size > 1
+        if parallel and futures is None:
+            logger.warning('concurrent.futures module is not available: '
+                           'iterations will be executed sequentially, one '
+                           'by one.')
+            parallel = False
+        if parallel:
+            self._run_parallel(size, no_output_value, max_workers)
+        elif no_output_value:
             for parameter in self.iterative_parameters:
                 trait = self.trait(parameter)
                 if trait.output:
@@ -251,6 +507,109 @@ class ProcessIteration(Process):
                 self.complete_iteration(iteration)
                 self.process()
 
+    def get_batch_size(self):
+        ''' Return the number of iterations processed in a single call of the
+        iterated process: batch_size if the process implements the batch
+        protocol, 1 otherwise.
+        '''
+        if self.batch_size and self.batch_size > 1 \
+                and self.process.has_batch_protocol():
+            return self.batch_size
+        return 1
+
+    def get_chunk_commandline(self, parameters_list, first_iteration=0):
+        ''' Generate a commandline running python and executing a chunk of
+        iterations (see :func:`run_iterations`). As in
+        :meth:`~capsul.process.process.Process.get_commandline`, file names
+        are given as separate arguments.
+
+        Parameters
+        ----------
+        parameters_list: list of dict
+            the iterated process parameters for each iteration of the chunk
+            (see :meth:`iteration_parameters`).
+        first_iteration: int
+            index of the first iteration of the chunk.
+
+        Returns
+        -------
+        commandline: list of strings
+            Arguments are in separate elements of the list.
+        '''
+        kwargs_list, pathslist = self.process._commandline_parameters(
+            parameters_list)
+        process_type = self._process_type
+        if not isinstance(process_type, six.string_types):
+            process_type = '%s.%s' % (process_type.__module__,
+                                      process_type.__name__)
+        python_command = os.path.basename(sys.executable)
+        return [
+            python_command,
+            "-c",
+            ("import sys; from capsul.pipeline.process_iteration import "
+             "run_iterations; run_iterations({0}, {1}, {2}, {3}, {4})").format(
+                repr(process_type), repr(kwargs_list), first_iteration,
+                self.max_workers, repr(self.parallel_mode)).replace("'", '"')
+        ] + pathslist
+
+    def iteration_parameters(self, size, no_output_value=False):
+        ''' Complete iterations sequentially (see :meth:`complete_iteration`)
+        and return the parameters of the iterated process for each of them,
+        as a list of dicts.
+        '''
+        outputs = []
+        if no_output_value:
+            outputs = [parameter for parameter in self.iterative_parameters
+                       if self.trait(parameter).output]
+        iterations = []
+        for iteration in xrange(size):
+            for parameter in self.iterative_parameters:
+                value = getattr(self, parameter)
+                if len(value) > iteration:
+                    setattr(self.process, parameter, value[iteration])
+            # operate completion
+            self.complete_iteration(iteration)
+            iterations.append(dict(
+                (name, getattr(self.process, name))
+                for name in self.process.user_traits()
+                if getattr(self.process, name) is not Undefined))
+            for parameter in outputs:
+                # reset empty value
+                setattr(self.process, parameter, Undefined)
+        return iterations
+
+    def _run_parallel(self, size, no_output_value, max_workers):
+        ''' Complete iterations sequentially, then execute them (possibly by
+        batches) in a pool of workers and gather their iterative outputs.
+        '''
+        outputs = []
+        if no_output_value:
+            for parameter in self.iterative_parameters:
+                if self.trait(parameter).output:
+                    setattr(self, parameter, [])
+                    outputs.append(parameter)
+
+        iterations = self.iteration_parameters(size, no_output_value)
+        study_config = self.get_study_config()
+        if max_workers != 1 and self.parallel_mode == 'process':
+            study_config = (list(study_config.modules),
+                            study_config.get_configuration_dict())
+        results, errors = _execute_iterations(
+            self._process_type, iterations, outputs, study_config,
+            max_workers, self.parallel_mode, self.get_batch_size())
+        for iteration in sorted(errors):
+            logger.error('iteration %d of %s failed: %s'
+                         % (iteration, self.process.id, errors[iteration]))
+
+        # failed iterations get the default value of the outputs
+        for parameter in outputs:
+            default = self.process.trait(parameter).default
+            setattr(self, parameter,
+                    [default if result is None else result[parameter]
+                     for result in results])
+        if errors:
+            raise IterationError(errors)
+
     def set_study_config(self, study_config):
         super(ProcessIteration, self).set_study_config(study_config)
         self.process.set_study_config(study_config)
@@ -0,0 +1,268 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+'''
+Temporary files of pipelines executions.
+
+Temporary files are the outputs of pipeline nodes which are only used as
+inputs of other nodes. They are allocated before the execution of a
+pipeline and deleted at its end, or as soon as all the nodes using them
+are done with a :class:`TemporaryFilesManager`.
+
+Classes
+=======
+:class:`TemporaryFilesManager`
+------------------------------
+
+Functions
+=========
+:func:`remove_temporary_path`
+-----------------------------
+'''
+
+from __future__ import print_function
+
+import glob
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import six
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+
+def remove_temporary_path(path):
+    ''' Delete a temporary file or directory, and the files sharing its name
+    with other extensions (.minf, .hdr, .mat...). Errors are ignored.
+    '''
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    # side files: temporary names are unique, so files sharing their base
+    # name are other parts of the same data
+    dirname, basename = os.path.split(path)
+    stem = basename.split('.')[0]
+    if not stem:
+        return
+    if hasattr(glob, 'escape'):
+        stem = glob.escape(stem)
+    for side_file in glob.glob(os.path.join(dirname, stem + '.*')):
+        try:
+            os.unlink(side_file)
+        except OSError:
+            pass
+
+
+def _free_space(directory):
+    if hasattr(shutil, 'disk_usage'):
+        return shutil.disk_usage(directory).free
+    stat = os.statvfs(directory)
+    return stat.f_bavail * stat.f_frsize
+
+
+class TemporaryFilesManager(object):
+    '''
+    Allocation and early deletion of the temporary files of a pipeline
+    execution.
+
+    Temporary files are created in a private directory of the execution,
+    below the given directory (or the system default temporary directory).
+    When a fast directory (a RAM disk like /dev/shm for instance) is given,
+    small temporary files are placed there, as long as it has enough free
+    space. The size of a temporary output is estimated as the size of the
+    largest input of the node producing it (temporary directories are not
+    placed there).
+
+    Once :meth:`track_consumers` has been called, each temporary is deleted
+    when the node producing it and all the nodes using it have been
+    executed (see :meth:`node_done`). All remaining files are deleted by
+    :meth:`cleanup`.
+
+    Parameters
+    ----------
+    directory: str (optional)
+        directory of temporary files
+    fast_directory: str (optional)
+        directory of small temporary files
+    fast_max_size: int (optional)
+        maximum estimated size, in bytes, of temporary files placed in the
+        fast directory
+    '''
+
+    def __init__(self, directory=None, fast_directory=None,
+                 fast_max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.fast_directory = fast_directory
+        self.fast_max_size = fast_max_size
+        self._run_directories = {}
+        self._lock = threading.Lock()
+        # {path: estimated size of the temporary file, or None}
+        self._size_hints = {}
+        # temporary files in the fast directory
+        self._fast_paths = set()
+        # {path: set of nodes which have not finished using it}
+        self._users = {}
+        # {node: list of paths}
+        self._node_paths = {}
+
+    def _run_directory(self, base):
+        with self._lock:
+            directory = self._run_directories.get(base)
+            if directory is None:
+                directory = tempfile.mkdtemp(prefix='capsul_run_', dir=base)
+                self._run_directories[base] = directory
+        return directory
+
+    def _fast_directory(self, size_hint):
+        if not self.fast_directory or size_hint is None \
+                or size_hint > self.fast_max_size:
+            return None
+        try:
+            free_space = _free_space(self.fast_directory)
+        except OSError:
+            return None
+        with self._lock:
+            # keep room for the files already allocated there
+            reserved = sum(self._size_hints[path]
+                           for path in self._fast_paths)
+            if reserved + size_hint > free_space:
+                return None
+        return self._run_directory(self.fast_directory)
+
+    def new_file(self, suffix='', size_hint=None):
+        ''' Create a new temporary file, and return its path.
+
+        Parameters
+        ----------
+        suffix: str
+            end of the file name (extension)
+        size_hint: int
+            estimated size of the file, in bytes
+        '''
+        directory = self._fast_directory(size_hint)
+        fast = directory is not None
+        if not fast:
+            directory = self._run_directory(self.directory)
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+        os.close(fd)
+        with self._lock:
+            self._size_hints[path] = size_hint
+            if fast:
+                self._fast_paths.add(path)
+        return path
+
+    def new_directory(self):
+        ''' Create a new temporary directory, and return its path.
+        '''
+        return tempfile.mkdtemp(suffix='capsul_run',
+                                dir=self._run_directory(self.directory))
+
+    def size_hint(self, node):
+        ''' Estimated size of the outputs of a node: the size of its largest
+        input file, or None if it is unknown.
+        '''
+        sizes = []
+        for plug_name, plug in six.iteritems(node.plugs):
+            if plug.output:
+                continue
+            for path in _paths(node.get_plug_value(plug_name)):
+                if path in self._size_hints:
+                    # temporary file, not written yet
+                    size = self._size_hints[path]
+                    if size is None:
+                        return None
+                    sizes.append(size)
+                elif os.path.isfile(path):
+                    sizes.append(os.path.getsize(path))
+        if not sizes:
+            return None
+        return max(sizes)
+
+    def track_consumers(self, temporary_files, nodes):
+        ''' Find the nodes producing and using each temporary file, so that
+        they can be deleted as soon as these nodes have been executed.
+
+        Parameters
+        ----------
+        temporary_files: list
+            temporary files of the execution, as allocated by
+            :meth:`capsul.pipeline.pipeline.Pipeline._check_temporary_files_for_node`
+        nodes: list
+            the executed nodes
+        '''
+        users = {}
+        for node, plug_name, paths, value in temporary_files:
+            if not isinstance(paths, list):
+                paths = [paths]
+            for path in paths:
+                users[path] = set([node])
+        for node in nodes:
+            plugs = getattr(node, 'plugs', {})
+            for plug_name, plug in six.iteritems(plugs):
+                if plug.output:
+                    continue
+                for path in _paths(node.get_plug_value(plug_name)):
+                    if path in users:
+                        users[path].add(node)
+        with self._lock:
+            self._users = users
+            self._node_paths = {}
+            for path, path_users in six.iteritems(users):
+                for node in path_users:
+                    self._node_paths.setdefault(node, []).append(path)
+
+    def node_done(self, node):
+        ''' Notify that a node has been executed: temporary files which are
+        not used by other nodes are deleted.
+        '''
+        to_remove = []
+        with self._lock:
+            for path in self._node_paths.pop(node, []):
+                path_users = self._users.get(path)
+                if path_users is None:
+                    continue
+                path_users.discard(node)
+                if not path_users:
+                    del self._users[path]
+                    self._fast_paths.discard(path)
+                    to_remove.append(path)
+        for path in to_remove:
+            logger.debug('deleting temporary %s' % path)
+            remove_temporary_path(path)
+
+    def cleanup(self):
+        ''' Delete all the temporary files.
+        '''
+        with self._lock:
+            directories = list(six.itervalues(self._run_directories))
+            self._run_directories = {}
+            self._users = {}
+            self._node_paths = {}
+            self._size_hints = {}
+            self._fast_paths = set()
+        for directory in directories:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _paths(value):
+    ''' Strings in a parameter value (a path or a list of paths)
+    '''
+    if isinstance(value, six.string_types):
+        return [value] if value else []
+    if isinstance(value, (list, tuple)):
+        return [item for item in value
+                if isinstance(item, six.string_types) and item]
+    return []
@@ -0,0 +1,116 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+''' Benchmark of pipelines instantiation time according to their number of
+nodes, with and without construction transactions.
+
+Usage::
+
+    python -m capsul.pipeline.test.benchmark_pipeline_construction 50 100 200
+
+Functions
+=========
+:func:`build_pipeline`
+----------------------
+:func:`benchmark_pipeline_construction`
+---------------------------------------
+'''
+
+from __future__ import print_function
+
+import sys
+import time
+
+from traits.api import File
+from capsul.api import Process, Pipeline
+
+
+class Identity(Process):
+    input_image = File(optional=False, output=False)
+    output_image = File(optional=False, output=True)
+
+
+def build_pipeline(pipeline, node_count, chain_length=10):
+    ''' Add to a pipeline parallel chains of processes, each chain ending
+    with a switch selecting the output of one of the two last chain
+    processes.
+
+    Parameters
+    ----------
+    pipeline: Pipeline (mandatory)
+        pipeline to fill
+    node_count: int (mandatory)
+        approximate number of processes to add
+    chain_length: int (optional)
+        number of processes in each chain
+    '''
+    for chain in range(max(1, node_count // chain_length)):
+        previous = None
+        for i in range(chain_length):
+            name = 'node_%d_%d' % (chain, i)
+            pipeline.add_process(name, Identity)
+            if previous is None:
+                pipeline.export_parameter(name, 'input_image',
+                                          'input_%d' % chain)
+            else:
+                pipeline.add_link('%s.output_image->%s.input_image'
+                                  % (previous, name))
+            previous = name
+        switch = 'switch_%d' % chain
+        pipeline.add_switch(switch, ['last', 'previous'], ['output'])
+        pipeline.add_link('%s.output_image->%s.last_switch_output'
+                          % (previous, switch))
+        pipeline.add_link('node_%d_%d.output_image->%s.previous_switch_output'
+                          % (chain, chain_length - 2, switch))
+        pipeline.export_parameter(switch, 'output', 'output_%d' % chain)
+
+
+def benchmark_pipeline_construction(node_counts=(50, 100, 200, 400)):
+    ''' Measure the time needed to build pipelines of various sizes.
+
+    Each pipeline is built from its pipeline_definition() method (i.e. in a
+    construction transaction), then the same structure is built on an
+    existing pipeline calling construction methods one by one.
+
+    Parameters
+    ----------
+    node_counts: sequence of int (optional)
+        number of processes of the benchmarked pipelines
+
+    Returns
+    -------
+    results: list
+        list of (node_count, transaction_time, immediate_time) tuples, times
+        are given in seconds.
+    '''
+    results = []
+    for node_count in node_counts:
+        class BenchmarkPipeline(Pipeline):
+            def pipeline_definition(self):
+                build_pipeline(self, node_count)
+
+        t0 = time.time()
+        BenchmarkPipeline(autoexport_nodes_parameters=False)
+        transaction_time = time.time() - t0
+
+        t0 = time.time()
+        pipeline = Pipeline(autoexport_nodes_parameters=False)
+        build_pipeline(pipeline, node_count)
+        immediate_time = time.time() - t0
+
+        results.append((node_count, transaction_time, immediate_time))
+    return results
+
+
+if __name__ == '__main__':
+    node_counts = [int(n) for n in sys.argv[1:]] or (50, 100, 200, 400)
+    print('%10s %15s %15s' % ('nodes', 'transaction(s)', 'immediate(s)'))
+    for node_count, transaction_time, immediate_time \
+            in benchmark_pipeline_construction(node_counts):
+        print('%10d %15.3f %15.3f'
+              % (node_count, transaction_time, immediate_time))
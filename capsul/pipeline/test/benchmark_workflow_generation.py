@@ -0,0 +1,147 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+''' Benchmark of the soma-workflow workflows generation time and memory
+according to their number of jobs. Workflows are generated for a pipeline
+iterating over a sub-pipeline of two processes linked by a temporary file.
+
+Usage::
+
+    python -m capsul.pipeline.test.benchmark_workflow_generation 1000 10000
+
+Functions
+=========
+:func:`build_iterative_pipeline`
+--------------------------------
+:func:`benchmark_workflow_generation`
+-------------------------------------
+'''
+
+from __future__ import print_function
+
+import sys
+import time
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
+
+from traits.api import File, Float, List
+from capsul.api import Process, Pipeline
+from capsul.pipeline import pipeline_workflow
+
+
+class Scale(Process):
+    input_image = File(optional=False, output=False)
+    factor = Float(1., optional=True, output=False)
+    output_image = File(optional=False, output=True)
+
+
+class Merge(Process):
+    input_images = List(File(), output=False)
+    output_image = File(optional=False, output=True)
+
+
+class ScaleTwice(Pipeline):
+    ''' Two processes linked by a temporary file.
+    '''
+    do_autoexport_nodes_parameters = False
+
+    def pipeline_definition(self):
+        self.add_process('scale1', Scale)
+        self.add_process('scale2', Scale)
+        self.add_link('scale1.output_image->scale2.input_image')
+        self.export_parameter('scale1', 'input_image')
+        self.export_parameter('scale2', 'output_image')
+
+
+def build_iterative_pipeline(size):
+    ''' Build a pipeline iterating over the ScaleTwice pipeline, and merging
+    the iteration outputs. The corresponding workflow contains 4 jobs per
+    iteration (2 processes and the 2 barriers of the iteration group).
+
+    Parameters
+    ----------
+    size: int (mandatory)
+        number of iterations
+
+    Returns
+    -------
+    pipeline: Pipeline
+    '''
+    pipeline = Pipeline(autoexport_nodes_parameters=False)
+    pipeline.add_iterative_process(
+        'iteration', ScaleTwice, iterative_plugs=['input_image',
+                                                  'output_image'])
+    pipeline.add_process('merge', Merge)
+    pipeline.add_link('iteration.output_image->merge.input_images')
+    pipeline.export_parameter('iteration', 'input_image')
+    pipeline.export_parameter('iteration', 'output_image')
+    pipeline.export_parameter('merge', 'output_image', 'merged_image')
+    pipeline.input_image = ['/tmp/capsul_bench/in_%d.nii' % i
+                            for i in range(size)]
+    pipeline.output_image = ['/tmp/capsul_bench/out_%d.nii' % i
+                             for i in range(size)]
+    pipeline.merged_image = '/tmp/capsul_bench/merged.nii'
+    return pipeline
+
+
+def benchmark_workflow_generation(job_counts=(1000, 10000), repeat=3,
+                                  measure_memory=True):
+    ''' Measure the time and memory needed to generate workflows of various
+    sizes.
+
+    Parameters
+    ----------
+    job_counts: sequence of int (optional)
+        approximate number of jobs of the benchmarked workflows
+    repeat: int (optional)
+        number of generations of each workflow, the best time is kept
+    measure_memory: bool (optional)
+        if True, workflows are generated a second time while tracing memory
+        allocations (which slows down the generation)
+
+    Returns
+    -------
+    results: list
+        list of (job_count, time, peak_memory) tuples: the actual number of
+        jobs, the best generation time in seconds and the peak memory allocated
+        during the generation, in MB (None if it cannot be measured).
+    '''
+    results = []
+    for job_count in job_counts:
+        pipeline = build_iterative_pipeline(max(1, job_count // 4))
+        duration = None
+        for i in range(max(1, repeat)):
+            t0 = time.time()
+            workflow = pipeline_workflow.workflow_from_pipeline(
+                pipeline, create_directories=False)
+            t1 = time.time() - t0
+            if duration is None or t1 < duration:
+                duration = t1
+        peak_memory = None
+        if measure_memory and tracemalloc is not None:
+            del workflow
+            tracemalloc.start()
+            workflow = pipeline_workflow.workflow_from_pipeline(
+                pipeline, create_directories=False)
+            peak_memory = tracemalloc.get_traced_memory()[1] / 1024. / 1024.
+            tracemalloc.stop()
+        results.append((len(workflow.jobs), duration, peak_memory))
+    return results
+
+
+if __name__ == '__main__':
+    job_counts = [int(n) for n in sys.argv[1:]] or (1000, 10000)
+    print('%10s %10s %15s' % ('jobs', 'time(s)', 'peak mem(MB)'))
+    for job_count, duration, peak_memory \
+            in benchmark_workflow_generation(job_counts):
+        print('%10d %10.3f %15s'
+              % (job_count, duration,
+                 '%.1f' % peak_memory if peak_memory is not None else '-'))
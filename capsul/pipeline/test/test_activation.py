@@ -96,6 +96,34 @@ class TestPipeline(unittest.TestCase):
         self.pipeline.workflow_ordered_nodes()
         self.assertEqual(self.pipeline.workflow_repr, "")
 
+    def test_incremental_activation(self):
+        # each incremental update is checked against a full update
+        self.pipeline._check_incremental_activations = True
+        for node_name in ("way11", "way12", "way21", "way22"):
+            setattr(self.pipeline.nodes_activation, node_name, False)
+            setattr(self.pipeline.nodes_activation, node_name, True)
+        setattr(self.pipeline.nodes_activation, "way11", False)
+        self.run_unactivation_tests_1()
+        setattr(self.pipeline.nodes_activation, "way22", False)
+        self.assertFalse(self.pipeline.nodes["way21"].activated)
+        self.pipeline.nodes["way12"].plugs["input_image"].enabled = False
+        setattr(self.pipeline.nodes_activation, "way11", True)
+        self.assertFalse(self.pipeline.nodes["way11"].activated)
+        self.assertFalse(self.pipeline.nodes["way12"].activated)
+        self.pipeline.nodes["way12"].plugs["input_image"].enabled = True
+        self.run_unactivation_tests_2()
+
+    def test_activation_changes(self):
+        setattr(self.pipeline.nodes_activation, "way11", False)
+        changes = self.pipeline.last_activation_changes
+        self.assertEqual(changes["nodes"], {"way11": False, "way12": False})
+        self.assertEqual(changes["plugs"][("way12", "output_image")], False)
+        self.assertEqual(changes["plugs"][("", "output_image")], False)
+        self.assertTrue(("way21", "input_image") not in changes["plugs"])
+        setattr(self.pipeline.nodes_activation, "way11", True)
+        changes = self.pipeline.last_activation_changes
+        self.assertEqual(changes["nodes"], {"way11": True, "way12": True})
+
     def run_unactivation_tests_1(self):
         self.assertFalse(self.pipeline.nodes["way11"].activated)
         self.assertFalse(self.pipeline.nodes["way12"].activated)
@@ -106,6 +106,61 @@ class TestPipeline(unittest.TestCase):
         self.pipeline.workflow_ordered_nodes()
         self.assertEqual(self.pipeline.workflow_repr, "")
 
+    def test_workflow_graph_cache(self):
+        graph = self.pipeline.workflow_graph()
+        self.assertIs(self.pipeline.workflow_graph(), graph)
+        nodes = self.pipeline.workflow_ordered_nodes()
+        self.assertEqual(self.pipeline.workflow_ordered_nodes(), nodes)
+        # disabling a node changes the structure
+        setattr(self.pipeline.nodes_activation, "node2", False)
+        self.assertIsNot(self.pipeline.workflow_graph(), graph)
+        self.assertEqual(self.pipeline.workflow_ordered_nodes(), [])
+        setattr(self.pipeline.nodes_activation, "node2", True)
+        self.assertEqual(len(self.pipeline.workflow_ordered_nodes()), 3)
+        # steps
+        self.pipeline.add_pipeline_step('step2', ['node2'])
+        graph = self.pipeline.workflow_graph()
+        self.assertIn('node2', graph._nodes)
+        self.pipeline.pipeline_steps.step2 = False
+        self.assertNotIn('node2', self.pipeline.workflow_graph()._nodes)
+        self.assertIn('node2', self.pipeline.workflow_graph(False)._nodes)
+        self.pipeline.pipeline_steps.step2 = True
+        self.assertIs(self.pipeline.workflow_graph(), graph)
+        # changes in a sub-pipeline invalidate the parent pipeline graph
+        pipeline = Pipeline()
+        pipeline.add_process("sub", self.pipeline)
+        graph = pipeline.workflow_graph()
+        self.assertIn("node1", graph.find_node("sub").meta._nodes)
+        self.pipeline.remove_link("node1.output_image->node2.input_image")
+        self.pipeline.remove_link("node1.other_output->node2.other_input")
+        graph2 = pipeline.workflow_graph()
+        self.assertIsNot(graph2, graph)
+        self.assertEqual(
+            len(graph.find_node("sub").meta.find_node("node1").links_to), 1)
+        self.assertEqual(
+            sorted(graph2._nodes),
+            sorted(pipeline._build_workflow_graph(True, True)._nodes))
+
+    def test_construction_transaction(self):
+        pipeline = Pipeline()
+        with pipeline.construction_transaction():
+            pipeline.add_process("node1",
+                "capsul.pipeline.test.test_pipeline.DummyProcess")
+            pipeline.add_process("node2",
+                "capsul.pipeline.test.test_pipeline.DummyProcess")
+            pipeline.nodes["node1"].process.other_output = 3.5
+            pipeline.add_link("node1.other_output->node2.other_input")
+            pipeline.export_parameter("node1", "input_image")
+            pipeline.export_parameter("node1", "output_image")
+            # values propagation and activations are done at the end of the
+            # transaction
+            self.assertNotEqual(pipeline.nodes["node2"].process.other_input,
+                                3.5)
+            self.assertFalse(pipeline.nodes["node1"].activated)
+        self.assertEqual(pipeline.nodes["node2"].process.other_input, 3.5)
+        self.assertTrue(pipeline.nodes["node1"].activated)
+        self.assertFalse(pipeline.nodes["node2"].activated)
+
     def test_run_pipeline(self):
         setattr(self.pipeline.nodes_activation, "node2", True)
         tmp = tempfile.mkstemp('', prefix='capsul_test_pipeline')
@@ -11,7 +11,7 @@ from __future__ import print_function
 import unittest
 import os
 import sys
-from traits.api import File
+from traits.api import File, Undefined
 from capsul.api import Process
 from capsul.api import Pipeline, PipelineNode
 from capsul.pipeline import pipeline_workflow
@@ -134,6 +134,87 @@ class TestPipelineWorkflow(unittest.TestCase):
             raise ValueError('workflow should have failed due to a missing '
                 'temporary file')
 
+    def test_iteration_temporaries(self):
+        from capsul.pipeline.test.benchmark_workflow_generation \
+            import build_iterative_pipeline
+        import soma_workflow.client as swclient
+        pipeline = build_iterative_pipeline(3)
+        wf = pipeline_workflow.workflow_from_pipeline(
+            pipeline, create_directories=False)
+        # 3 iterations of 2 jobs (plus the groups barriers), and the merge
+        jobs = [job for job in wf.jobs if job.command]
+        self.assertEqual(len(jobs), 7)
+        # each iteration uses its own temporary file, the same one for the
+        # output of its first job and the input of its second job
+        temporaries = [item for job in jobs for item in job.command
+                       if isinstance(item, swclient.TemporaryPath)]
+        self.assertEqual(len(temporaries), 6)
+        self.assertEqual(
+            len(set(temp.referent() for temp in temporaries)), 3)
+        # temporary values are restored in the pipeline
+        iteration = pipeline.nodes['iteration'].process.process
+        self.assertIs(iteration.nodes['scale1'].process.output_image,
+                      Undefined)
+        self.assertIs(iteration.nodes['scale2'].process.input_image,
+                      Undefined)
+
+    def test_linked_plugs(self):
+        # temporary values are set without notifications only when the
+        # pipeline links callbacks are recognized in traits notifiers: this
+        # fails if traits internals change
+        from capsul.pipeline.test.benchmark_workflow_generation \
+            import ScaleTwice, Scale
+        pipeline = ScaleTwice()
+        scale1 = pipeline.nodes['scale1']
+        scale2 = pipeline.nodes['scale2']
+        self.assertEqual(
+            pipeline_workflow._linked_plugs(scale1, 'output_image'),
+            [(scale1.process, 'output_image'),
+             (scale2.process, 'input_image')])
+        # unlinked plug
+        self.assertIsNone(pipeline_workflow._linked_plugs(scale1, 'factor'))
+        # process callback
+        scale2.process.on_trait_change(lambda: None, 'input_image')
+        self.assertIsNone(
+            pipeline_workflow._linked_plugs(scale1, 'output_image'))
+        # switch
+        pipeline = Pipeline()
+        pipeline.add_process('scale1', Scale)
+        pipeline.add_process('scale2', Scale)
+        pipeline.add_switch('switch', ['one', 'two'], ['image'])
+        pipeline.add_link('scale1.output_image->switch.one_switch_image')
+        pipeline.add_link('switch.image->scale2.input_image')
+        self.assertIsNone(pipeline_workflow._linked_plugs(
+            pipeline.nodes['scale1'], 'output_image'))
+
+    def test_critical_path_priorities(self):
+        from capsul.pipeline.test.benchmark_workflow_generation \
+            import build_iterative_pipeline
+        pipeline = build_iterative_pipeline(2)
+        wf = pipeline_workflow.workflow_from_pipeline(
+            pipeline, create_directories=False, jobs_priority=5,
+            critical_path_priorities=True,
+            process_costs={'Scale': 10., 'Merge': 1.})
+        jobs = dict(((job.name, job.priority) for job in wf.jobs
+                     if job.command))
+        self.assertEqual(jobs['merge'], 5)
+        self.assertTrue(jobs['scale1'] > jobs['scale2'] > jobs['merge'])
+        report = pipeline_workflow.workflow_critical_path(
+            wf, lambda job: {'scale1': 10., 'scale2': 10.}.get(job.name))
+        self.assertEqual(report['makespan'], 21.)
+        self.assertEqual(report['total_cost'], 41.)
+        self.assertEqual([job.name for job in report['critical_path']
+                          if job.command], ['scale1', 'scale2', 'merge'])
+        # durations declared on processes
+        pipeline.nodes['merge'].process.estimated_duration = 100.
+        wf = pipeline_workflow.workflow_from_pipeline(
+            pipeline, create_directories=False,
+            critical_path_priorities=True)
+        jobs = dict(((job.name, job.priority) for job in wf.jobs
+                     if job.command))
+        self.assertEqual(jobs['merge'], 0)
+        self.assertTrue(jobs['scale1'] > jobs['scale2'] > jobs['merge'])
+
 
 def test():
     """ Function to execute unitest
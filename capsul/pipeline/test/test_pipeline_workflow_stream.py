@@ -0,0 +1,77 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+from __future__ import print_function
+
+import unittest
+import os
+import tempfile
+import soma_workflow.client as swclient
+from capsul.pipeline import pipeline_workflow
+from capsul.pipeline.pipeline_workflow_stream import (
+    write_workflow_stream, read_workflow_stream, workflow_stream_chunks)
+from capsul.pipeline.test.benchmark_workflow_generation \
+    import build_iterative_pipeline
+
+
+class TestPipelineWorkflowStream(unittest.TestCase):
+
+    def setUp(self):
+        self.pipeline = build_iterative_pipeline(5)
+        fd, self.filename = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_stream(self):
+        workflow = pipeline_workflow.workflow_from_pipeline(self.pipeline)
+        job_count = write_workflow_stream(self.pipeline, self.filename)
+        # directories creation, 5 * 2 scale jobs and the merge job
+        self.assertEqual(job_count, 12)
+        streamed = read_workflow_stream(self.filename)
+        self.assertEqual(sorted(job.name for job in streamed.jobs),
+                         sorted(job.name for job in workflow.jobs))
+        self.assertEqual(len(streamed.dependencies),
+                         len(workflow.dependencies))
+        self.assertEqual([element.name for element in streamed.root_group],
+                         [element.name for element in workflow.root_group])
+        # the two jobs of each iteration share a temporary file
+        temporaries = set()
+        for job in streamed.jobs:
+            temporaries.update(item.referent() for item in job.command
+                               if isinstance(item, swclient.TemporaryPath))
+        self.assertEqual(len(temporaries), 5)
+
+    def test_chunks(self):
+        write_workflow_stream(self.pipeline, self.filename,
+                              create_directories=False)
+        chunks = []
+        for workflow in workflow_stream_chunks(self.filename, max_jobs=4):
+            # barrier jobs are not counted
+            chunks.append([job.name for job in workflow.jobs
+                           if job.command])
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 3])
+        # jobs sharing a temporary file are in the same chunk, and jobs
+        # follow the dependencies order
+        for chunk in chunks:
+            self.assertEqual(chunk.count('scale1'), chunk.count('scale2'))
+        self.assertEqual(chunks[-1][-1], 'merge')
+
+
+def test():
+    """ Function to execute unitest
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestPipelineWorkflowStream)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("RETURNCODE: ", test())
@@ -13,15 +13,19 @@ import os
 import os.path as osp
 import unittest
 from tempfile import NamedTemporaryFile
+import tempfile
+import shutil
 import struct
 
 # Trait import
-from traits.api import String, Int, List, File
+from traits.api import String, Int, Float, List, File
 
 # Capsul import
 from capsul.api import Process
 from capsul.api import Pipeline
-from capsul.pipeline.process_iteration import ProcessIteration
+from capsul.api import StudyConfig
+from capsul.pipeline.process_iteration import (ProcessIteration,
+                                               IterationError)
 
 if sys.version_info[0] >= 3:
     basestring = str
@@ -61,6 +65,64 @@ class ProcessSlice(Process):
         f.write(struct.pack('H', self.slice_number))
         f.close()
 
+class Square(Process):
+    value = Float()
+    square = Float(output=True)
+
+    def _run_process(self):
+        if self.value < 0:
+            raise ValueError('negative value')
+        self.square = self.value * self.value
+
+
+class BatchWrite(Process):
+    value = Float()
+    output = File(output=True)
+
+    def _run_process(self):
+        self._run_process_batch([{'value': self.value,
+                                  'output': self.output}])
+
+    def _run_process_batch(self, parameters_list):
+        for parameters in parameters_list:
+            with open(parameters['output'], 'w') as f:
+                f.write('%s %d\n' % (parameters['value'],
+                                     len(parameters_list)))
+
+
+class BatchPipeline(Pipeline):
+    """ Pipeline with an iteration using the batch protocol
+    """
+    def pipeline_definition(self):
+        self.add_process(
+            'write', ProcessIteration(BatchWrite, ['value', 'output'],
+                                      batch_size=3))
+        self.export_parameter('write', 'value')
+        self.export_parameter('write', 'output')
+
+
+class ChunkPipeline(Pipeline):
+    """ Pipeline with an iteration run by chunks in workflows
+    """
+    def pipeline_definition(self):
+        self.add_process(
+            'square', ProcessIteration(Square, ['value'],
+                                       max_workers=2, parallel_mode='thread',
+                                       chunk_size=3))
+        self.export_parameter('square', 'value')
+
+
+class ChunkWritePipeline(Pipeline):
+    """ Pipeline with an iteration writing files run by chunks in workflows
+    """
+    def pipeline_definition(self):
+        self.add_process(
+            'write', ProcessIteration(BatchWrite, ['value', 'output'],
+                                      chunk_size=3))
+        self.export_parameter('write', 'value')
+        self.export_parameter('write', 'output')
+
+
 class MyPipeline(Pipeline):
     """ Simple Pipeline to test the iterative Node
     """
@@ -130,10 +192,221 @@ class TestPipeline(unittest.TestCase):
         self.assertEqual(numbers, tuple(range(self.parallel_processes)))
 
 
+class TestParallelIteration(unittest.TestCase):
+    """ Class to test the parallel execution of iterations
+    """
+    def check_parallel_mode(self, parallel_mode):
+        iteration = ProcessIteration(Square, ['value', 'square'],
+                                     max_workers=3,
+                                     parallel_mode=parallel_mode)
+        iteration.value = [float(i) for i in range(7)]
+        iteration()
+        self.assertEqual(iteration.square, [float(i * i) for i in range(7)])
+
+        # failed iterations are reported after the others are done
+        iteration.value = [1., -1., 3., -2.]
+        iteration.square = []
+        with self.assertRaises(IterationError) as context:
+            iteration()
+        self.assertEqual(sorted(context.exception.errors), [1, 3])
+        self.assertEqual(iteration.square[0], 1.)
+        self.assertEqual(iteration.square[2], 9.)
+
+    def test_thread_pool(self):
+        self.check_parallel_mode('thread')
+
+    def test_process_pool(self):
+        self.check_parallel_mode('process')
+
+
+def translated_arguments(job):
+    """ Describe the path arguments of a job command: translated paths as
+    (namespace, uuid, relative path), file transfers as their client path
+    """
+    arguments = []
+    for argument in job.command[3:]:
+        if hasattr(argument, 'relative_path'):
+            arguments.append((argument.namespace, argument.uuid,
+                              argument.relative_path))
+        elif hasattr(argument, 'client_path'):
+            arguments.append(('transfer', argument.client_path))
+        else:
+            arguments.append(argument)
+    return arguments
+
+
+def cluster_study_config():
+    """ StudyConfig using a computing resource with paths translations and
+    file transfers
+    """
+    study_config = StudyConfig(modules=['SomaWorkflowConfig'])
+    study_config.somaworkflow_computing_resource = 'cluster'
+    setattr(study_config.somaworkflow_computing_resources_config, 'cluster',
+            {'path_translations': {'/data': ['ns', 'uuid1']},
+             'transfer_paths': ['/transfer']})
+    return study_config
+
+
+class TestBatchIteration(unittest.TestCase):
+    """ Class to test the batch protocol of iterations
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pipeline = BatchPipeline()
+        self.pipeline.value = [float(i) for i in range(7)]
+        self.pipeline.output = [osp.join(self.directory, 'out%d' % i)
+                                for i in range(7)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_outputs(self):
+        for i, output in enumerate(self.pipeline.output):
+            with open(output) as f:
+                value, batch_size = f.read().split()
+            self.assertEqual(float(value), float(i))
+            # 7 items in batches of 3
+            self.assertEqual(int(batch_size), 1 if i == 6 else 3)
+
+    def test_batch_run(self):
+        iteration = self.pipeline.nodes['write'].process
+        self.assertEqual(iteration.get_batch_size(), 3)
+        self.pipeline()
+        self.check_outputs()
+
+    def test_batch_workflow(self):
+        from capsul.pipeline import pipeline_workflow
+        import soma.subprocess
+        workflow = pipeline_workflow.workflow_from_pipeline(self.pipeline)
+        jobs = [job for job in workflow.jobs
+                if job.name.startswith('BatchWrite')]
+        self.assertEqual(sorted(job.name for job in jobs),
+                         ['BatchWrite_0-2', 'BatchWrite_3-5',
+                          'BatchWrite_6-6'])
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [osp.dirname(osp.dirname(osp.dirname(osp.dirname(
+                osp.abspath(__file__)))))]
+            + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+        for job in jobs:
+            command = [sys.executable] + list(job.command[1:])
+            soma.subprocess.check_call(command, env=env)
+        self.check_outputs()
+
+    def test_batch_workflow_translations(self):
+        from capsul.pipeline import pipeline_workflow
+        study_config = cluster_study_config()
+        pipeline = study_config.get_process_instance(BatchPipeline)
+        pipeline.value = [float(i) for i in range(4)]
+        pipeline.output = ['/data/out%d' % i for i in range(3)] \
+            + ['/transfer/out3']
+        workflow = pipeline_workflow.workflow_from_pipeline(
+            pipeline, study_config=study_config, create_directories=False)
+        jobs = dict((job.name, job) for job in workflow.jobs
+                    if job.name.startswith('BatchWrite'))
+        # the paths of all the items of a batch are translated
+        self.assertEqual(translated_arguments(jobs['BatchWrite_0-2']),
+                         [('ns', 'uuid1', 'out%d' % i) for i in range(3)])
+        job = jobs['BatchWrite_3-3']
+        self.assertEqual(translated_arguments(job),
+                         [('transfer', '/transfer/out3')])
+        self.assertEqual([transfer.client_path
+                          for transfer in job.referenced_output_files],
+                         ['/transfer/out3'])
+
+
+class TestChunkIteration(unittest.TestCase):
+    """ Class to test the grouping of iterations in workflow jobs
+    """
+    def test_chunk_workflow(self):
+        from capsul.pipeline import pipeline_workflow
+        import soma.subprocess
+        pipeline = ChunkPipeline()
+        pipeline.value = [1., 2., -3., 4., 5.]
+        workflow = pipeline_workflow.workflow_from_pipeline(pipeline)
+        jobs = sorted([job for job in workflow.jobs
+                       if job.name.startswith('Square')],
+                      key=lambda job: job.name)
+        self.assertEqual([job.name for job in jobs],
+                         ['Square_0-2', 'Square_3-4'])
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [osp.dirname(osp.dirname(osp.dirname(osp.dirname(
+                osp.abspath(__file__)))))]
+            + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+        # the first chunk contains a failing iteration: the job fails and
+        # the status of each item is reported in its output
+        command = [sys.executable] + list(jobs[0].command[1:])
+        process = soma.subprocess.Popen(
+            command, env=env, stdout=soma.subprocess.PIPE,
+            stderr=soma.subprocess.PIPE)
+        output = process.communicate()[0].decode()
+        self.assertNotEqual(process.returncode, 0)
+        self.assertIn('capsul iteration 0: done', output)
+        self.assertIn('capsul iteration 1: done', output)
+        self.assertIn('capsul iteration 2: failed: negative value', output)
+        command = [sys.executable] + list(jobs[1].command[1:])
+        output = soma.subprocess.check_output(command, env=env).decode()
+        self.assertEqual(sorted(output.strip().split('\n')),
+                         ['capsul iteration 3: done',
+                          'capsul iteration 4: done'])
+
+    def test_run_iterations_without_futures(self):
+        from capsul.pipeline import process_iteration
+        # python 2 without the futures backport: iterations are run
+        # sequentially
+        futures = process_iteration.futures
+        process_iteration.futures = None
+        try:
+            try:
+                process_iteration.run_iterations(
+                    Square, [{'value': 1.}, {'value': -2.}, {'value': 3.}],
+                    4, 2, 'thread')
+            except process_iteration.IterationError as e:
+                self.assertEqual(list(e.errors), [5])
+            else:
+                self.fail('run_iterations should have failed')
+            results, errors = process_iteration._execute_iterations(
+                BatchWrite, [{'value': 1., 'output': '/nonexistent/out'}],
+                ['output'], None, batch_size=2)
+        finally:
+            process_iteration.futures = futures
+        self.assertEqual(results, [None])
+        self.assertEqual(list(errors), [0])
+
+    def test_chunk_workflow_translations(self):
+        from capsul.pipeline import pipeline_workflow
+        study_config = cluster_study_config()
+        pipeline = study_config.get_process_instance(ChunkWritePipeline)
+        pipeline.value = [float(i) for i in range(4)]
+        pipeline.output = ['/data/out%d' % i for i in range(3)] \
+            + ['/transfer/out3']
+        workflow = pipeline_workflow.workflow_from_pipeline(
+            pipeline, study_config=study_config, create_directories=False)
+        jobs = dict((job.name, job) for job in workflow.jobs
+                    if job.name.startswith('BatchWrite'))
+        # the paths of all the items of a chunk are translated
+        self.assertEqual(translated_arguments(jobs['BatchWrite_0-2']),
+                         [('ns', 'uuid1', 'out%d' % i) for i in range(3)])
+        job = jobs['BatchWrite_3-3']
+        self.assertEqual(translated_arguments(job),
+                         [('transfer', '/transfer/out3')])
+        self.assertEqual([transfer.client_path
+                          for transfer in job.referenced_output_files],
+                         ['/transfer/out3'])
+        self.assertEqual(pipeline.output[3], '/transfer/out3')
+
+
 def test():
     """ Function to execute unitest
     """
     suite = unittest.TestLoader().loadTestsFromTestCase(TestPipeline)
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        TestParallelIteration))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        TestBatchIteration))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        TestChunkIteration))
     runtime = unittest.TextTestRunner(verbosity=2).run(suite)
     return runtime.wasSuccessful()
 
@@ -194,6 +194,70 @@ class TestTemporary(unittest.TestCase):
         res_out = open(self.pipeline.output).readlines()
         self.assertEqual(len(res_out), 3)
 
+    def test_early_deletion(self):
+        self.study_config.use_soma_workflow = False
+        tmp_dir = tempfile.mkdtemp(prefix='capsul_test_tmp')
+        self.study_config.temporary_directory = tmp_dir
+        self.pipeline.nb_outputs = 3
+        existing = []
+        make_manager = self.study_config._temporary_files_manager
+
+        def temporary_files_manager():
+            manager = make_manager()
+            node_done = manager.node_done
+
+            def spy_node_done(node):
+                node_done(node)
+                existing.append(
+                    (node.name,
+                     len([path for path in manager._size_hints
+                          if os.path.exists(path)])))
+
+            manager.node_done = spy_node_done
+            return manager
+
+        self.study_config._temporary_files_manager = temporary_files_manager
+        try:
+            self.study_config.run(self.pipeline)
+            # temporaries of node1 are deleted once node2 has read them,
+            # the ones of node2 once node3 is done
+            self.assertEqual(existing,
+                             [('node1', 6), ('node2', 3), ('node3', 0)])
+            self.assertEqual(os.listdir(tmp_dir), [])
+            self.assertEqual(len(open(self.pipeline.output).readlines()), 3)
+            # side files are deleted with temporaries
+            from capsul.pipeline.temporary_files import remove_temporary_path
+            path = os.path.join(tmp_dir, 'tmpabc.nii')
+            for filename in (path, path + '.minf', path[:-4] + '.hdr',
+                             os.path.join(tmp_dir, 'tmpabcd.nii')):
+                open(filename, 'w').close()
+            remove_temporary_path(path)
+            self.assertEqual(os.listdir(tmp_dir), ['tmpabcd.nii'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_fast_directory(self):
+        from capsul.pipeline.temporary_files import TemporaryFilesManager
+        tmp_dir = tempfile.mkdtemp(prefix='capsul_test_tmp')
+        try:
+            directory = os.path.join(tmp_dir, 'scratch')
+            fast_directory = os.path.join(tmp_dir, 'fast')
+            os.mkdir(directory)
+            os.mkdir(fast_directory)
+            manager = TemporaryFilesManager(directory, fast_directory,
+                                            fast_max_size=1000)
+            small = manager.new_file('.nii', size_hint=100)
+            large = manager.new_file('.nii', size_hint=100000)
+            unknown = manager.new_file('.nii')
+            self.assertTrue(small.startswith(fast_directory))
+            self.assertTrue(large.startswith(directory))
+            self.assertTrue(unknown.startswith(directory))
+            manager.cleanup()
+            self.assertEqual(os.listdir(directory), [])
+            self.assertEqual(os.listdir(fast_directory), [])
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_full_wf(self):
         self.study_config.use_soma_workflow = True
         self.pipeline.nb_outputs = 3
@@ -0,0 +1,105 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+from __future__ import print_function
+
+import unittest
+from capsul.pipeline.topological_sort import Graph, GraphNode
+
+
+def build_graph(names, links):
+    graph = Graph()
+    for name in names:
+        graph.add_node(GraphNode(name, [name]))
+    for link in links:
+        graph.add_link(*link)
+    return graph
+
+
+class TestTopologicalSort(unittest.TestCase):
+
+    def setUp(self):
+        # a -> b -> d -> e
+        # a -> c -> d
+        self.graph = build_graph(
+            ['a', 'b', 'c', 'd', 'e'],
+            [('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd'), ('d', 'e'),
+             ('a', 'b')])
+
+    def check_order(self, graph, order):
+        position = dict((name, i) for i, name in enumerate(order))
+        self.assertEqual(len(position), len(graph._nodes))
+        for from_node, to_node in graph._links:
+            self.assertLess(position[from_node], position[to_node])
+
+    def test_sort(self):
+        self.assertEqual(len(self.graph._links), 5)
+        self.assertEqual(self.graph.find_node('d').links_from_degree, 2)
+        ordered = self.graph.topological_sort()
+        self.check_order(self.graph, [name for name, meta in ordered])
+        self.assertEqual(ordered[0], ('a', ['a']))
+        # the graph is not modified: it can be sorted again
+        self.assertEqual(self.graph.find_node('d').links_from_degree, 2)
+        self.assertEqual(self.graph.topological_sort(), ordered)
+
+    def test_levels(self):
+        levels = [[name for name, meta in level]
+                  for level in self.graph.levels()]
+        self.assertEqual(levels, [['a'], ['b', 'c'], ['d'], ['e']])
+        self.assertEqual(Graph().levels(), [])
+
+    def test_critical_path(self):
+        costs = {'a': 1., 'b': 5., 'c': 2., 'd': 1.}
+        lengths = self.graph.critical_path_lengths(costs, default_cost=0.5)
+        self.assertEqual(lengths, {'a': 7.5, 'b': 6.5, 'c': 3.5, 'd': 1.5,
+                                   'e': 0.5})
+        self.assertEqual(self.graph.critical_path(costs, default_cost=0.5),
+                         (7.5, ['a', 'b', 'd', 'e']))
+        # costs given by a function
+        cost, path = self.graph.critical_path(
+            lambda node: 10. if node.name == 'c' else None)
+        self.assertEqual((cost, path), (13., ['a', 'c', 'd', 'e']))
+        self.assertEqual(Graph().critical_path({}), (0, []))
+
+    def test_cycle(self):
+        self.assertEqual(self.graph.find_cycle(), None)
+        self.graph.add_node(GraphNode('f', None))
+        self.graph.add_link('e', 'f')
+        self.graph.add_link('f', 'b')
+        self.assertEqual(self.graph.find_cycle(), ['b', 'd', 'e', 'f'])
+        with self.assertRaises(ValueError) as context:
+            self.graph.topological_sort()
+        self.assertIn('b -> d -> e -> f -> b', str(context.exception))
+        self.assertRaises(ValueError, self.graph.levels)
+        # self loop
+        graph = build_graph(['a'], [('a', 'a')])
+        self.assertEqual(graph.find_cycle(), ['a'])
+
+    def test_large_graph(self):
+        # a chain and a wide fan: construction and sort are linear
+        size = 20000
+        names = ['n%d' % i for i in range(size)]
+        links = [(names[i], names[i + 1]) for i in range(size - 1)] \
+            + [(names[0], names[i]) for i in range(2, size)]
+        graph = build_graph(names, links + links)
+        self.assertEqual(len(graph._links), len(links))
+        self.check_order(graph,
+                         [name for name, meta in graph.topological_sort()])
+        self.assertEqual(len(graph.levels()), size)
+
+
+def test():
+    """ Function to execute unitest
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestTopologicalSort)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("RETURNCODE: ", test())
@@ -13,6 +13,8 @@ Classes
 =======
 :class:`GraphNode`
 ------------------
+:class:`Graph`
+--------------
 '''
 
 # System import
@@ -62,12 +64,20 @@ class GraphNode(object):
         """
         self.name = name
         self.meta = meta
-        # variables to store the graph edges
+        # variables to store the graph edges: the lists keep the insertion
+        # order, the sets are used for constant time membership tests
         self.links_to = []
         self.links_from = []
-        # the degree of the node
-        self.links_to_degree = 0
-        self.links_from_degree = 0
+        self._links_to_set = set()
+        self._links_from_set = set()
+
+    @property
+    def links_to_degree(self):
+        return len(self.links_to)
+
+    @property
+    def links_from_degree(self):
+        return len(self.links_from)
 
     def add_link_to(self, node):
         """ Method to add a Successor
@@ -77,9 +87,9 @@ class GraphNode(object):
         node: GraphNode (mandatory)
         the successor node
         """
-        if node not in self.links_to:
+        if node not in self._links_to_set:
+            self._links_to_set.add(node)
             self.links_to.append(node)
-            self.links_to_degree += 1
 
     def remove_link_to(self, node):
         """ Method to remove a Successor
@@ -89,9 +99,9 @@ class GraphNode(object):
         node: GraphNode (mandatory)
         the successor node
         """
-        if node in self.links_to:
+        if node in self._links_to_set:
+            self._links_to_set.remove(node)
             self.links_to.remove(node)
-            self.links_to_degree -= 1
 
     def add_link_from(self, node):
         """ Method to add a Predecessor
@@ -101,9 +111,9 @@ class GraphNode(object):
         node: GraphNode (mandatory)
         the predecessor node
         """
-        if node not in self.links_from:
+        if node not in self._links_from_set:
+            self._links_from_set.add(node)
             self.links_from.append(node)
-            self.links_from_degree += 1
 
     def remove_link_from(self, node):
         """ Method to remove a Predecessor
@@ -113,9 +123,9 @@ class GraphNode(object):
         node: GraphNode (mandatory)
         the predecessor node
         """
-        if node in self.links_from:
+        if node in self._links_from_set:
+            self._links_from_set.remove(node)
             self.links_from.remove(node)
-            self.links_from_degree -= 1
 
 
 class Graph(object):
@@ -123,7 +133,8 @@ class Graph(object):
     topological tree (no cycle).
 
     The algorithm is based on the R.E. Tarjanlinear linear
-    optimization (O(N+A)).
+    optimization (O(N+A)). The graph is not modified by the sort, which may
+    thus be performed several times.
 
     Attributes
     ----------
@@ -138,6 +149,10 @@ class Graph(object):
     find_node
     add_link
     topological_sort
+    find_cycle
+    levels
+    critical_path_lengths
+    critical_path
     """
 
     def __init__(self):
@@ -145,6 +160,7 @@ class Graph(object):
         """
         self._nodes = {}
         self._links = []
+        self._links_set = set()
 
     def add_node(self, node):
         """ Method to add a GraphNode in the Graph
@@ -191,10 +207,40 @@ class Graph(object):
         if to_node not in self._nodes:
             raise Exception("Node {0} is not defined in the Graph."
                    "Use add_node() method".format(to_node))
-        if (from_node, to_node) not in self._links:
+        link = (from_node, to_node)
+        if link not in self._links_set:
             self._nodes[to_node].add_link_from(self._nodes[from_node])
             self._nodes[from_node].add_link_to(self._nodes[to_node])
-            self._links.append((from_node, to_node))
+            self._links_set.add(link)
+            self._links.append(link)
+
+    def _sorted_nodes(self):
+        """ Kahn's algorithm on in-degree counters, without modifying the
+        graph. Returns the list of ordered GraphNodes, and the counters of
+        the nodes which could not be sorted because they belong to (or
+        depend on) a cycle.
+        """
+        in_degree = {}
+        nnil = []
+        for node in six.itervalues(self._nodes):
+            degree = len(node.links_from)
+            if degree == 0:
+                nnil.append(node)
+            else:
+                in_degree[node] = degree
+
+        ordered_nodes = []
+        while nnil:
+            c_nnil = nnil.pop()
+            ordered_nodes.append(c_nnil)
+            for node in c_nnil.links_to:
+                degree = in_degree[node] - 1
+                if degree == 0:
+                    del in_degree[node]
+                    nnil.append(node)
+                else:
+                    in_degree[node] = degree
+        return ordered_nodes, in_degree
 
     def topological_sort(self):
         """ Perform the topological sort: find an order in which all the
@@ -203,43 +249,177 @@ class Graph(object):
         Step 2: Loop until there are nnil
         a) Delete the current nodes c_nnil of in-degree 0.
         b) Place it in the output.
-        c) Remove all its outgoing links from the graph.
-        d) If the node has in-degree 0, add the node to nnil.
+        c) Decrement the in-degree counters of its successors.
+        d) If a successor has in-degree 0, add the node to nnil.
         Step 3: Assert that there is no loop in the graph.
 
+        The graph itself is not modified: in-degrees are counted in a
+        separate structure.
+
         Returns
         -------
         output: list of tuple
             a list of ordered nodes with a tuple element containing the node
             name and the node meta element.
+
+        Raises
+        ------
+        ValueError
+            if the graph contains a cycle. The message gives the nodes of
+            one of the cycles.
         """
-        ordered_nodes = []
+        ordered_nodes, remaining = self._sorted_nodes()
+        if remaining:
+            self._raise_cycle(remaining)
+        return [(node.name, node.meta) for node in ordered_nodes]
 
-        # Step 1
-        nnil = []
-        for name, node in six.iteritems(self._nodes):
-            if node.links_from_degree == 0:
-                nnil.append(node)
+    def find_cycle(self):
+        """ Find a cycle in the graph.
 
-        # Step 2
-        while len(nnil):
-        #-- a
-            c_nnil = nnil.pop()
-        #-- b
-            ordered_nodes.append(c_nnil)
-        #-- c
-            for node in c_nnil.links_to:
-                node.remove_link_from(c_nnil)
-        #-- d
-                if node.links_from_degree == 0:
-                    nnil.append(node)
+        Returns
+        -------
+        cycle: list of str or None
+            the names of the nodes of a cycle, in the links order (the last
+            node is linked to the first one), or None if the graph has no
+            cycle.
+        """
+        remaining = self._sorted_nodes()[1]
+        if not remaining:
+            return None
+        return [node.name for node in self._find_cycle(remaining)]
+
+    def _find_cycle(self, remaining):
+        """ Find a cycle among the nodes left unsorted by _sorted_nodes()
+        """
+        # each remaining node has at least one remaining predecessor: going
+        # backwards along them necessarily ends in a cycle
+        node = next(iter(remaining))
+        visited = {}
+        path = []
+        while node not in visited:
+            visited[node] = len(path)
+            path.append(node)
+            node = next(n for n in node.links_from if n in remaining)
+        cycle = path[visited[node]:]
+        cycle.reverse()
+        # start with the first node of the cycle in the graph nodes order
+        rank = dict((node, i)
+                    for i, node in enumerate(six.itervalues(self._nodes)))
+        first = min(range(len(cycle)), key=lambda i: rank[cycle[i]])
+        return cycle[first:] + cycle[:first]
+
+    def _raise_cycle(self, remaining):
+        cycle = [node.name for node in self._find_cycle(remaining)]
+        raise ValueError("There is a loop in the Graph: {0}".format(
+            " -> ".join(str(name) for name in cycle + cycle[:1])))
+
+    def levels(self):
+        """ Group the nodes by levels (wavefronts): the nodes of a level only
+        depend on nodes of the previous levels, so all the nodes of a level
+        may be executed in parallel. The level of a node is the length of the
+        longest path from a node without predecessor.
 
-        # Step 3
-        if len(ordered_nodes) == len(self._nodes):
-            return [(node.name, node.meta) for node in ordered_nodes]
+        Returns
+        -------
+        levels: list of list of tuple
+            each level is a list of (node name, node meta) tuples, in the
+            graph nodes order.
+
+        Raises
+        ------
+        ValueError
+            if the graph contains a cycle.
+        """
+        ordered_nodes, remaining = self._sorted_nodes()
+        if remaining:
+            self._raise_cycle(remaining)
+        node_level = {}
+        for node in ordered_nodes:
+            node_level[node] = max([node_level[n] + 1
+                                    for n in node.links_from] or [0])
+        levels = [[] for i in range(max(node_level.values()) + 1)] \
+            if node_level else []
+        for node in six.itervalues(self._nodes):
+            levels[node_level[node]].append((node.name, node.meta))
+        return levels
+
+    def critical_path_lengths(self, costs, default_cost=1.):
+        """ Compute, for each node, the cost of the most expensive path
+        starting at this node (including its own cost) down to the end of
+        the graph. Scheduling first the nodes with the highest values
+        shortens the overall execution of the graph.
+
+        Parameters
+        ----------
+        costs: dict or callable (mandatory)
+            either a dict {node name: cost}, or a function taking a
+            GraphNode and returning its cost (or None if it is unknown).
+        default_cost: float (optional)
+            cost of nodes which are not in the costs dict, or for which the
+            costs function returns None.
+
+        Returns
+        -------
+        lengths: dict
+            {node name: critical path length}
+
+        Raises
+        ------
+        ValueError
+            if the graph contains a cycle.
+        """
+        ordered_nodes, remaining = self._sorted_nodes()
+        if remaining:
+            self._raise_cycle(remaining)
+        if callable(costs):
+            get_cost = costs
         else:
-            raise Exception("There is loop in the Graph."
-                            "Please inverstigate")
+            get_cost = lambda node: costs.get(node.name)
+        lengths = {}
+        for node in reversed(ordered_nodes):
+            cost = get_cost(node)
+            if cost is None:
+                cost = default_cost
+            lengths[node.name] = cost + max(
+                [lengths[n.name] for n in node.links_to] or [0])
+        return lengths
+
+    def critical_path(self, costs, default_cost=1.):
+        """ Find the critical path of the graph: the most expensive chain of
+        dependent nodes, which bounds the execution time of the graph
+        whatever the number of parallel workers.
+
+        Parameters
+        ----------
+        costs: dict or callable (mandatory)
+            node costs, see :meth:`critical_path_lengths`
+        default_cost: float (optional)
+            cost of nodes without known cost
+
+        Returns
+        -------
+        total_cost: float
+            the cost of the critical path (0 for an empty graph)
+        path: list of str
+            the names of the nodes of the critical path, in execution order
+
+        Raises
+        ------
+        ValueError
+            if the graph contains a cycle.
+        """
+        lengths = self.critical_path_lengths(costs, default_cost)
+        if not lengths:
+            return 0, []
+        sources = [node for node in six.itervalues(self._nodes)
+                   if not node.links_from]
+        node = max(sources, key=lambda n: lengths[n.name])
+        total_cost = lengths[node.name]
+        path = [node.name]
+        while node.links_to:
+            node = max(node.links_to, key=lambda n: lengths[n.name])
+            path.append(node.name)
+        return total_cost, path
 
 
 if __name__ == '__main__':
@@ -274,3 +454,5 @@ if __name__ == '__main__':
     r = g.topological_sort()
     r = [x[0] for x in r]
     print(" -> ".join(r))
+    for i, level in enumerate(g.levels()):
+        print("level {0}: {1}".format(i, ", ".join(x[0] for x in level)))
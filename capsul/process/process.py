@@ -60,12 +60,22 @@ from soma.controller.trait_utils import get_trait_desc
 
 # Capsul import
 from capsul.utils.version_utils import get_tool_version
+from capsul.utils.file_utils import reflink
 
 if sys.version_info[0] <= 3:
     unicode = str
     basestring = str
 
 
+class _ArgPicker(object):
+    """ This small object is only here to have a __repr__() representation which will print sys.argv[n] in a list when writing the commandline code.
+    """
+    def __init__(self, num):
+        self.num = num
+    def __repr__(self):
+        return 'sys.argv[%d]' % self.num
+
+
 class ProcessMeta(Controller.__class__):
     """ Class used to complete a process docstring
 
@@ -197,6 +207,7 @@ class Process(six.with_metaclass(ProcessMeta, Controller)):
     -------
     __call__
     _run_process
+    _run_process_batch
     _get_log
     add_trait
     save_log
@@ -214,6 +225,10 @@ class Process(six.with_metaclass(ProcessMeta, Controller)):
 
     """
 
+    # {(class, function, name): (python command, code template)}, see
+    # _commandline_template()
+    _commandline_templates = {}
+
     def __init__(self, **kwargs):
         """ Initialize the Process class.
         """
@@ -307,6 +322,15 @@ class Process(six.with_metaclass(ProcessMeta, Controller)):
         '''
         return self.__call__(**kwargs)
 
+    def run_async(self, **kwargs):
+        """ Coroutine counterpart of __call__() (Python 3 only)::
+
+            await process.run_async(param=value)
+
+        See :meth:`capsul.study_config.study_config.StudyConfig.run_async`.
+        """
+        return self.get_study_config().run_async(self, **kwargs)
+
     
     ####################################################################
     # Private methods
@@ -350,6 +374,41 @@ class Process(six.with_metaclass(ProcessMeta, Controller)):
                 "redefined in process ({0})".format(
                     self.__class__.__name__))
     
+    def _run_process_batch(self, parameters_list):
+        """Runs the processings for several sets of parameters in a single
+        call.
+
+        This optional batch protocol is used by iterations (see
+        :class:`~capsul.pipeline.process_iteration.ProcessIteration`
+        batch_size) for processes which have a large fixed startup cost:
+        they may overload this method to process many items at once. By
+        default it raises NotImplementedError, and iterations call
+        :meth:`_run_process` once per item.
+
+        Parameters
+        ----------
+        parameters_list: list of dict
+            for each item, the values of the process parameters (inputs and
+            output file names), as {parameter name: value}.
+
+        Returns
+        -------
+        outputs: list of dict
+            for each item, the values of the output parameters computed by
+            the process ({parameter name: value}). May be None if the
+            process has no output to return except files whose names are
+            given in parameters_list.
+        """
+        raise NotImplementedError(
+            "_run_process_batch() is not implemented in process ({0})".format(
+                self.__class__.__name__))
+
+    @classmethod
+    def has_batch_protocol(cls):
+        """Tell if the process implements :meth:`_run_process_batch`.
+        """
+        return cls._run_process_batch is not Process._run_process_batch
+
     def _before_run_process(self):
         """This method is called by StudyConfig.run() before calling
         _run_process(). By default it does nothing but can be overriden
@@ -511,14 +570,6 @@ class Process(six.with_metaclass(ProcessMeta, Controller)):
         # externally afterwards, typically to handle temporary files, or
         # file transfers with Soma-Workflow.
 
-        class ArgPicker(object):
-            """ This small object is only here to have a __repr__() representation which will print sys.argv[n] in a list when writing the commandline code.
-            """
-            def __init__(self, num):
-                self.num = num
-            def __repr__(self):
-                return 'sys.argv[%d]' % self.num
-
         reserved_params = ("nodes_activation", "selection_changed")
         # pathslist is for files referenced from lists: a list of files will
         # look like [sys.argv[5], sys.argv[6]...], then the corresponding
@@ -543,7 +594,7 @@ class Process(six.with_metaclass(ProcessMeta, Controller)):
                 plist = []
                 for pathname in value:
                     if is_trait_value_defined(pathname):
-                        plist.append(ArgPicker(len(pathslist) + 1))
+                        plist.append(_ArgPicker(len(pathslist) + 1))
                         pathslist.append(pathname)
                     else:
                         plist.append(pathname)
@@ -551,31 +602,122 @@ class Process(six.with_metaclass(ProcessMeta, Controller)):
             else:
                 argsdict[trait_name] = value
 
+        # Construct the command line
+        python_command, template = self._commandline_template()
+        commandline = [
+            python_command,
+            "-c",
+            template.format(repr(argsdict).replace("'", '"'),
+                            len(pathslist) + 1, len(pathslist) + 2)
+        ] + pathslist
+        for item in six.iteritems(pathsdict):
+            commandline.extend(item)
+
+        return commandline
+
+    def _commandline_template(self):
+        """ Return the python command and the python code template used by
+        :meth:`get_commandline`. They only depend on the process class and
+        name, and are computed once for each of them: in the template, {0}
+        stands for the arguments dict, {1} and {2} for the positions of the
+        first named path argument and of its value in sys.argv.
+        """
+        function = getattr(self, '_function', None)
+        key = (self.__class__, function, self.name)
+        template = Process._commandline_templates.get(key)
+        if template is not None:
+            return template
         # Get the module and class names
-        if hasattr(self, '_function'):
+        if function is not None:
             # function with xml decorator
-            module_name = self._function.__module__
-            class_name = self._function.__name__
+            module_name = function.__module__
+            class_name = function.__name__
             call_name = class_name
         else:
             module_name = self.__class__.__module__
             class_name = self.name
             call_name = '%s()' % class_name
+        template = (
+            os.path.basename(sys.executable),
+            ("import sys; from %s import %s; kwargs={0}; "
+             "kwargs.update(dict((sys.argv[i * 2 + {1}], "
+             "sys.argv[i * 2 + {2}]) "
+             "for i in range(int((len(sys.argv) - {1}) / 2)))); "
+             "%s(**kwargs)") % (module_name, class_name, call_name))
+        Process._commandline_templates[key] = template
+        return template
+
+    def _commandline_parameters(self, parameters_list):
+        """ Prepare several sets of parameters values to be written in a
+        python commandline: file names are replaced by sys.argv[n]
+        references.
 
-        # Construct the command line
+        Returns
+        -------
+        kwargs_list: list of dict
+            the parameters sets, whose repr() can be written in the python
+            code.
+        pathslist: list
+            the file names, which must follow the python code in the
+            commandline.
+        """
+        reserved_params = ("nodes_activation", "selection_changed")
+        pathslist = []
+        kwargs_list = []
+        for parameters in parameters_list:
+            kwargs = {}
+            for trait_name, value in six.iteritems(parameters):
+                trait = self.trait(trait_name)
+                if trait is None or trait_name in reserved_params \
+                        or not is_trait_value_defined(value):
+                    continue
+                if is_trait_pathname(trait):
+                    kwargs[trait_name] = _ArgPicker(len(pathslist) + 1)
+                    pathslist.append(value)
+                elif isinstance(trait.trait_type, List) \
+                        and is_trait_pathname(trait.inner_traits[0]):
+                    plist = []
+                    for pathname in value:
+                        if is_trait_value_defined(pathname):
+                            plist.append(_ArgPicker(len(pathslist) + 1))
+                            pathslist.append(pathname)
+                        else:
+                            plist.append(pathname)
+                    kwargs[trait_name] = plist
+                else:
+                    kwargs[trait_name] = value
+            kwargs_list.append(kwargs)
+        return kwargs_list, pathslist
+
+    def get_batch_commandline(self, parameters_list):
+        """ Method to generate a commandline running python, instantiating the
+        current process, and calling its :meth:`_run_process_batch` method
+        on several sets of parameters.
+
+        As in :meth:`get_commandline`, file names are given as separate
+        arguments, so that they can be modified externally (temporary files,
+        Soma-Workflow file transfers).
+
+        Parameters
+        ----------
+        parameters_list: list of dict
+            for each item, the values of the process parameters.
+
+        Returns
+        -------
+        commandline: list of strings
+            Arguments are in separate elements of the list.
+        """
+        kwargs_list, pathslist = self._commandline_parameters(parameters_list)
         python_command = os.path.basename(sys.executable)
         commandline = [
             python_command,
             "-c",
-            ("import sys; from {0} import {1}; kwargs={2}; "
-             "kwargs.update(dict((sys.argv[i * 2 + {3}], "
-             "sys.argv[i * 2 + {4}]) "
-             "for i in range(int((len(sys.argv) - {3}) / 2)))); "
-             "{5}(**kwargs)").format(module_name, class_name,
-                                       repr(argsdict), len(pathslist) + 1,
-                                       len(pathslist) + 2,
-                                       call_name).replace("'", '"')
-        ] + pathslist + sum([list(x) for x in pathsdict.items()], [])
+            ("import sys; from {0} import {1}; "
+             "{1}()._run_process_batch({2})").format(
+                self.__class__.__module__, self.__class__.__name__,
+                repr(kwargs_list)).replace("'", '"')
+        ] + pathslist
 
         return commandline
 
@@ -938,6 +1080,57 @@ class Process(six.with_metaclass(ProcessMeta, Controller)):
         return missing
 
 
+def _symlink_file(src, dst):
+    os.symlink(os.path.abspath(src), dst)
+
+
+# file copy strategies of FileCopyProcess
+_copy_functions = {
+    'copy': shutil.copy2,
+    'reflink': reflink,
+    'hardlink': os.link,
+    'symlink': _symlink_file,
+}
+
+
+def _is_staged(src, dst, strategies):
+    """ Check if dst is an up-to-date copy (or link) of src, made by one of
+    the given copy strategies.
+    """
+    if os.path.islink(dst):
+        return 'symlink' in strategies \
+            and os.path.realpath(dst) == os.path.realpath(src)
+    if not os.path.exists(dst):
+        return False
+    src_stat = os.stat(src)
+    dst_stat = os.stat(dst)
+    if os.path.samestat(src_stat, dst_stat):
+        return 'hardlink' in strategies
+    # copies keep the size and modification time of the source
+    return dst_stat.st_size == src_stat.st_size \
+        and dst_stat.st_mtime == src_stat.st_mtime
+
+
+def _stage_file(src, dst, strategies):
+    """ Copy or link src to dst using the first copy strategy which works
+    (links are not possible across filesystems for instance). An
+    up-to-date dst is kept as it is.
+    """
+    if _is_staged(src, dst, strategies):
+        return
+    if os.path.lexists(dst):
+        os.remove(dst)
+    for strategy in strategies:
+        try:
+            _copy_functions[strategy](src, dst)
+            return
+        except (IOError, OSError) as e:
+            if strategy == strategies[-1]:
+                raise
+            logger.debug('%s of %s to %s failed: %s'
+                         % (strategy, src, dst, e))
+
+
 class FileCopyProcess(Process):
     """ A specific process that copies all the input files.
 
@@ -945,6 +1138,8 @@ class FileCopyProcess(Process):
     ----------
     `copied_inputs` : list of 2-uplet
         the list of copied files (src, dest).
+    `copy_strategy` : str or list of str
+        how input files are copied, see :meth:`__init__`.
 
     Methods
     -------
@@ -954,7 +1149,8 @@ class FileCopyProcess(Process):
     _copy_input_files
     """
     def __init__(self, activate_copy=True, inputs_to_copy=None,
-                 inputs_to_clean=None, destination=None):
+                 inputs_to_clean=None, destination=None,
+                 copy_strategy='reflink'):
         """ Initialize the FileCopyProcess class.
 
         Parameters
@@ -971,6 +1167,16 @@ class FileCopyProcess(Process):
             where the files are copied.
             If None, files are copied in a '_workspace' folder included in the
             image folder.
+        copy_strategy: str or list of str (optional, default 'reflink')
+            how files are copied, or list of methods tried in order:
+            'reflink' (copy-on-write clone sharing the data of the source
+            file, on filesystems supporting it such as btrfs or xfs),
+            'hardlink', 'symlink' or 'copy'. When a method is not possible
+            (links across filesystems for instance), the next one is used,
+            and files are copied at last. Unlike copies and reflinks, links
+            do not protect input files from modifications by the process.
+            Copies or links made by a previous execution are reused if the
+            input file has not changed.
         """
         # Inheritance
         super(FileCopyProcess, self).__init__()
@@ -978,6 +1184,7 @@ class FileCopyProcess(Process):
         # Class parameters
         self.activate_copy = activate_copy
         self.destination = destination
+        self.copy_strategy = copy_strategy
         if self.activate_copy:
             self.inputs_to_clean = inputs_to_clean or []
             if inputs_to_copy is None:
@@ -1099,19 +1306,36 @@ class FileCopyProcess(Process):
                     os.makedirs(destdir)
                 fname = os.path.basename(python_object)
                 out = os.path.join(destdir, fname)
-                shutil.copy2(python_object, out)
-                
+                strategies = self._copy_strategies()
+                _stage_file(python_object, out, strategies)
+
                 # Copy associated .mat files
                 name = fname.split(".")[0]
-                matfnames = glob.glob(os.path.join(
-                    os.path.dirname(python_object), name + ".*"))
+                if hasattr(glob, 'escape'):
+                    name = glob.escape(name)
+                matfnames = glob.glob(os.path.join(srcdir, name + ".*"))
                 for matfname in matfnames:
                     extrafname = os.path.basename(matfname)
+                    if extrafname == fname:
+                        continue
                     extraout = os.path.join(destdir, extrafname)
-                    shutil.copy2(matfname, extraout)
+                    _stage_file(matfname, extraout, strategies)
 
         return out
 
+    def _copy_strategies(self):
+        """ List of the copy methods to try, ending with a copy.
+        """
+        strategies = getattr(self, 'copy_strategy', None) or 'copy'
+        if isinstance(strategies, six.string_types):
+            strategies = [strategies]
+        for strategy in strategies:
+            if strategy not in _copy_functions:
+                raise ValueError('unknown copy strategy: %s' % strategy)
+        if strategies[-1] != 'copy':
+            strategies = list(strategies) + ['copy']
+        return strategies
+
     def _get_process_arguments(self):
         """ Get the process arguments.
 
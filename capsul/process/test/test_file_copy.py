@@ -0,0 +1,97 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+from __future__ import print_function
+
+import unittest
+import tempfile
+import shutil
+import os
+
+from traits.api import File, String
+from capsul.api import FileCopyProcess
+
+
+class ReadCopy(FileCopyProcess):
+    """ Read the copy of its input file.
+    """
+    i = File(output=False, optional=False, desc="a file")
+    s = String(output=True, optional=False, desc="the copy content")
+
+    def _run_process(self):
+        with open(self.i) as f:
+            self.s = f.read()
+
+
+class TestFileCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='capsul_test_copy')
+        self.input = os.path.join(self.tmp_dir, 'image.nii')
+        with open(self.input, 'w') as f:
+            f.write('image data')
+        with open(os.path.join(self.tmp_dir, 'image.mat'), 'w') as f:
+            f.write('matrix')
+        self.workspace = os.path.join(self.tmp_dir, '_workspace')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def copy(self, copy_strategy):
+        process = ReadCopy(copy_strategy=copy_strategy)
+        process.i = self.input
+        process._before_run_process()
+        copied = process.copied_inputs['i']
+        self.assertEqual(copied, os.path.join(self.workspace, 'image.nii'))
+        with open(copied) as f:
+            self.assertEqual(f.read(), 'image data')
+        # side files are staged too
+        with open(os.path.join(self.workspace, 'image.mat')) as f:
+            self.assertEqual(f.read(), 'matrix')
+        return copied
+
+    def test_strategies(self):
+        copied = self.copy('copy')
+        self.assertFalse(os.path.samefile(copied, self.input))
+        # an up-to-date copy is reused
+        ctime = os.stat(copied).st_ctime
+        self.copy('copy')
+        self.assertEqual(os.stat(copied).st_ctime, ctime)
+        # even if links are requested
+        self.copy('hardlink')
+        self.assertEqual(os.stat(copied).st_ctime, ctime)
+        shutil.rmtree(self.workspace)
+        copied = self.copy('hardlink')
+        self.assertTrue(os.path.samefile(copied, self.input))
+        copied = self.copy('symlink')
+        self.assertTrue(os.path.islink(copied))
+        # links are not reused by copies
+        copied = self.copy(['reflink'])
+        self.assertFalse(os.path.islink(copied))
+        self.assertFalse(os.path.samefile(copied, self.input))
+        # a modified input is staged again
+        with open(self.input, 'w') as f:
+            f.write('new image data!')
+        process = ReadCopy(copy_strategy='copy')
+        process.i = self.input
+        process._before_run_process()
+        process._run_process()
+        self.assertEqual(process.s, 'new image data!')
+        self.assertRaises(ValueError, self.copy, 'teleport')
+
+
+def test():
+    """ Function to execute unitest
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFileCopy)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("RETURNCODE: ", test())
@@ -78,6 +78,7 @@ class FomConfig(StudyConfigModule):
         self.study_config.modules_data.all_foms = SortedDictionary()
         self.study_config.modules_data.fom_atp = {'all': {}}
         self.study_config.modules_data.fom_pta = {'all': {}}
+        self.study_config.modules_data.fom_cache = {}
 
         foms = (('input', self.study_config.input_fom),
                 ('output', self.study_config.output_fom),
@@ -132,6 +133,8 @@ class FomConfig(StudyConfigModule):
 
         for atp in modules_data.fom_atp['all'].values():
             atp.directories = directories
+        # FOM paths completion results are obsolete
+        modules_data.fom_cache = {}
 
 
     def update_formats(self):
@@ -158,6 +161,8 @@ class FomConfig(StudyConfigModule):
                 for t in ('input', 'output', 'shared'):
                     if self.study_config.modules_data.fom_atp.get(t) is old_atp:
                         self.study_config.modules_data.fom_atp[t] = atp
+        # FOM paths completion results are obsolete
+        self.study_config.modules_data.fom_cache = {}
 
     def load_fom(self, schema):
         soma_app = Application('capsul', plugin_modules=['soma.fom'])
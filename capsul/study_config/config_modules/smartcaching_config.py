@@ -15,7 +15,7 @@ Classes
 ---------------------------
 '''
 
-from traits.api import Bool, Undefined
+from traits.api import Bool, Enum, Int, Undefined
 from capsul.study_config.study_config import StudyConfigModule
 
 
@@ -28,5 +28,33 @@ class SmartCachingConfig(StudyConfigModule):
             False,
             output=False,
             desc='Use smart-caching during the execution'))
+        study_config.add_trait('smart_caching_fingerprint', Enum(
+            'stat', 'content',
+            output=False,
+            desc='How input files are identified by smart-caching: "stat" '
+                 'uses their path, size and modification time, "content" '
+                 'uses a digest of their content (computed once per file '
+                 'and stored in an index in the cache directory)'))
+        study_config.add_trait('smart_caching_max_size', Int(
+            Undefined,
+            output=False,
+            desc='Maximum size of the smart-caching directory, in bytes'))
+        study_config.add_trait('smart_caching_max_entries', Int(
+            Undefined,
+            output=False,
+            desc='Maximum number of results stored by smart-caching'))
+        study_config.add_trait('smart_caching_eviction_policy', Enum(
+            'lru', 'cost',
+            output=False,
+            desc='How smart-caching results are removed when the cache '
+                 'exceeds its limits: "lru" removes the least recently used '
+                 'ones, "cost" removes first the ones which saved the least '
+                 'computation time per stored byte'))
+        study_config.add_trait('smart_caching_skip_up_to_date', Bool(
+            False,
+            output=False,
+            desc='With smart-caching, skip the pipeline nodes whose inputs '
+                 'and output files have not changed since their last '
+                 'execution, without restoring their outputs'))
         self.study_config = study_config
         # self.study_config.on_trait_change(self._use_smart_caching_changed, 'use_smart_caching')
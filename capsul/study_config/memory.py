@@ -19,6 +19,14 @@ Classes
 -------------------------
 :class:`CapsulResultEncoder`
 ----------------------------
+:class:`BlobStore`
+------------------
+:class:`DigestIndex`
+--------------------
+:class:`CacheIndex`
+-------------------
+:class:`FileLock`
+-----------------
 :class:`Memory`
 ---------------
 
@@ -30,6 +38,16 @@ Functions
 ---------------------
 :func:`file_fingerprint`
 ------------------------
+:func:`file_digest`
+-------------------
+:func:`default_digest_algorithm`
+--------------------------------
+:func:`link_or_copy`
+--------------------
+:func:`remove_cache_entry`
+--------------------------
+:func:`directory_size`
+----------------------
 '''
 
 # System import
@@ -42,9 +60,21 @@ import json
 import logging
 import six
 import sys
+import errno
+import sqlite3
+import threading
+import uuid
+import glob
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows: locks only synchronize the threads of a
+    # process
+    fcntl = None
 
 # CAPSUL import
 from capsul.process.process import Process, ProcessResult
+from capsul.utils.file_utils import reflink
 
 # NIPYPE import
 try:
@@ -58,9 +88,19 @@ except ImportError:
 # TRAITS import
 from traits.api import Undefined
 
+# fast non-cryptographic hashes for file contents
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 if sys.version_info[0] >= 3:
     basestring = str
 
+# atomic replacement of an existing file (os.rename fails on Windows when
+# the destination exists)
+_replace = getattr(os, "replace", os.rename)
+
 
 # Define the logger
 logger = logging.getLogger(__name__)
@@ -213,7 +253,8 @@ class MemorizedProcess(object):
     structure. Methods are provided to inspect the cache or clean it.
     """
 
-    def __init__(self, process, cachedir, timestamp=None, verbose=1):
+    def __init__(self, process, cachedir, timestamp=None, verbose=1,
+                 blob_store=None, digest_index=None, cache_index=None):
         """ Initialize the MemorizedProcess class.
 
         Parameters
@@ -230,6 +271,15 @@ class MemorizedProcess(object):
             is called.
         verbose: int
             if different from zero, print console messages.
+        blob_store: BlobStore (optional)
+            the store of the result files. Defaults to a store in the
+            'blob_store' sub-directory of cachedir.
+        digest_index: DigestIndex (optional)
+            if given, input files are identified by their content digest
+            instead of their path, size and modification time.
+        cache_index: CacheIndex (optional)
+            if given, cache entries, hits and misses are recorded in this
+            index, which also enforces the cache size limits.
         """
         # Check the a process is passed
         self.process_class = process.__class__
@@ -246,6 +296,11 @@ class MemorizedProcess(object):
         if not os.path.exists(cachedir) and os.path.isdir(cachedir):
             raise ValueError("'base_dir' should be an existing directory.")
         self.cachedir = cachedir
+        if blob_store is None:
+            blob_store = BlobStore(os.path.join(cachedir, "blob_store"))
+        self.blob_store = blob_store
+        self.digest_index = digest_index
+        self.cache_index = cache_index
 
         # Define the cache time
         if timestamp is None:
@@ -281,60 +336,204 @@ class MemorizedProcess(object):
         # process
         process_dir, process_hash, input_parameters = self._get_process_id()
 
-        # Execute the process
+        # Concurrent calls with the same parameters (from other threads or
+        # processes) wait for the first one to publish the cache entry
+        # instead of computing it again
+        with FileLock(process_dir + ".lock"):
+            file_mapping = self._check_entry(process_dir)
+
+            # Execute the process
+            computed = file_mapping is None
+            if computed:
+                result, file_mapping, duration = self._compute_entry(
+                    process_dir, input_parameters)
+                if self.cache_index is not None:
+                    self.cache_index.record_miss()
+                    self._index_entry(process_dir, file_mapping, duration)
+
+            # Restore the process results from the cache folder
+            else:
+                # Go through all mapping files
+                for workspace_file, memory_file in file_mapping:
+
+                    # Determine if the workspace directory is writeable
+                    if os.access(os.path.dirname(workspace_file), os.W_OK):
+                        if os.path.isabs(memory_file):
+                            # entry written before the blob store
+                            shutil.copy2(memory_file, workspace_file)
+                        else:
+                            self.blob_store.restore(memory_file,
+                                                    workspace_file)
+                    else:
+                        logger.debug("Can't restore file '{0}', access "
+                                     "rights are not sufficients.".format(
+                                         workspace_file))
+
+                if self.cache_index is not None:
+                    self.cache_index.record_hit()
+                    if not self.cache_index.touch_entry(process_dir):
+                        # entry created without index: its cost is unknown
+                        self._index_entry(process_dir, file_mapping, 0.)
+
+                # Update the process output traits
+                result = self._load_process_result(process_dir,
+                                                   input_parameters)
+
+        if computed and self.cache_index is not None:
+            self.cache_index.enforce_limits(keep=[process_dir])
+
+        return result
+
+    def _check_entry(self, process_dir):
+        """ Check the cache entry of a process, and repair the cache if a
+        previous computation of this entry has been interrupted. Must be
+        called with the entry lock held.
+
+        Parameters
+        ----------
+        process_dir: str
+            the process memory path.
+
+        Returns
+        -------
+        file_mapping: list of 2-uplet
+            the mapping of the entry (see :meth:`_load_file_mapping`), or
+            None if the entry must be computed.
+        """
+        # Temporary directories left by killed computations
+        for tmp_dir in glob.glob(process_dir + ".tmp-*"):
+            logger.warning("Removing the incomplete cache entry "
+                           "'{0}'.".format(tmp_dir))
+            remove_cache_entry(tmp_dir, self.blob_store)
+
+        # A cache entry whose files have been modified or removed from the
+        # store is discarded, as well as an incomplete entry written by an
+        # older version
         if not os.path.isdir(process_dir):
+            return None
+        file_mapping = self._load_file_mapping(process_dir)
+        if file_mapping is None:
+            remove_cache_entry(process_dir, self.blob_store)
+            if self.cache_index is not None:
+                self.cache_index.remove_entry(process_dir)
+        return file_mapping
+
+    def _compute_entry(self, process_dir, input_parameters):
+        """ Execute the process and publish its cache entry. The entry is
+        written in a temporary directory which is renamed once it is
+        complete, so an entry directory is always complete, even if the
+        computation is killed. Must be called with the entry lock held.
+
+        Parameters
+        ----------
+        process_dir: str
+            the process memory path.
+        input_parameters: dict
+            the process input_parameters.
 
-            # Create the destination memory folder
-            os.makedirs(process_dir)
+        Returns
+        -------
+        result: dict
+            the process results.
+        file_mapping: list of 2-uplet
+            the mapping between the workspace and the memory.
+        duration: float
+            the process execution time, in seconds.
+        """
+        tmp_dir = "{0}.tmp-{1}".format(process_dir, uuid.uuid4().hex)
+        os.makedirs(tmp_dir)
 
-            # Try to execute the process and if an error occured remove the
-            # cache folder
+        # Try to execute the process and if an error occured remove the
+        # temporary folder
+        try:
+            # Run
+            start_time = time.time()
+            result = self._call_process(tmp_dir, input_parameters)
+            duration = time.time() - start_time
+
+            # Save the result files in the memory with the corresponding
+            # mapping
+            output_parameters = {}
+            for name, trait in self.process.traits(output=True).items():
+                # Get the trait value
+                value = self.process.get_parameter(name)
+                output_parameters[name] = value
+            file_mapping = []
             try:
-                # Run
-                result = self._call_process(process_dir, input_parameters)
-
-                # Save the result files in the memory with the corresponding
-                # mapping
-                output_parameters = {}
-                for name, trait in self.process.traits(output=True).items():
-                    # Get the trait value
-                    value = self.process.get_parameter(name)
-                    output_parameters[name] = value
-                file_mapping = []
-                self._copy_files_to_memory(output_parameters, process_dir,
+                self._copy_files_to_memory(output_parameters, tmp_dir,
                                            file_mapping)
-                map_fname = os.path.join(process_dir, "file_mapping.json")
-                with open(map_fname, "w") as open_file:
-                    open_file.write(json.dumps(file_mapping))
-
             except:
-                shutil.rmtree(process_dir)
+                for workspace_file, digest in file_mapping:
+                    self.blob_store.release(digest)
                 raise
+            map_fname = os.path.join(tmp_dir, "file_mapping.json")
+            with open(map_fname, "w") as open_file:
+                open_file.write(json.dumps(file_mapping))
 
-        # Restore the process results from the cache folder
-        else:
-            # Restore the memorized files
-            map_fname = os.path.join(process_dir, "file_mapping.json")
-            with open(map_fname, "r") as json_data:
-                file_mapping = json.load(json_data)
+            # Publish the entry
+            os.rename(tmp_dir, process_dir)
 
-            # Go through all mapping files
-            for workspace_file, memory_file in file_mapping:
+        except:
+            if os.path.isdir(tmp_dir):
+                remove_cache_entry(tmp_dir, self.blob_store)
+            raise
 
-                # Determine if the workspace directory is writeable
-                if os.access(os.path.dirname(workspace_file), os.W_OK):
-                    shutil.copy2(memory_file, workspace_file)
-                else:
-                    logger.debug("Can't restore file '{0}', access rights are "
-                                 "not sufficients.".format(workspace_file))
+        return result, file_mapping, duration
 
-            # Update the process output traits
-            result = self._load_process_result(process_dir, input_parameters)
+    def _index_entry(self, process_dir, file_mapping, duration):
+        """ Record a cache entry in the cache index.
 
-        return result
+        Parameters
+        ----------
+        process_dir: str
+            the process memory path.
+        file_mapping: list of 2-uplet
+            the entry mapping between the workspace and the memory.
+        duration: float
+            the process execution time, in seconds.
+        """
+        files_size = 0
+        for workspace_file, memory_file in file_mapping:
+            if not os.path.isabs(memory_file):
+                files_size += self.blob_store.size(memory_file)
+        self.cache_index.add_entry(process_dir, directory_size(process_dir),
+                                   files_size, duration)
+
+    def _load_file_mapping(self, process_dir):
+        """ Load the file mapping of a cache entry.
+
+        Parameters
+        ----------
+        process_dir: str
+            the process memory path.
+
+        Returns
+        -------
+        file_mapping: list of 2-uplet
+            the mapping between the workspace and the memory
+            (workspace_file, blob_digest), or None if the entry is incomplete
+            or if some of its files are missing or have been modified.
+        """
+        map_fname = os.path.join(process_dir, "file_mapping.json")
+        if not os.path.isfile(map_fname) \
+                or not os.path.isfile(os.path.join(process_dir,
+                                                   "result.json")):
+            return None
+        try:
+            with open(map_fname, "r") as json_data:
+                file_mapping = json.load(json_data)
+        except ValueError:
+            return None
+        for workspace_file, memory_file in file_mapping:
+            if os.path.isabs(memory_file):
+                if not os.path.isfile(memory_file):
+                    return None
+            elif not self.blob_store.is_valid(memory_file):
+                return None
+        return file_mapping
 
     def _copy_files_to_memory(self, python_object, process_dir, file_mapping):
-        """ Copy file items inside the memory.
+        """ Store file items inside the memory blob store.
 
         Parameters
         ----------
@@ -344,7 +543,7 @@ class MemorizedProcess(object):
             the process memory path.
         file_mapping: list of 2-uplet
             store in this structure the mapping between the workspace and the
-            memory (workspace_file, memory_file).
+            memory (workspace_file, blob_digest).
         """
         # Deal with dictionary
         if isinstance(python_object, dict):
@@ -363,10 +562,8 @@ class MemorizedProcess(object):
             if (python_object is not Undefined and
                     isinstance(python_object, basestring) and
                     os.path.isfile(python_object)):
-                fname = os.path.basename(python_object)
-                out = os.path.join(process_dir, fname)
-                shutil.copy2(python_object, out)
-                file_mapping.append((python_object, out))
+                digest = self.blob_store.add(python_object)
+                file_mapping.append((python_object, digest))
 
     def _call_process(self, process_dir, input_parameters):
         """ Call a process.
@@ -392,8 +589,11 @@ class MemorizedProcess(object):
         # Start a timer
         start_time = time.time()
 
-        # Execute the process
-        result = self.process()
+        # Execute the process (not using Process.__call__, which would run
+        # it again through its StudyConfig and its cache)
+        self.process._before_run_process()
+        result = self.process._run_process()
+        result = self.process._after_run_process(result)
         duration = time.time() - start_time
 
         # Save the result in json format
@@ -562,7 +762,10 @@ class MemorizedProcess(object):
             if (python_object is not Undefined and
                     isinstance(python_object, basestring) and
                     os.path.isfile(python_object)):
-                out = file_fingerprint(python_object)
+                if self.digest_index is not None:
+                    out = {"digest": self.digest_index.digest(python_object)}
+                else:
+                    out = file_fingerprint(python_object)
 
         return out
 
@@ -582,7 +785,12 @@ class MemorizedProcess(object):
 
         # Guarantee the path exists on the disk
         if not os.path.exists(process_dir):
-            os.makedirs(process_dir)
+            try:
+                os.makedirs(process_dir)
+            except OSError:
+                # created meanwhile by a concurrent call
+                if not os.path.isdir(process_dir):
+                    raise
 
         return process_dir
 
@@ -724,6 +932,222 @@ def file_fingerprint(afile):
     return fingerprint
 
 
+def default_digest_algorithm():
+    """ Return the fastest available algorithm to identify file contents:
+    'xxh3_128' if the xxhash module is installed, 'blake2b' otherwise
+    ('sha256' on older pythons).
+    """
+    if xxhash is not None and hasattr(xxhash, "xxh3_128"):
+        return "xxh3_128"
+    if "blake2b" in hashlib.algorithms_available:
+        return "blake2b"
+    return "sha256"
+
+
+def file_digest(afile, block_size=1 << 20, algorithm="sha256"):
+    """ Computes the digest of a file content.
+
+    Parameters
+    ----------
+    afile: string
+        the file to process.
+    block_size: int (optional)
+        size of the blocks read from the file.
+    algorithm: string (optional)
+        a hashlib algorithm name, or an xxhash one (starting with "xxh").
+
+    Returns
+    -------
+    digest: string
+        the hexadecimal digest of the file content.
+    """
+    if algorithm.startswith("xxh"):
+        hasher = getattr(xxhash, algorithm)()
+    else:
+        hasher = hashlib.new(algorithm)
+    with open(afile, "rb") as open_file:
+        while True:
+            block = open_file.read(block_size)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def link_or_copy(source, destination, use_hardlinks=False):
+    """ Make destination a copy of the source file, sharing its data when
+    possible: a reflink (copy-on-write clone) is tried first, then a
+    hardlink (if use_hardlinks is True, it requires both files to be on the
+    same filesystem), and the file is copied otherwise.
+
+    A hardlink is the same file as its source: modifying one modifies the
+    other, so hardlinks are unsafe for files which may be modified in place.
+
+    Parameters
+    ----------
+    source: string
+        the file to copy.
+    destination: string
+        the copy file name. It must not exist.
+    use_hardlinks: bool (optional)
+        if True, a hardlink is made when reflinks are not supported.
+
+    Returns
+    -------
+    mode: string
+        the way the file has been copied: 'reflink', 'hardlink' or 'copy'.
+    """
+    try:
+        reflink(source, destination)
+        return "reflink"
+    except (IOError, OSError):
+        pass
+    if use_hardlinks:
+        try:
+            os.link(source, destination)
+            return "hardlink"
+        except OSError:
+            pass
+    shutil.copy2(source, destination)
+    return "copy"
+
+
+def remove_cache_entry(process_dir, blob_store):
+    """ Remove a cache entry directory and release the references it holds
+    on the files of the blob store.
+
+    Parameters
+    ----------
+    process_dir: string
+        the cache entry directory.
+    blob_store: BlobStore
+        the store of the cache files.
+
+    Returns
+    -------
+    freed: int
+        the number of bytes freed.
+    """
+    freed = directory_size(process_dir)
+    map_fname = os.path.join(process_dir, "file_mapping.json")
+    if os.path.isfile(map_fname):
+        try:
+            with open(map_fname, "r") as json_data:
+                file_mapping = json.load(json_data)
+        except ValueError:
+            file_mapping = []
+        for workspace_file, memory_file in file_mapping:
+            if not os.path.isabs(memory_file):
+                freed += blob_store.release(memory_file)
+    shutil.rmtree(process_dir)
+    return freed
+
+
+def directory_size(directory):
+    """ Return the size of the files in a directory, in bytes.
+    """
+    total = 0
+    for root, dirs, files in os.walk(directory):
+        for fname in files:
+            total += os.path.getsize(os.path.join(root, fname))
+    return total
+
+
+class FileLock(object):
+    """ Exclusive lock associated with a lock file, synchronizing threads
+    and processes (including processes on other hosts if the filesystem
+    supports flock() locks). The lock file is created if needed, and may be
+    removed by the holder of the lock (see :meth:`remove`).
+
+    Where fcntl is not available, only the threads of the current process
+    are synchronized.
+
+    A FileLock object is not reentrant and must be used by a single thread:
+    each thread must create its own object.
+
+    >>> with FileLock("/tmp/entry.lock"):
+    ...     pass
+    """
+    _thread_locks = {}
+    _thread_locks_lock = threading.Lock()
+
+    def __init__(self, path):
+        """ Initialize the FileLock class.
+
+        Parameters
+        ----------
+        path: string
+            the lock file.
+        """
+        self.path = os.path.abspath(path)
+        self._fd = None
+        self._thread_lock = None
+
+    def acquire(self, blocking=True):
+        """ Acquire the lock. If blocking is False, return False instead of
+        waiting when the lock is held by someone else.
+        """
+        if fcntl is None:
+            with FileLock._thread_locks_lock:
+                lock = FileLock._thread_locks.setdefault(
+                    self.path, threading.Lock())
+            if not lock.acquire(blocking):
+                return False
+            self._thread_lock = lock
+            return True
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, flags)
+            except (IOError, OSError) as e:
+                os.close(fd)
+                if not blocking and e.errno in (errno.EAGAIN, errno.EACCES):
+                    return False
+                raise
+            try:
+                locked = os.path.samestat(os.fstat(fd), os.stat(self.path))
+            except OSError:
+                locked = False
+            if locked:
+                break
+            # the lock file has been removed by the previous holder of the
+            # lock: lock the new one
+            os.close(fd)
+        self._fd = fd
+        return True
+
+    def remove(self):
+        """ Remove the lock file. Must be called while holding the lock:
+        threads and processes waiting for it then lock a new file.
+        """
+        if self._fd is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def release(self):
+        """ Release the lock.
+        """
+        if self._thread_lock is not None:
+            lock, self._thread_lock = self._thread_lock, None
+            lock.release()
+        elif self._fd is not None:
+            fd, self._fd = self._fd, None
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
 class CapsulResultEncoder(json.JSONEncoder):
     """ Deal with ProcessResult in json.
     """
@@ -809,6 +1233,571 @@ class CapsulResultDecoder(json.JSONDecoder):
             return obj
 
 
+############################################################################
+# Content-addressed storage of the cached files
+############################################################################
+
+class BlobStore(object):
+    """ Content-addressed store of files, shared by all the cache entries of
+    a Memory: a file content is stored only once, whatever the number of
+    processes or executions which produced it.
+
+    A file is stored in <directory>/<digest[:2]>/<digest> where digest is the
+    sha256 of its content. Next to it, a <digest>.json file holds the number
+    of cache entries referencing the blob and the size and modification time
+    of the blob when it has been stored.
+
+    Files are added and restored using reflinks when possible (see
+    :func:`link_or_copy`), so a blob may share its data with workspace files
+    without being modified with them, and copied otherwise. Files may be
+    added using hardlinks if use_hardlinks is True: a workspace file is then
+    the blob itself, and modifying it in place modifies the blob. Such a blob
+    is detected as invalid (its size or modification time has changed) and
+    the cache entries using it are recomputed. Files are never restored as
+    hardlinks, which would make identical outputs share the same data.
+
+    Reference counts are updated under a lock on the store (see
+    :class:`FileLock`), so a store may be shared by concurrent processes.
+    The total size of the stored files is maintained in a size.json file
+    of the store, updated under the same lock.
+    """
+
+    def __init__(self, directory, use_hardlinks=False):
+        """ Initialize the BlobStore class.
+
+        Parameters
+        ----------
+        directory: string
+            the store directory, created if needed.
+        use_hardlinks: bool (optional)
+            if True, files are added as hardlinks when reflinks are not
+            supported, instead of being copied. Unsafe for workspace files
+            which are modified in place.
+        """
+        self.directory = directory
+        self.use_hardlinks = use_hardlinks
+
+    def blob_path(self, digest):
+        """ Return the path of a stored file.
+        """
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _read_info(self, digest):
+        info_fname = self.blob_path(digest) + ".json"
+        if not os.path.isfile(info_fname):
+            return None
+        with open(info_fname, "r") as json_data:
+            return json.load(json_data)
+
+    def _write_info(self, digest, info):
+        # concurrent readers must never see a partially written file
+        info_fname = self.blob_path(digest) + ".json"
+        tmp_fname = info_fname + ".tmp"
+        with open(tmp_fname, "w") as open_file:
+            open_file.write(json.dumps(info))
+        _replace(tmp_fname, info_fname)
+
+    def _lock(self):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+        return FileLock(self.directory + ".lock")
+
+    def _total_size(self):
+        # must be called under the store lock
+        size_fname = os.path.join(self.directory, "size.json")
+        if os.path.isfile(size_fname):
+            with open(size_fname, "r") as json_data:
+                return json.load(json_data)["size"]
+        # store created without the size file: compute it once
+        total = 0
+        for root, dirs, files in os.walk(self.directory):
+            for fname in files:
+                if not fname.endswith(".json"):
+                    total += os.path.getsize(os.path.join(root, fname))
+        self._write_total_size(total)
+        return total
+
+    def _write_total_size(self, total):
+        size_fname = os.path.join(self.directory, "size.json")
+        tmp_fname = size_fname + ".tmp"
+        with open(tmp_fname, "w") as open_file:
+            open_file.write(json.dumps({"size": total}))
+        _replace(tmp_fname, size_fname)
+
+    def _add_total_size(self, delta):
+        # must be called under the store lock
+        if delta:
+            self._write_total_size(self._total_size() + delta)
+
+    @staticmethod
+    def _stat_info(path):
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime": repr(stat.st_mtime)}
+
+    def is_valid(self, digest):
+        """ Check that a blob exists and has not been modified since it has
+        been stored.
+        """
+        info = self._read_info(digest)
+        if info is None or not os.path.isfile(self.blob_path(digest)):
+            return False
+        stat_info = self._stat_info(self.blob_path(digest))
+        return (stat_info["size"] == info["size"]
+                and stat_info["mtime"] == info["mtime"])
+
+    def size(self, digest):
+        """ Return the size of a blob, in bytes (0 if it is not stored).
+        """
+        info = self._read_info(digest)
+        if info is None:
+            return 0
+        return info["size"]
+
+    def total_size(self):
+        """ Return the size of all the stored files, in bytes.
+        """
+        with self._lock():
+            return self._total_size()
+
+    def references(self, digest):
+        """ Return the number of cache entries referencing a blob.
+        """
+        info = self._read_info(digest)
+        if info is None:
+            return 0
+        return info["references"]
+
+    def add(self, path):
+        """ Store a file, or add a reference to an identical stored file.
+
+        Parameters
+        ----------
+        path: string
+            the file to store.
+
+        Returns
+        -------
+        digest: string
+            the key of the stored file.
+        """
+        digest = file_digest(path)
+        blob = self.blob_path(digest)
+        with self._lock():
+            info = self._read_info(digest)
+            if info is None or not self.is_valid(digest):
+                references = 0
+                stored_size = 0
+                if info is not None:
+                    references = info["references"]
+                    stored_size = info["size"]
+                blob_dir = os.path.dirname(blob)
+                if not os.path.isdir(blob_dir):
+                    os.makedirs(blob_dir)
+                tmp_blob = blob + ".tmp"
+                # the total size must be known before the store changes
+                self._total_size()
+                for fname in (blob, tmp_blob):
+                    if os.path.lexists(fname):
+                        os.unlink(fname)
+                link_or_copy(path, tmp_blob, self.use_hardlinks)
+                os.rename(tmp_blob, blob)
+                info = self._stat_info(blob)
+                info["references"] = references
+                self._add_total_size(info["size"] - stored_size)
+            info["references"] += 1
+            self._write_info(digest, info)
+        return digest
+
+    def restore(self, digest, path):
+        """ Restore a stored file in the workspace. An existing file at this
+        location is replaced.
+
+        Returns
+        -------
+        mode: string
+            the way the file has been restored: 'reflink', 'copy', or None
+            if path is already the stored file.
+        """
+        blob = self.blob_path(digest)
+        if os.path.lexists(path):
+            if os.path.exists(path) and os.path.samefile(blob, path):
+                return None
+            os.unlink(path)
+        # restored files never share their inode with the blob, otherwise
+        # modifying an output would modify identical outputs of other
+        # processes
+        return link_or_copy(blob, path)
+
+    def release(self, digest):
+        """ Remove a reference to a blob. The blob is deleted when it is not
+        referenced any longer.
+
+        Returns
+        -------
+        freed: int
+            the number of bytes freed.
+        """
+        with self._lock():
+            info = self._read_info(digest)
+            if info is None:
+                return 0
+            info["references"] -= 1
+            if info["references"] > 0:
+                self._write_info(digest, info)
+                return 0
+            blob = self.blob_path(digest)
+            # the total size must be known before the store changes
+            self._total_size()
+            freed = 0
+            if os.path.lexists(blob):
+                freed = os.path.getsize(blob)
+                os.unlink(blob)
+            os.unlink(blob + ".json")
+            self._add_total_size(-info["size"])
+        return freed
+
+
+class DigestIndex(object):
+    """ Persistent index of file content digests, so that each file is
+    hashed only once as long as it is not modified.
+
+    Digests are stored in a sqlite database, indexed by the file absolute
+    path, and associated with the file inode, size and modification time:
+    a digest is computed again only if one of them has changed. Digests are
+    prefixed with the name of the algorithm used to compute them.
+    """
+
+    def __init__(self, filename, algorithm=None):
+        """ Initialize the DigestIndex class.
+
+        Parameters
+        ----------
+        filename: string
+            the sqlite database file, created if needed.
+        algorithm: string (optional)
+            the digest algorithm (see :func:`file_digest`). Defaults to
+            :func:`default_digest_algorithm`.
+        """
+        self.filename = filename
+        if algorithm is None:
+            algorithm = default_digest_algorithm()
+        self.algorithm = algorithm
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.filename, timeout=60, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS digests (path TEXT PRIMARY KEY, "
+                "inode INTEGER, size INTEGER, mtime TEXT, digest TEXT)")
+        return self._connection
+
+    def digest(self, path):
+        """ Return the digest of a file content, computing it only if it is
+        not known for the current state of the file.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (stat.st_ino, stat.st_size, repr(stat.st_mtime))
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT inode, size, mtime, digest FROM digests "
+                "WHERE path=?", (path, )).fetchone()
+        if row is not None and tuple(row[:3]) == key \
+                and row[3].startswith(self.algorithm + ":"):
+            return row[3]
+        digest = "{0}:{1}".format(
+            self.algorithm, file_digest(path, algorithm=self.algorithm))
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?)",
+                (path, ) + key + (digest, ))
+            connection.commit()
+        return digest
+
+    def close(self):
+        """ Close the database connection.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class CacheIndex(object):
+    """ Index of the entries of a Memory cache, enforcing its size limits.
+
+    For each cache entry (a process results directory), the index records
+    its own size, the size of the files it references in the blob store,
+    its creation and last hit times and the duration of the computation it
+    saves. Hits, misses and evictions counters are also stored. The index is
+    a sqlite database.
+
+    The total size of the entries is kept in the counters, and the size of
+    the blob store is maintained by the store, so that the cache size is
+    known without walking the cache directories.
+
+    When the cache exceeds its budget (max_size bytes, including the blob
+    store, and/or max_entries entries), entries are evicted according to the
+    policy:
+
+    - 'lru': least recently used entries first.
+    - 'cost': entries which saved the least computation time per stored
+      byte first (least recently used first for equal costs), so expensive
+      results are kept longer.
+    """
+
+    policies = ("lru", "cost")
+    # number of eviction candidates read at once by enforce_limits()
+    eviction_batch_size = 16
+
+    def __init__(self, filename, blob_store, max_size=None, max_entries=None,
+                 policy="lru"):
+        """ Initialize the CacheIndex class.
+
+        Parameters
+        ----------
+        filename: string
+            the sqlite database file, created if needed.
+        blob_store: BlobStore
+            the store of the cache files.
+        max_size: int (optional)
+            maximum size of the cache, in bytes. No limit if None.
+        max_entries: int (optional)
+            maximum number of cache entries. No limit if None.
+        policy: string (optional)
+            eviction policy: 'lru' or 'cost'.
+        """
+        if policy not in self.policies:
+            raise ValueError("Unknown eviction policy: {0}".format(policy))
+        self.filename = filename
+        self.blob_store = blob_store
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.policy = policy
+        self._lock = threading.RLock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.filename, timeout=60, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, "
+                "size INTEGER, files_size INTEGER, creation_time REAL, "
+                "last_hit_time REAL, hits INTEGER, duration REAL)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_hit_time "
+                "ON entries (last_hit_time)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, "
+                "value INTEGER)")
+            # running total of the entries sizes (computed for indexes
+            # created without it)
+            self._connection.execute(
+                "INSERT OR IGNORE INTO counters SELECT 'entries_size', "
+                "IFNULL(SUM(size), 0) FROM entries")
+            self._connection.commit()
+        return self._connection
+
+    def _update_entries_size(self, connection, path, size):
+        # replace the size of the entry path in the running total
+        row = connection.execute(
+            "SELECT size FROM entries WHERE path=?", (path, )).fetchone()
+        delta = size - (row[0] if row else 0)
+        if delta:
+            connection.execute(
+                "UPDATE counters SET value = value + ? "
+                "WHERE name='entries_size'", (delta, ))
+
+    def _increment(self, name, count=1):
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR IGNORE INTO counters VALUES (?, 0)", (name, ))
+            connection.execute(
+                "UPDATE counters SET value = value + ? WHERE name=?",
+                (count, name))
+            connection.commit()
+
+    def record_hit(self):
+        """ Increment the cache hits counter.
+        """
+        self._increment("hits")
+
+    def record_miss(self):
+        """ Increment the cache misses counter.
+        """
+        self._increment("misses")
+
+    def add_entry(self, path, size, files_size, duration):
+        """ Record a new cache entry.
+
+        Parameters
+        ----------
+        path: string
+            the cache entry directory.
+        size: int
+            size of the entry directory, in bytes.
+        files_size: int
+            size of the blob store files referenced by the entry, in bytes.
+        duration: float
+            the computation time saved by the entry, in seconds.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            self._update_entries_size(connection, path, size)
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, 0, ?)",
+                (path, size, files_size, now, now, duration))
+            connection.commit()
+
+    def touch_entry(self, path):
+        """ Record a hit on an entry. Returns False if the entry is not in
+        the index.
+        """
+        with self._lock:
+            connection = self._connect()
+            cursor = connection.execute(
+                "UPDATE entries SET last_hit_time=?, hits=hits + 1 "
+                "WHERE path=?", (time.time(), path))
+            connection.commit()
+            return cursor.rowcount > 0
+
+    def remove_entry(self, path):
+        """ Remove an entry from the index (not from the disk).
+        """
+        with self._lock:
+            connection = self._connect()
+            self._update_entries_size(connection, path, 0)
+            connection.execute("DELETE FROM entries WHERE path=?", (path, ))
+            connection.commit()
+
+    def entries(self):
+        """ Return the indexed entries as a list of dicts.
+        """
+        names = ("path", "size", "files_size", "creation_time",
+                 "last_hit_time", "hits", "duration")
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT {0} FROM entries".format(", ".join(names))).fetchall()
+        return [dict(zip(names, row)) for row in rows]
+
+    def counters(self):
+        """ Return the hits, misses and evictions counters as a dict.
+        """
+        counters = {"hits": 0, "misses": 0, "evictions": 0}
+        with self._lock:
+            for name, value in self._connect().execute(
+                    "SELECT name, value FROM counters"):
+                if name in counters:
+                    counters[name] = value
+        return counters
+
+    def size(self):
+        """ Return the size of the cache: the size of the indexed entries and
+        of the blob store, in bytes.
+        """
+        with self._lock:
+            entries_size = self._connect().execute(
+                "SELECT value FROM counters WHERE name='entries_size'"
+            ).fetchone()[0]
+        return entries_size + self.blob_store.total_size()
+
+    def _eviction_order(self):
+        # SQL ordering of the entries, first evicted first
+        if self.policy == "cost":
+            return ("IFNULL(duration, 0.) / (size + files_size + 1), "
+                    "last_hit_time")
+        return "last_hit_time"
+
+    def enforce_limits(self, max_size=None, max_entries=None, keep=()):
+        """ Evict entries until the cache fits its budget.
+
+        Parameters
+        ----------
+        max_size: int (optional)
+            maximum size in bytes, defaults to self.max_size.
+        max_entries: int (optional)
+            maximum number of entries, defaults to self.max_entries.
+        keep: sequence of str (optional)
+            entries which must not be evicted.
+
+        Returns
+        -------
+        evicted: list of str
+            the evicted entries directories.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if max_entries is None:
+            max_entries = self.max_entries
+        if max_size is None and max_entries is None:
+            return []
+        evicted = []
+        with self._lock:
+            connection = self._connect()
+            count = connection.execute(
+                "SELECT COUNT(*) FROM entries").fetchone()[0]
+            size = None
+            if max_size is not None:
+                size = self.size()
+
+            def fits():
+                return (max_size is None or size <= max_size) \
+                    and (max_entries is None or count <= max_entries)
+
+            # candidates are read by batches in eviction order: evicted
+            # entries leave the index, skipped ones are passed over
+            skipped = 0
+            while not fits():
+                paths = [row[0] for row in connection.execute(
+                    "SELECT path FROM entries ORDER BY {0} "
+                    "LIMIT ? OFFSET ?".format(self._eviction_order()),
+                    (self.eviction_batch_size, skipped))]
+                if not paths:
+                    break
+                for path in paths:
+                    if fits():
+                        break
+                    # an entry being used by another call is not evicted
+                    lock = FileLock(path + ".lock")
+                    if path in keep or not lock.acquire(blocking=False):
+                        skipped += 1
+                        continue
+                    try:
+                        freed = 0
+                        if os.path.isdir(path):
+                            freed = remove_cache_entry(path, self.blob_store)
+                        self.remove_entry(path)
+                        lock.remove()
+                    finally:
+                        lock.release()
+                    evicted.append(path)
+                    count -= 1
+                    if size is not None:
+                        size -= freed
+            if evicted:
+                self._increment("evictions", len(evicted))
+        return evicted
+
+    def close(self):
+        """ Close the database connection.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
 ############################################################################
 # Memory manager: provide some tracking about what is computed when, to
 # be able to flush the disk
@@ -821,20 +1810,48 @@ class Memory(object):
     ----------
     `cachedir`: string
         the location for the caching. If None is given, no caching is done.
+    `blob_store`: BlobStore
+        the store of the cached files, shared by all the cached processes.
+    `digest_index`: DigestIndex
+        the index of input files digests, None when input files are not
+        identified by their content.
+    `cache_index`: CacheIndex
+        the index of cache entries, enforcing the cache size limits.
 
     Methods
     -------
     cache
     clear
+    evict
+    statistics
+    close
     """
 
-    def __init__(self, cachedir):
+    def __init__(self, cachedir, use_hardlinks=False, fingerprint="stat",
+                 max_size=None, max_entries=None, eviction_policy="lru"):
         """ Initialize the Memory class.
 
         Parameters
         ----------
         base_dir: string
             the directory name of the location for the caching.
+        use_hardlinks: bool (optional)
+            if True, cached files may be hardlinks to the workspace files
+            when reflinks are not supported by the filesystem (see
+            :class:`BlobStore`). Unsafe if output files are modified in
+            place after their execution.
+        fingerprint: string (optional)
+            how input files are identified: "stat" uses their path, size and
+            modification time, "content" uses a digest of their content,
+            stored in a :class:`DigestIndex` in the cache directory, so that
+            copied or moved files are still recognized.
+        max_size: int (optional)
+            maximum size of the cache, in bytes. No limit if None.
+        max_entries: int (optional)
+            maximum number of cache entries. No limit if None.
+        eviction_policy: string (optional)
+            how entries are chosen when the cache exceeds its limits: 'lru'
+            or 'cost' (see :class:`CacheIndex`).
         """
         # Build the capsul memory folder
         if cachedir is not None:
@@ -848,6 +1865,21 @@ class Memory(object):
         # Define class parameters
         self.cachedir = cachedir
         self.timestamp = time.time()
+        self.blob_store = None
+        self.digest_index = None
+        self.cache_index = None
+        if cachedir is not None:
+            self.blob_store = BlobStore(
+                os.path.join(cachedir, "blob_store"), use_hardlinks)
+            self.cache_index = CacheIndex(
+                os.path.join(cachedir, "cache_index.sqlite"),
+                self.blob_store, max_size, max_entries, eviction_policy)
+            if fingerprint == "content":
+                self.digest_index = DigestIndex(
+                    os.path.join(cachedir, "digest_index.sqlite"))
+            elif fingerprint != "stat":
+                raise ValueError(
+                    "Unknown fingerprint mode: {0}".format(fingerprint))
 
     def cache(self, process, verbose=1):
         """ Create a proxy of the given process in order to only execute
@@ -903,7 +1935,8 @@ class Memory(object):
         # Otherwise a proxy process is created
         else:
             return MemorizedProcess(process, self.cachedir, self.timestamp,
-                                    verbose)
+                                    verbose, self.blob_store,
+                                    self.digest_index, self.cache_index)
 
     def clear(self, skips=None):
         """ Remove all the cache appart from those given to the method
@@ -918,12 +1951,61 @@ class Memory(object):
         to_remove_folders = []
         skips = skips or []
         for root, dirs, files in os.walk(self.cachedir):
-            if "result.json" and files and dirs == [] and root not in skips:
+            if root == self.blob_store.directory:
+                # blobs are removed when they are not referenced any longer
+                dirs[:] = []
+                continue
+            # entries being computed are not published yet
+            dirs[:] = [name for name in dirs if ".tmp-" not in name]
+            if "result.json" in files and root not in skips:
                 to_remove_folders.append(root)
 
         # Delete memory directories
         for folder in to_remove_folders:
-            shutil.rmtree(folder)
+            with FileLock(folder + ".lock") as lock:
+                if os.path.isdir(folder):
+                    remove_cache_entry(folder, self.blob_store)
+                self.cache_index.remove_entry(folder)
+                lock.remove()
+
+    def evict(self, max_size=None, max_entries=None):
+        """ Remove cache entries, following the eviction policy, until the
+        cache fits the given limits (by default the limits of the Memory).
+
+        Parameters
+        ----------
+        max_size: int (optional)
+            maximum size of the cache, in bytes.
+        max_entries: int (optional)
+            maximum number of cache entries.
+
+        Returns
+        -------
+        evicted: list of str
+            the evicted entries directories.
+        """
+        return self.cache_index.enforce_limits(max_size, max_entries)
+
+    def statistics(self):
+        """ Return the cache usage statistics.
+
+        Returns
+        -------
+        statistics: dict
+            'hits', 'misses' and 'evictions' counters, number of 'entries'
+            and 'size' of the cache in bytes.
+        """
+        statistics = self.cache_index.counters()
+        statistics["entries"] = len(self.cache_index.entries())
+        statistics["size"] = self.cache_index.size()
+        return statistics
+
+    def close(self):
+        """ Close the connections to the cache and digest indexes databases.
+        """
+        for index in (self.digest_index, self.cache_index):
+            if index is not None:
+                index.close()
 
     def __repr__(self):
         """ Memory class representation.
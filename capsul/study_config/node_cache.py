@@ -0,0 +1,281 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+'''
+Pipeline-level smart-caching: skip the nodes which are up to date, like a
+build system.
+
+Each executed node gets a key which is a hash of its process type and
+versions, of its output file names and of its input values, where input
+files are identified by the key of the node which produced them during the
+current execution (Merkle-style), or by their fingerprint for files which
+are not produced by the pipeline. A node is up to date if its key has been
+recorded after a successful execution and if its output files have not been
+modified or removed since: its execution is then skipped, its output files
+are not touched, and its other outputs values are restored. As keys are
+propagated, whole sub-graphs whose inputs have not changed are skipped.
+
+Classes
+=======
+:class:`NodeCache`
+------------------
+'''
+
+# System import
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import logging
+import six
+
+# CAPSUL import
+from capsul.study_config.memory import (CapsulResultEncoder,
+                                        CapsulResultDecoder,
+                                        file_fingerprint)
+from soma.controller.trait_utils import is_trait_pathname
+
+# TRAITS import
+from traits.api import Undefined
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+
+class NodeCache(object):
+    """ Records the keys of successfully executed pipeline nodes and decides
+    which nodes can be skipped.
+
+    Keys are recorded in a sqlite database, with the output values of the
+    node and the size and modification time of its output files. A NodeCache
+    is used for a single execution, during which the keys of the nodes
+    outputs files are collected: nodes must be processed in a topological
+    order (dependencies first), possibly from several threads.
+
+    Attributes
+    ----------
+    `reused`: list of str
+        names of the nodes skipped because they were up to date.
+    `recomputed`: list of str
+        names of the nodes which have been executed.
+    """
+
+    def __init__(self, filename, digest_index=None):
+        """ Initialize the NodeCache class.
+
+        Parameters
+        ----------
+        filename: string
+            the sqlite database file, created if needed.
+        digest_index: DigestIndex (optional)
+            if given, input files which are not produced during the
+            execution are identified by their content digest instead of
+            their path, size and modification time.
+        """
+        self.filename = filename
+        self.digest_index = digest_index
+        self.reused = []
+        self.recomputed = []
+        # {output file name: key of the node which produced it}
+        self._produced = {}
+        self._lock = threading.RLock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.filename, timeout=60, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS nodes (key TEXT PRIMARY KEY, "
+                "outputs TEXT, files TEXT)")
+        return self._connection
+
+    def _fingerprint(self, value):
+        """ Replace file names by the key of the node which produced them, or
+        by their fingerprint.
+        """
+        if isinstance(value, dict):
+            return dict((key, self._fingerprint(item))
+                        for key, item in six.iteritems(value)
+                        if item is not Undefined)
+        if isinstance(value, (list, tuple)):
+            return [self._fingerprint(item) for item in value
+                    if item is not Undefined]
+        if isinstance(value, six.string_types):
+            with self._lock:
+                producer = self._produced.get(os.path.abspath(value))
+            if producer is not None:
+                return {"produced_by": producer}
+            if os.path.isfile(value):
+                if self.digest_index is not None:
+                    return {"digest": self.digest_index.digest(value)}
+                return file_fingerprint(value)
+        if value is Undefined:
+            return "<undefined_trait_value>"
+        return value
+
+    def node_key(self, process):
+        """ Compute the key of a process, from its current parameters values.
+        The process dependencies must have been processed before.
+
+        Returns
+        -------
+        key: str
+            the node key, or None if the process parameters cannot be
+            hashed (the node is then always executed).
+        """
+        inputs = {}
+        output_files = {}
+        for name, trait in six.iteritems(process.user_traits()):
+            value = getattr(process, name)
+            if not trait.output:
+                inputs[name] = self._fingerprint(value)
+            elif _is_file_trait(trait):
+                output_files[name] = value
+        description = {
+            "process": "{0}.{1}".format(process.__class__.__module__,
+                                        process.__class__.__name__),
+            "versions": getattr(process, "versions", None),
+            "inputs": inputs,
+            "output_files": output_files,
+        }
+        try:
+            description = json.dumps(description, sort_keys=True,
+                                     cls=CapsulResultEncoder)
+        except TypeError:
+            return None
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def reuse(self, process, key, name):
+        """ Skip the execution of a process if it is up to date: restore its
+        outputs values and record it as reused.
+
+        Parameters
+        ----------
+        process: Process
+            the process to execute.
+        key: str
+            the node key (see :meth:`node_key`).
+        name: str
+            the node name used in reports.
+
+        Returns
+        -------
+        reused: bool
+            True if the process is up to date and must not be executed.
+        """
+        if key is None:
+            return False
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT outputs, files FROM nodes WHERE key=?",
+                (key, )).fetchone()
+        if row is None:
+            return False
+        outputs = json.loads(row[0], cls=CapsulResultDecoder)
+        files = json.loads(row[1])
+        for fname, stat_info in six.iteritems(files):
+            if not os.path.isfile(fname) or _stat_info(fname) != stat_info:
+                return False
+        for param, value in six.iteritems(outputs):
+            if param in process.user_traits() \
+                    and getattr(process, param) != value:
+                process.set_parameter(param, value)
+        with self._lock:
+            self._register_outputs(key, files)
+            self.reused.append(name)
+        logger.info("Node cache: '{0}' is up to date.".format(name))
+        return True
+
+    def record(self, process, key, name):
+        """ Record a successful execution of a process.
+
+        Parameters
+        ----------
+        process: Process
+            the executed process.
+        key: str
+            the node key computed before the execution (see
+            :meth:`node_key`).
+        name: str
+            the node name used in reports.
+        """
+        outputs = {}
+        files = {}
+        for param, trait in six.iteritems(process.user_traits()):
+            if trait.output:
+                value = getattr(process, param)
+                outputs[param] = value
+                for fname in _file_names(value):
+                    if os.path.isfile(fname):
+                        files[os.path.abspath(fname)] = _stat_info(fname)
+        with self._lock:
+            self.recomputed.append(name)
+            if key is None:
+                return
+            try:
+                outputs = json.dumps(outputs, cls=CapsulResultEncoder)
+            except TypeError:
+                # outputs cannot be restored: the node is not cached
+                return
+            self._register_outputs(key, files)
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)",
+                (key, outputs, json.dumps(files)))
+            connection.commit()
+
+    def _register_outputs(self, key, files):
+        for fname in files:
+            self._produced[fname] = key
+
+    def report(self):
+        """ Return the names of the nodes which have been reused and
+        recomputed, as a dict {'reused': list, 'recomputed': list}.
+        """
+        with self._lock:
+            return {"reused": list(self.reused),
+                    "recomputed": list(self.recomputed)}
+
+    def close(self):
+        """ Close the database connection, and the digest index one.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            if self.digest_index is not None:
+                self.digest_index.close()
+
+
+def _is_file_trait(trait):
+    """ Tell if a trait is a file or directory, or a list of them.
+    """
+    if is_trait_pathname(trait):
+        return True
+    return len(trait.inner_traits) == 1 \
+        and is_trait_pathname(trait.inner_traits[0])
+
+
+def _file_names(value):
+    """ Return the strings contained in a parameter value.
+    """
+    if isinstance(value, six.string_types):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        names = []
+        for item in value:
+            names.extend(_file_names(item))
+        return names
+    return []
+
+
+def _stat_info(fname):
+    stat = os.stat(fname)
+    return [stat.st_size, repr(stat.st_mtime)]
@@ -9,16 +9,36 @@
 '''
 Process and pipeline execution management
 
+Classes
+=======
+:class:`ParallelExecutionError`
+-------------------------------
+:class:`ExecutionInterrupted`
+-----------------------------
+
 Functions
 =========
+:func:`prepare_process_run`
+---------------------------
+:func:`set_process_parameters`
+------------------------------
 :func:`run_process`
 -------------------
+:func:`workflow_nodes_dependencies`
+-----------------------------------
+:func:`run_nodes_in_parallel`
+-----------------------------
 '''
 
 # System import
 import os
 import logging
 import six
+try:
+    import concurrent.futures as futures
+except ImportError:
+    # python 2 without the "futures" backport
+    futures = None
 
 # CAPSUL import
 from capsul.study_config.memory import Memory
@@ -30,9 +50,11 @@ from traits.api import Undefined
 logger = logging.getLogger(__name__)
 
 
-def run_process(output_dir, process_instance, cachedir=None,
-                generate_logging=False, verbose=0, **kwargs):
-    """ Execute a capsul process in a specific directory.
+def prepare_process_run(output_dir, process_instance, generate_logging,
+                        verbose, kwargs):
+    """ Prepare the execution of a process: set its working directory and
+    log file, check the parameters given for the execution and print the
+    execution message.
 
     Parameters
     ----------
@@ -40,18 +62,15 @@ def run_process(output_dir, process_instance, cachedir=None,
         the folder where the process will write results.
     process_instance: Process (madatory)
         the capsul process we want to execute.
-    cachedir: str (optional, default None)
-        save in the cache the current process execution.
-        If None, no caching is done.
-    generate_logging: bool (optional, default False)
-        if True save the log stored in the process after its execution.
-    verbose: int
+    generate_logging: bool (mandatory)
+        if True the process log will be saved after its execution.
+    verbose: int (mandatory)
         if different from zero, print console messages.
+    kwargs: dict (mandatory)
+        parameters values given for the execution.
 
     Returns
     -------
-    returncode: ProcessResult
-        contains all execution information.
     output_log_file: str
         the path to the process execution log file.
     """
@@ -93,20 +112,64 @@ def run_process(output_dir, process_instance, cachedir=None,
         print("{0}\n[Process] Calling {1}...\n{2}".format(
             80 * "_", process_instance.id,
             call_with_inputs))
+    return output_log_file
+
+
+def set_process_parameters(process_instance, kwargs):
+    """ Set the parameters of a process before its execution and check that
+    all its mandatory parameters are set. Raise a ValueError otherwise.
+    """
+    for k, v in six.iteritems(kwargs):
+        setattr(process_instance, k, v)
+    missing = process_instance.get_missing_mandatory_parameters()
+    if len(missing) != 0:
+        raise ValueError('In process %s: missing mandatory parameters: %s'
+                         % (process_instance.name, ', '.join(missing)))
+
+
+def run_process(output_dir, process_instance, cachedir=None,
+                generate_logging=False, verbose=0, memory_options=None,
+                **kwargs):
+    """ Execute a capsul process in a specific directory.
+
+    Parameters
+    ----------
+    output_dir: str (mandatory)
+        the folder where the process will write results.
+    process_instance: Process (madatory)
+        the capsul process we want to execute.
+    cachedir: str (optional, default None)
+        save in the cache the current process execution.
+        If None, no caching is done.
+    generate_logging: bool (optional, default False)
+        if True save the log stored in the process after its execution.
+    verbose: int
+        if different from zero, print console messages.
+    memory_options: dict (optional)
+        parameters of the cache :class:`~capsul.study_config.memory.Memory`
+        (fingerprint mode, size limits, eviction policy).
+
+    Returns
+    -------
+    returncode: ProcessResult
+        contains all execution information.
+    output_log_file: str
+        the path to the process execution log file.
+    """
+    output_log_file = prepare_process_run(output_dir, process_instance,
+                                          generate_logging, verbose, kwargs)
     if cachedir:
         # Create a memory object
-        mem = Memory(cachedir)
-        proxy_instance = mem.cache(process_instance, verbose=verbose)
+        mem = Memory(cachedir, **(memory_options or {}))
+        try:
+            proxy_instance = mem.cache(process_instance, verbose=verbose)
 
-        # Execute the proxy process
-        returncode = proxy_instance(**kwargs)
+            # Execute the proxy process
+            returncode = proxy_instance(**kwargs)
+        finally:
+            mem.close()
     else:
-        for k, v in six.iteritems(kwargs):
-            setattr(process_instance, k, v)
-        missing = process_instance.get_missing_mandatory_parameters()
-        if len(missing) != 0:
-            raise ValueError('In process %s: missing mandatory parameters: %s'
-                             % (process_instance.name, ', '.join(missing)))
+        set_process_parameters(process_instance, kwargs)
         process_instance._before_run_process()
         returncode = process_instance._run_process()
         returncode = process_instance._after_run_process(returncode)
@@ -116,3 +179,244 @@ def run_process(output_dir, process_instance, cachedir=None,
         process_instance.save_log(returncode)
 
     return returncode, output_log_file
+
+
+class ParallelExecutionError(Exception):
+    """ Error raised when some nodes failed during a parallel execution.
+
+    Attributes
+    ----------
+    errors: dict
+        {node: exception} for each failed node
+    not_run: list
+        nodes that have not been executed because they depend on a failed
+        node, or because the execution has been stopped
+    """
+    def __init__(self, errors, not_run):
+        super(ParallelExecutionError, self).__init__(
+            'Error during parallel execution: %d node(s) failed (%s), '
+            '%d node(s) not run.'
+            % (len(errors),
+               ', '.join(getattr(node, 'name', str(node)) for node in errors),
+               len(not_run)))
+        self.errors = errors
+        self.not_run = not_run
+
+
+class ExecutionInterrupted(Exception):
+    """ Error raised when an execution has been stopped before all its nodes
+    have been executed.
+
+    Attributes
+    ----------
+    not_run: list
+        nodes that have not been executed
+    """
+    def __init__(self, not_run):
+        super(ExecutionInterrupted, self).__init__(
+            'Execution interrupted: %d node(s) not run.' % len(not_run))
+        self.not_run = not_run
+
+
+def workflow_nodes_dependencies(graph, node_filter=None):
+    """ Flatten a workflow graph (see Pipeline.workflow_graph) into a list of
+    nodes and their dependencies.
+
+    Sub-pipelines graphs are expanded: the nodes of a sub-pipeline depend on
+    the dependencies of the sub-pipeline node, and the dependent nodes of the
+    sub-pipeline node depend on all its nodes.
+
+    Parameters
+    ----------
+    graph: topological_sort.Graph (mandatory)
+        the workflow graph.
+    node_filter: callable (optional)
+        if given, only nodes for which node_filter(node) is True are kept.
+        Dependencies of removed nodes are transmitted to their dependent
+        nodes.
+
+    Returns
+    -------
+    nodes: list
+        nodes in a topological order
+    dependencies: dict
+        {node: set of nodes that must be executed before node}
+    """
+    nodes = []
+    dependencies = {}
+
+    def expand(graph, entry_dependencies):
+        """ Add the graph nodes to nodes and dependencies, returns the set of
+        leaf nodes (not followed by another node in the graph).
+        """
+        ordered = graph.topological_sort()
+        predecessors = dict((name, []) for name, meta in ordered)
+        for name, meta in ordered:
+            for graph_node in graph.find_node(name).links_to:
+                predecessors[graph_node.name].append(name)
+        # {graph node name: leaf nodes of the graph node}
+        leaves = {}
+        for name, meta in ordered:
+            node_dependencies = set(entry_dependencies)
+            for predecessor in predecessors[name]:
+                node_dependencies.update(leaves[predecessor])
+            if isinstance(meta, list):
+                for node in meta:
+                    dependencies[node] = node_dependencies
+                    nodes.append(node)
+                leaves[name] = set(meta)
+            else:
+                leaves[name] = expand(meta, node_dependencies)
+        result = set()
+        for name, meta in ordered:
+            if not graph.find_node(name).links_to:
+                result.update(leaves[name])
+        return result
+
+    expand(graph, set())
+
+    if node_filter is not None:
+        kept = []
+        kept_dependencies = {}
+        # {filtered node: its dependencies}
+        removed = {}
+        for node in nodes:
+            node_dependencies = set()
+            for dependency in dependencies[node]:
+                if dependency in removed:
+                    node_dependencies.update(removed[dependency])
+                else:
+                    node_dependencies.add(dependency)
+            if node_filter(node):
+                kept.append(node)
+                kept_dependencies[node] = node_dependencies
+            else:
+                removed[node] = node_dependencies
+        nodes = kept
+        dependencies = kept_dependencies
+
+    return nodes, dependencies
+
+
+def run_nodes_in_parallel(nodes, dependencies, run_node, max_workers=1,
+                          continue_on_error=False, stop_event=None):
+    """ Execute nodes, respecting their dependencies, using a pool of
+    threads.
+
+    Processes run in threads since they are part of the pipeline which holds
+    their parameters and links. Processes running a command line (which is
+    the common case for heavy processing) run it in a sub-process, thus the
+    pool allows to use several processors.
+
+    Parameters
+    ----------
+    nodes: list (mandatory)
+        nodes to execute, in a topological order
+    dependencies: dict (mandatory)
+        {node: set of nodes that must be executed before node}
+    run_node: callable (mandatory)
+        function called with a node as argument to execute it
+    max_workers: int (optional)
+        maximum number of nodes running at the same time. 0 or None means the
+        number of processors of the machine.
+    continue_on_error: bool (optional)
+        if False (the default), no new node is started after a failure (nodes
+        already running are waited for) and the exception of the failed node
+        is raised. If True, all nodes which do not depend on a failed node are
+        executed and a ParallelExecutionError is raised at the end.
+    stop_event: threading.Event (optional)
+        when this event is set, no new node is started. Running nodes are
+        waited for, then an ExecutionInterrupted exception is raised.
+
+    Returns
+    -------
+    results: dict
+        {node: value returned by run_node(node)}
+    """
+    if not max_workers:
+        import multiprocessing
+        max_workers = multiprocessing.cpu_count()
+    if futures is None or max_workers == 1:
+        if futures is None and max_workers != 1:
+            logger.warning('concurrent.futures module is not available: '
+                           'nodes will be executed sequentially.')
+        max_workers = 1
+
+    results = {}
+    errors = {}
+    not_run = []
+    if max_workers == 1:
+        # plain sequential execution, nodes are already in a valid order
+        failed = set()
+        for node in nodes:
+            if stop_event is not None and stop_event.is_set():
+                not_run.append(node)
+            elif errors and not continue_on_error:
+                not_run.append(node)
+            elif failed.intersection(dependencies[node]):
+                not_run.append(node)
+                failed.add(node)
+            else:
+                try:
+                    results[node] = run_node(node)
+                except Exception as e:
+                    if not continue_on_error:
+                        raise
+                    errors[node] = e
+                    failed.add(node)
+    else:
+        waiting = dict((node, set(dependencies[node])) for node in nodes)
+        dependents = dict((node, []) for node in nodes)
+        for node in nodes:
+            for dependency in dependencies[node]:
+                dependents[dependency].append(node)
+        ready = [node for node in nodes if not waiting[node]]
+        running = {}
+        first_error = None
+
+        def discard(node):
+            # node and all its dependents will never be executed
+            todo = [node]
+            while todo:
+                node = todo.pop()
+                if node in waiting:
+                    del waiting[node]
+                    not_run.append(node)
+                    todo.extend(dependents[node])
+
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while ready or running:
+                while ready and (first_error is None or continue_on_error) \
+                        and (stop_event is None or not stop_event.is_set()):
+                    node = ready.pop(0)
+                    del waiting[node]
+                    running[pool.submit(run_node, node)] = node
+                if not running:
+                    break
+                done, pending = futures.wait(
+                    list(running), return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    try:
+                        results[node] = future.result()
+                    except Exception as e:
+                        errors[node] = e
+                        if first_error is None:
+                            first_error = e
+                        for dependent in dependents[node]:
+                            discard(dependent)
+                        continue
+                    for dependent in dependents[node]:
+                        if dependent in waiting:
+                            waiting[dependent].discard(node)
+                            if not waiting[dependent]:
+                                ready.append(dependent)
+        not_run.extend(node for node in nodes if node in waiting)
+        if first_error is not None and not continue_on_error:
+            raise first_error
+
+    if stop_event is not None and stop_event.is_set() and not_run:
+        raise ExecutionInterrupted(not_run)
+    if errors:
+        raise ParallelExecutionError(errors, not_run)
+    return results
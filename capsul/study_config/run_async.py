@@ -0,0 +1,259 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+'''
+asyncio execution of processes and pipelines (Python 3 only).
+
+Processes whose execution is a command line (they define
+:meth:`~capsul.process.process.Process.get_commandline` but not
+:meth:`~capsul.process.process.Process._run_process`) run as asyncio
+subprocesses. Other processes (python functions, cached or logged
+executions) run in the default executor of the event loop.
+
+Functions
+=========
+:func:`is_commandline_process`
+------------------------------
+:func:`run_process_async`
+-------------------------
+:func:`run_async`
+-----------------
+'''
+
+# System import
+import asyncio
+import functools
+import logging
+import multiprocessing
+import time
+
+# CAPSUL import
+from capsul.process.process import Process
+from capsul.pipeline.pipeline_nodes import Node
+from capsul.study_config.run import (run_process, prepare_process_run,
+                                     set_process_parameters,
+                                     ParallelExecutionError)
+from capsul.subprocess import aio
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+
+class _DependencyNotRun(Exception):
+    ''' A node dependency failed or has been cancelled.
+    '''
+
+
+def is_commandline_process(process_instance):
+    """ Tell if the execution of a process only consists in running its
+    command line.
+    """
+    cls = process_instance.__class__
+    return (cls._run_process is Process._run_process
+            and cls.get_commandline is not Process.get_commandline)
+
+
+async def run_process_async(output_dir, process_instance, cachedir=None,
+                            generate_logging=False, verbose=0,
+                            memory_options=None, semaphore=None, **kwargs):
+    """ Coroutine counterpart of :func:`capsul.study_config.run.run_process`.
+
+    Parameters
+    ----------
+    output_dir: str (mandatory)
+        the folder where the process will write results.
+    process_instance: Process (madatory)
+        the capsul process we want to execute.
+    cachedir: str (optional, default None)
+        save in the cache the current process execution.
+        If None, no caching is done.
+    generate_logging: bool (optional, default False)
+        if True save the log stored in the process after its execution.
+    verbose: int
+        if different from zero, print console messages.
+    memory_options: dict (optional)
+        parameters of the cache Memory.
+    semaphore: asyncio.Semaphore (optional)
+        if given, the process is started only when the semaphore can be
+        acquired.
+
+    Returns
+    -------
+    returncode: ProcessResult
+        contains all execution information.
+    output_log_file: str
+        the path to the process execution log file.
+    """
+    if cachedir or generate_logging \
+            or not is_commandline_process(process_instance):
+        loop = asyncio.get_event_loop()
+        call = functools.partial(
+            run_process, output_dir, process_instance, cachedir=cachedir,
+            generate_logging=generate_logging, verbose=verbose,
+            memory_options=memory_options, **kwargs)
+        if semaphore is None:
+            return await loop.run_in_executor(None, call)
+        async with semaphore:
+            return await loop.run_in_executor(None, call)
+
+    output_log_file = prepare_process_run(output_dir, process_instance,
+                                          generate_logging, verbose, kwargs)
+    set_process_parameters(process_instance, kwargs)
+    process_instance._before_run_process()
+    await aio.check_call(process_instance.get_commandline(),
+                         semaphore=semaphore)
+    # Process._run_process() returns nothing for command lines
+    returncode = process_instance._after_run_process(None)
+    return returncode, output_log_file
+
+
+async def run_async(study_config, process_or_pipeline, output_directory=None,
+                    execute_qc_nodes=True, verbose=0, max_concurrency=None,
+                    **kwargs):
+    """ Coroutine counterpart of
+    :meth:`capsul.study_config.study_config.StudyConfig.run`.
+
+    Pipeline nodes are run as soon as their dependencies are done, at most
+    max_concurrency at the same time. The failure policy of the study config
+    is applied: with 'fail_fast' running nodes are cancelled (their command
+    is killed) after the first failure. Cancelling the coroutine cancels all
+    the running nodes.
+
+    Executions using soma-workflow run StudyConfig.run() in the default
+    executor of the event loop.
+
+    Parameters
+    ----------
+    study_config: StudyConfig (mandatory)
+        the study configuration
+    process_or_pipeline: Process or Pipeline instance (mandatory)
+        the process or pipeline we want to execute
+    output_directory: Directory name (optional)
+        the output directory to use for process execution.
+    execute_qc_nodes: bool (optional)
+        if True execute process nodes that are taged as qualtity control
+        process nodes.
+    verbose: int
+        if different from zero, print console messages.
+    max_concurrency: int (optional)
+        maximum number of processes running at the same time. Defaults to
+        study_config.local_parallel_workers (0 means the number of
+        processors).
+    """
+    if study_config.get_trait_value("use_soma_workflow"):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(
+            study_config.run, process_or_pipeline,
+            output_directory=output_directory,
+            execute_qc_nodes=execute_qc_nodes, verbose=verbose, **kwargs))
+
+    study_config._prepare_run(process_or_pipeline, kwargs)
+    output_directory = study_config._local_output_directory(output_directory)
+    if max_concurrency is None:
+        max_concurrency = study_config.local_parallel_workers
+    if not max_concurrency:
+        max_concurrency = multiprocessing.cpu_count()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    continue_on_error = (study_config.local_failure_policy
+                         == 'continue_on_error')
+
+    history = study_config._runtime_history()
+    temporary_files = []
+    temporary_files_manager = study_config._temporary_files_manager()
+    try:
+        execution_list, dependencies = study_config._local_execution_list(
+            process_or_pipeline, execute_qc_nodes, temporary_files,
+            temporary_files_manager)
+        tasks = {}
+
+        async def run_node(node, dependency_tasks):
+            if dependency_tasks:
+                results = await asyncio.gather(*dependency_tasks,
+                                               return_exceptions=True)
+                if [r for r in results if isinstance(r, BaseException)]:
+                    raise _DependencyNotRun()
+            if isinstance(node, Node):
+                process_instance = node.process
+            else:
+                process_instance = node
+            logger.info("Study Config: executing process '{0}'...".format(
+                process_instance.id))
+            output_dir, cachedir = study_config._process_run_settings(
+                process_instance, output_directory)
+            # concurrent executions share the event loop thread: only the
+            # duration of executions can be measured
+            measures = {'start_time': time.time(), 'cpu_time': None,
+                        'peak_rss': None, 'io_read_bytes': None,
+                        'io_write_bytes': None}
+            try:
+                returncode, log_file = await run_process_async(
+                    output_dir, process_instance, cachedir=cachedir,
+                    generate_logging=study_config.generate_logging,
+                    verbose=verbose,
+                    memory_options=study_config._memory_options(),
+                    semaphore=semaphore)
+            except Exception as e:
+                if history is not None:
+                    measures['wall_time'] = time.time() \
+                        - measures['start_time']
+                    history.record(process_instance, measures,
+                                   status='failed',
+                                   error='%s: %s' % (e.__class__.__name__,
+                                                     e))
+                raise
+            if history is not None:
+                measures['wall_time'] = time.time() - measures['start_time']
+                history.record(process_instance, measures)
+            # delete temporary files which are not used anymore
+            temporary_files_manager.node_done(node)
+            return returncode
+
+        for node in execution_list:
+            tasks[node] = asyncio.ensure_future(run_node(
+                node, [tasks[d] for d in dependencies[node]]))
+
+        try:
+            if tasks:
+                if continue_on_error:
+                    await asyncio.wait(list(tasks.values()))
+                else:
+                    done, pending = await asyncio.wait(
+                        list(tasks.values()),
+                        return_when=asyncio.FIRST_EXCEPTION)
+                    for task in pending:
+                        task.cancel()
+                    if pending:
+                        await asyncio.wait(pending)
+        except asyncio.CancelledError:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        errors = {}
+        not_run = []
+        for node in execution_list:
+            task = tasks[node]
+            if task.cancelled():
+                not_run.append(node)
+            elif isinstance(task.exception(), _DependencyNotRun):
+                not_run.append(node)
+            elif task.exception() is not None:
+                errors[node] = task.exception()
+        if errors:
+            if not continue_on_error:
+                raise list(errors.values())[0]
+            raise ParallelExecutionError(errors, not_run)
+        if execution_list:
+            return tasks[execution_list[-1]].result()
+    finally:
+        if history is not None:
+            history.save()
+        if temporary_files:
+            process_or_pipeline._free_temporary_files(temporary_files)
+        temporary_files_manager.cleanup()
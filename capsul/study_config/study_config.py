@@ -33,6 +33,7 @@ import json
 import sys
 import six
 import weakref
+import threading
 if sys.version_info[:2] >= (2, 7):
     from collections import OrderedDict
 else:
@@ -42,7 +43,7 @@ else:
 logger = logging.getLogger(__name__)
 
 # Trait import
-from traits.api import File, Directory, Bool, String, Undefined
+from traits.api import File, Directory, Bool, String, Undefined, Int, Enum
 
 # Soma import
 from soma.controller import Controller
@@ -51,7 +52,10 @@ from soma.controller import Controller
 from capsul.pipeline.pipeline import Pipeline
 from capsul.process.process import Process
 from capsul.study_config.run import run_process
+from capsul.study_config.run import workflow_nodes_dependencies
+from capsul.study_config.run import run_nodes_in_parallel
 from capsul.pipeline.pipeline_nodes import Node
+from capsul.pipeline.temporary_files import TemporaryFilesManager
 from capsul.study_config.process_instance import get_process_instance
 
 if sys.version_info[0] >= 3:
@@ -124,6 +128,26 @@ class StudyConfig(Controller):
         subdirectory to output_directory. This subdirectory is named 
         '<count>-<name>' where <count> if self.process_counter and <name> 
         is the name of the process.
+    `local_parallel_workers` : int (default 1)
+        Number of pipeline nodes executed at the same time when running
+        without soma-workflow. 0 means the number of processors.
+    `local_failure_policy` : str (default 'fail_fast')
+        Behaviour of an execution without soma-workflow when a node fails:
+        'fail_fast' does not start any other node, 'continue_on_error'
+        executes all the nodes which do not depend on the failed one.
+    `record_runtime_history` : bool (default True)
+        Record the duration and resources usage of executed processes in the
+        runtime history of the engine (see
+        :class:`capsul.engine.runtime_history.RuntimeHistory`).
+    `temporary_directory` : str
+        Directory where temporary files of pipelines executions are created,
+        the system temporary directory if undefined
+    `fast_temporary_directory` : str
+        Directory for small temporary files (a RAM disk like /dev/shm for
+        instance), not used if undefined
+    `fast_temporary_max_size` : int (default 256)
+        Maximum estimated size, in MB, of temporary files placed in
+        fast_temporary_directory
 
     Methods
     -------
@@ -171,6 +195,39 @@ class StudyConfig(Controller):
              "'<count>-<name>' where <count> if self.process_counter and <name> "
              "is the name of the process.")
 
+    local_parallel_workers = Int(
+        1,
+        desc="Number of pipeline nodes executed at the same time when "
+             "running without soma-workflow. 0 means the number of "
+             "processors.")
+
+    local_failure_policy = Enum(
+        'fail_fast', 'continue_on_error',
+        desc="Behaviour of an execution without soma-workflow when a node "
+             "fails: 'fail_fast' does not start any other node, "
+             "'continue_on_error' executes all the nodes which do not "
+             "depend on the failed one.")
+
+    record_runtime_history = Bool(
+        True,
+        desc="Record the duration and resources usage of executed "
+             "processes in the runtime history of the engine.")
+
+    temporary_directory = Directory(
+        Undefined,
+        desc="Directory where temporary files of pipelines executions are "
+             "created, the system temporary directory if undefined")
+
+    fast_temporary_directory = Directory(
+        Undefined,
+        desc="Directory for small temporary files (a RAM disk like /dev/shm "
+             "for instance), not used if undefined")
+
+    fast_temporary_max_size = Int(
+        256,
+        desc="Maximum estimated size, in MB, of temporary files placed in "
+             "fast_temporary_directory")
+
     def __init__(self, study_name=None, init_config=None, modules=None,
                  engine=None, **override_config):
         """ Initilize the StudyConfig class
@@ -195,6 +252,7 @@ class StudyConfig(Controller):
         """
 
         super(StudyConfig, self).__init__()
+        self._process_counter_lock = threading.Lock()
         
         if study_name:
             self.study_name = study_name
@@ -304,7 +362,7 @@ class StudyConfig(Controller):
             return module
 
     def run(self, process_or_pipeline, output_directory= None,
-            execute_qc_nodes=True, verbose=0, **kwargs):
+            execute_qc_nodes=True, verbose=0, stop_event=None, **kwargs):
         """Method to execute a process or a pipline in a study configuration
          environment.
 
@@ -330,27 +388,19 @@ class StudyConfig(Controller):
             process nodes.
         verbose: int
             if different from zero, print console messages.
+        stop_event: threading.Event (optional)
+            allows to interrupt a local execution: when this event is set, no
+            new pipeline node is started and an ExecutionInterrupted exception
+            is raised once the running nodes are finished.
+
+        When smart-caching is used with smart_caching_skip_up_to_date, nodes
+        whose inputs have not changed since their last execution are skipped
+        (see :mod:`capsul.study_config.node_cache`). The names of the reused
+        and recomputed nodes of a local execution are then available in
+        self.caching_report, a dict {'reused': list, 'recomputed': list}.
         """
         
-        if self.create_output_directories:
-            for name, trait in process_or_pipeline.user_traits().items():
-                if trait.output and isinstance(trait.handler, (File, Directory)):
-                    value = getattr(process_or_pipeline, name)
-                    if value is not Undefined and value:
-                        base = os.path.dirname(value)
-                        if base and not os.path.exists(base):
-                            os.makedirs(base)
-                            
-        for k, v in six.iteritems(kwargs):
-            setattr(process_or_pipeline, k, v)
-        missing = process_or_pipeline.get_missing_mandatory_parameters()
-        if len(missing) != 0:
-            ptype = 'process'
-            if isinstance(process_or_pipeline, Pipeline):
-                ptype = 'pipeline'
-            raise ValueError('In %s %s: missing mandatory parameters: %s'
-                             % (ptype, process_or_pipeline.name,
-                                ', '.join(missing)))
+        self._prepare_run(process_or_pipeline, kwargs)
 
         # Use soma worflow to execute the pipeline or porcess in parallel
         # on the local machine
@@ -359,9 +409,16 @@ class StudyConfig(Controller):
             # Create soma workflow pipeline
             from capsul.pipeline.pipeline_workflow import (
                 workflow_from_pipeline, workflow_run)
-            workflow = workflow_from_pipeline(process_or_pipeline)
+            history = self._runtime_history()
+            job_processes = {} if history is not None else None
+            workflow = workflow_from_pipeline(process_or_pipeline,
+                                              job_processes=job_processes)
             controller, wf_id = workflow_run(process_or_pipeline.id,
                                              workflow, self)
+            if history is not None:
+                history.record_workflow(controller, wf_id, workflow,
+                                        job_processes)
+                history.save()
             workflow_status = controller.workflow_status(wf_id)
             elements_status = controller.workflow_elements_status(wf_id)
             # FIXME: it would be better if study_config does not require
@@ -393,120 +450,305 @@ class StudyConfig(Controller):
 
         # Use the local machine to execute the pipeline or process
         else:
-            if output_directory is None or output_directory is Undefined:
-                output_directory = self.output_directory
-            # Not all processes need an output_directory defined on
-            # StudyConfig
-            if output_directory is not None and output_directory is not Undefined:
-                # Check the output directory is valid
-                if not isinstance(output_directory, basestring):
-                    raise ValueError(
-                        "'{0}' is not a valid directory. A valid output "
-                        "directory is expected to run the process or "
-                        "pipeline.".format(output_directory))
-                try:
-                    if not os.path.isdir(output_directory):
-                        os.makedirs(output_directory)
-                except:
-                    raise ValueError(
-                        "Can't create folder '{0}', please investigate.".format(
-                            output_directory))
+            output_directory = self._local_output_directory(
+                output_directory)
 
             # Temporary files can be generated for pipelines
             temporary_files = []
+            temporary_files_manager = self._temporary_files_manager()
             result = None
+            node_cache = self._node_cache(output_directory)
             try:
-                # Generate ordered execution list
-                execution_list = []
-                if isinstance(process_or_pipeline, Pipeline):
-                    execution_list = \
-                        process_or_pipeline.workflow_ordered_nodes()
-                    # Filter process nodes if necessary
-                    if not execute_qc_nodes:
-                        execution_list = [node for node in execution_list
-                                          if node.node_type
-                                              == "processing_node"]
-                    for node in execution_list:
-                        # check temporary outputs and allocate files
-                        process_or_pipeline._check_temporary_files_for_node(
-                            node, temporary_files)
-                elif isinstance(process_or_pipeline, Process):
-                    execution_list.append(process_or_pipeline)
-                else:
-                    raise Exception(
-                        "Unknown instance type. Got {0}and expect Process or "
-                        "Pipeline instances".format(
-                            process_or_pipeline.__module__.name__))
+                # Generate the execution list and the nodes dependencies
+                execution_list, dependencies = self._local_execution_list(
+                    process_or_pipeline, execute_qc_nodes, temporary_files,
+                    temporary_files_manager)
 
-                # Execute each process node element
-                for process_node in execution_list:
+                def run_node(process_node):
                     # Execute the process instance contained in the node
                     if isinstance(process_node, Node):
-                        result = self._run(process_node.process, 
-                                           output_directory, 
-                                           verbose)
-
+                        process_instance = process_node.process
+                        name = process_node.full_name
                     # Execute the process instance
                     else:
-                        result = self._run(process_node, output_directory,
-                                           verbose)
+                        process_instance = process_node
+                        name = process_node.name
+                    if node_cache is None:
+                        result = self._run(process_instance,
+                                           output_directory, verbose)
+                    else:
+                        # Skip up to date nodes
+                        key = node_cache.node_key(process_instance)
+                        if node_cache.reuse(process_instance, key, name):
+                            result = None
+                        else:
+                            result = self._run(process_instance,
+                                               output_directory, verbose)
+                            node_cache.record(process_instance, key, name)
+                    # delete temporary files which are not used anymore
+                    temporary_files_manager.node_done(process_node)
+                    return result
+
+                # Execute each process node element
+                results = run_nodes_in_parallel(
+                    execution_list, dependencies, run_node,
+                    max_workers=self.local_parallel_workers,
+                    continue_on_error=(self.local_failure_policy
+                                       == 'continue_on_error'),
+                    stop_event=stop_event)
+                if execution_list:
+                    result = results.get(execution_list[-1])
             finally:
+                if node_cache is not None:
+                    self.caching_report = node_cache.report()
+                    node_cache.close()
+                history = self._runtime_history()
+                if history is not None:
+                    history.save()
                 # Destroy temporary files
                 if temporary_files:
                     # If temporary files have been created, we are sure that
                     # process_or_pipeline is a pipeline with a method
                     # _free_temporary_files.
                     process_or_pipeline._free_temporary_files(temporary_files)
+                temporary_files_manager.cleanup()
             return result
 
-    def _run(self, process_instance, output_directory, verbose, **kwargs):
-        """ Method to execute a process in a study configuration environment.
+    def run_async(self, process_or_pipeline, output_directory=None,
+                  execute_qc_nodes=True, verbose=0, max_concurrency=None,
+                  **kwargs):
+        """ Coroutine counterpart of run() (Python 3 only)::
 
-        Parameters
-        ----------
-        process_instance: Process instance (mandatory)
-            the process we want to execute
-        output_directory: Directory name (optional)
-            the output directory to use for process execution. This replaces
-            self.output_directory but left it unchanged.
-        verbose: int
-            if different from zero, print console messages.
+            await study_config.run_async(pipeline)
+
+        Command line processes run as asyncio subprocesses, at most
+        max_concurrency at the same time (default: local_parallel_workers).
+        See :func:`capsul.study_config.run_async.run_async`.
         """
-        # Message
-        logger.info("Study Config: executing process '{0}'...".format(
-            process_instance.id))
+        from capsul.study_config.run_async import run_async
+        return run_async(self, process_or_pipeline,
+                         output_directory=output_directory,
+                         execute_qc_nodes=execute_qc_nodes, verbose=verbose,
+                         max_concurrency=max_concurrency, **kwargs)
+
+    def _prepare_run(self, process_or_pipeline, kwargs):
+        """ Create output directories if requested, set the parameters given
+        for an execution and check that mandatory parameters are set.
+        """
+        if self.create_output_directories:
+            for name, trait in process_or_pipeline.user_traits().items():
+                if trait.output and isinstance(trait.handler, (File, Directory)):
+                    value = getattr(process_or_pipeline, name)
+                    if value is not Undefined and value:
+                        base = os.path.dirname(value)
+                        if base and not os.path.exists(base):
+                            os.makedirs(base)
+                            
+        for k, v in six.iteritems(kwargs):
+            setattr(process_or_pipeline, k, v)
+        missing = process_or_pipeline.get_missing_mandatory_parameters()
+        if len(missing) != 0:
+            ptype = 'process'
+            if isinstance(process_or_pipeline, Pipeline):
+                ptype = 'pipeline'
+            raise ValueError('In %s %s: missing mandatory parameters: %s'
+                             % (ptype, process_or_pipeline.name,
+                                ', '.join(missing)))
 
-        # Run
+    def _local_output_directory(self, output_directory):
+        """ Return the output directory used for a local execution, created
+        if needed.
+        """
+        if output_directory is None or output_directory is Undefined:
+            output_directory = self.output_directory
+        # Not all processes need an output_directory defined on
+        # StudyConfig
+        if output_directory is not None and output_directory is not Undefined:
+            # Check the output directory is valid
+            if not isinstance(output_directory, basestring):
+                raise ValueError(
+                    "'{0}' is not a valid directory. A valid output "
+                    "directory is expected to run the process or "
+                    "pipeline.".format(output_directory))
+            try:
+                if not os.path.isdir(output_directory):
+                    os.makedirs(output_directory)
+            except:
+                raise ValueError(
+                    "Can't create folder '{0}', please investigate.".format(
+                        output_directory))
+        return output_directory
+
+    def _local_execution_list(self, process_or_pipeline, execute_qc_nodes,
+                              temporary_files, temporary_files_manager=None):
+        """ Return the list of nodes (or processes) to execute locally, in a
+        topological order, and their dependencies. Temporary files of
+        pipelines are allocated and appended to temporary_files. If a
+        TemporaryFilesManager is given, it allocates them and tracks the
+        nodes using them.
+        """
+        execution_list = []
+        dependencies = {}
+        if isinstance(process_or_pipeline, Pipeline):
+            node_filter = None
+            # Filter process nodes if necessary
+            if not execute_qc_nodes:
+                node_filter = lambda node: \
+                    node.node_type == "processing_node"
+            execution_list, dependencies \
+                = workflow_nodes_dependencies(
+                    process_or_pipeline.workflow_graph(), node_filter)
+            for node in execution_list:
+                # check temporary outputs and allocate files
+                process_or_pipeline._check_temporary_files_for_node(
+                    node, temporary_files, temporary_files_manager)
+            if temporary_files_manager is not None:
+                temporary_files_manager.track_consumers(temporary_files,
+                                                        execution_list)
+        elif isinstance(process_or_pipeline, Process):
+            execution_list.append(process_or_pipeline)
+            dependencies[process_or_pipeline] = set()
+        else:
+            raise Exception(
+                "Unknown instance type. Got {0}and expect Process or "
+                "Pipeline instances".format(
+                    process_or_pipeline.__module__.name__))
+        return execution_list, dependencies
+
+    def _process_run_settings(self, process_instance, output_directory):
+        """ Reserve a process number and return the output directory (created
+        if needed) and the cache directory used to execute a process.
+        """
+        # Cache directory
         if self.get_trait_value("use_smart_caching") in [None, False]:
             cachedir = None
         else:
             cachedir = output_directory
 
+        # Reserve a process number (processes may run in parallel)
+        with self._process_counter_lock:
+            process_counter = self.process_counter
+            self.process_counter += 1
+
         # Update the output directory folder if necessary
         if output_directory is not None and output_directory is not Undefined and output_directory:
             if self.process_output_directory:
-                output_directory = os.path.join(output_directory, '%s-%s' % (self.process_counter, process_instance.name))
+                output_directory = os.path.join(output_directory, '%s-%s' % (process_counter, process_instance.name))
             # Guarantee that the output directory exists
             if not os.path.isdir(output_directory):
-                os.makedirs(output_directory)
+                try:
+                    os.makedirs(output_directory)
+                except OSError:
+                    # it may have been created by a concurrent process
+                    if not os.path.isdir(output_directory):
+                        raise
             if self.process_output_directory:
                 if 'output_directory' in process_instance.user_traits():
                     if (process_instance.output_directory is Undefined or
                             not(process_instance.output_directory)):
                         process_instance.output_directory = output_directory
-        
-        returncode, log_file = run_process(
-            output_directory,
-            process_instance,
-            cachedir=cachedir,
-            generate_logging=self.generate_logging,
-            verbose=verbose,
-            **kwargs)
-
-        # Increment the number of executed process count
-        self.process_counter += 1
+        return output_directory, cachedir
+
+    def _node_cache(self, output_directory):
+        """ Return the NodeCache used to skip up to date nodes during a local
+        execution, or None if nodes must not be skipped.
+        """
+        if self.get_trait_value("use_smart_caching") in [None, False] \
+                or not self.get_trait_value("smart_caching_skip_up_to_date") \
+                or output_directory is None or output_directory is Undefined:
+            return None
+        from capsul.study_config.node_cache import NodeCache
+        from capsul.study_config.memory import DigestIndex
+        cachedir = os.path.join(os.path.abspath(output_directory),
+                                "capsul_memory")
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        digest_index = None
+        if self.get_trait_value("smart_caching_fingerprint") == "content":
+            digest_index = DigestIndex(
+                os.path.join(cachedir, "digest_index.sqlite"))
+        return NodeCache(os.path.join(cachedir, "node_cache.sqlite"),
+                         digest_index)
+
+    def _memory_options(self):
+        """ Return the parameters of the smart-caching Memory.
+        """
+        options = {}
+        for option, trait_name in (
+                ("fingerprint", "smart_caching_fingerprint"),
+                ("max_size", "smart_caching_max_size"),
+                ("max_entries", "smart_caching_max_entries"),
+                ("eviction_policy", "smart_caching_eviction_policy")):
+            value = self.get_trait_value(trait_name)
+            if value is not None and value is not Undefined:
+                options[option] = value
+        return options
+
+    def _run(self, process_instance, output_directory, verbose, **kwargs):
+        """ Method to execute a process in a study configuration environment.
+
+        Parameters
+        ----------
+        process_instance: Process instance (mandatory)
+            the process we want to execute
+        output_directory: Directory name (optional)
+            the output directory to use for process execution. This replaces
+            self.output_directory but left it unchanged.
+        verbose: int
+            if different from zero, print console messages.
+        """
+        # Message
+        logger.info("Study Config: executing process '{0}'...".format(
+            process_instance.id))
+
+        output_directory, cachedir = self._process_run_settings(
+            process_instance, output_directory)
+
+        from capsul.engine.runtime_history import ResourceMonitor
+        history = self._runtime_history()
+        monitor = ResourceMonitor()
+        try:
+            with monitor:
+                returncode, log_file = run_process(
+                    output_directory,
+                    process_instance,
+                    cachedir=cachedir,
+                    generate_logging=self.generate_logging,
+                    verbose=verbose,
+                    memory_options=self._memory_options(),
+                    **kwargs)
+        except Exception as e:
+            if history is not None:
+                history.record(process_instance, monitor.measures,
+                               status='failed',
+                               error='%s: %s' % (e.__class__.__name__, e))
+            raise
+        if history is not None:
+            history.record(process_instance, monitor.measures)
+
         return returncode
-    
+
+    def _temporary_files_manager(self):
+        """ Return a TemporaryFilesManager for an execution, placing files
+        according to the temporary directories options.
+        """
+        directory = self.temporary_directory
+        if directory in (None, Undefined, ''):
+            directory = None
+        fast_directory = self.fast_temporary_directory
+        if fast_directory in (None, Undefined, ''):
+            fast_directory = None
+        return TemporaryFilesManager(
+            directory, fast_directory,
+            fast_max_size=self.fast_temporary_max_size * 1024 * 1024)
+
+    def _runtime_history(self):
+        """ Return the runtime history where executions are recorded, or
+        None if they must not be recorded.
+        """
+        if not self.get_trait_value("record_runtime_history"):
+            return None
+        return self.engine.runtime_history
 
     def reset_process_counter(self):
         """ Method to reset the process counter to one.
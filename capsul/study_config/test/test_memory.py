@@ -13,12 +13,15 @@ import unittest
 import os
 import tempfile
 import shutil
+import threading
+import time
 
 # Capsul import
 from capsul.api import Process
 from capsul.api import FileCopyProcess
 from capsul.api import get_process_instance
 from capsul.study_config.memory import Memory
+from capsul.study_config.study_config import StudyConfig
 
 # Trait import
 from traits.api import Float, File, List, String
@@ -50,6 +53,48 @@ class DummyCopyProcess(FileCopyProcess):
         self.s = repr(self.copied_inputs)
 
 
+class DummyFileProcess(Process):
+    """ Write a file whose content does not depend on f.
+    """
+    f = Float(output=False, optional=False, desc="float")
+    out = File(output=True, optional=False, desc="output file")
+
+    def _run_process(self):
+        DummyFileProcess.runs += 1
+        with open(self.out, "w") as open_file:
+            open_file.write("constant content\n")
+
+DummyFileProcess.runs = 0
+
+
+class DummyInputFileProcess(Process):
+    """ Read an input file.
+    """
+    i = File(output=False, optional=False, desc="input file")
+    res = String(output=True, desc="input file content")
+
+    def _run_process(self):
+        DummyInputFileProcess.runs += 1
+        with open(self.i) as open_file:
+            self.res = open_file.read()
+
+DummyInputFileProcess.runs = 0
+
+
+class DummySlowProcess(Process):
+    """ Slow computation.
+    """
+    f = Float(output=False, optional=False, desc="float")
+    res = Float(output=True, desc="float")
+
+    def _run_process(self):
+        DummySlowProcess.runs += 1
+        time.sleep(0.2)
+        self.res = self.f * 2
+
+DummySlowProcess.runs = 0
+
+
 class TestMemory(unittest.TestCase):
     """ Execute a process using smart-caching functionalities.
     """
@@ -97,6 +142,248 @@ class TestMemory(unittest.TestCase):
         # Call the test
         self.proxy_process_copy()
 
+    def test_blob_store(self):
+        """ Test the deduplication of cached files.
+        """
+        self.cachedir = tempfile.mkdtemp()
+        self.mem = Memory(self.cachedir)
+        DummyFileProcess.runs = 0
+        out1 = os.path.join(self.workspace_dir, "out1.txt")
+        out2 = os.path.join(self.workspace_dir, "out2.txt")
+        proxy_process = self.mem.cache(DummyFileProcess(), verbose=0)
+        proxy_process(f=1., out=out1)
+        proxy_process(f=2., out=out2)
+        self.assertEqual(DummyFileProcess.runs, 2)
+
+        # identical outputs are stored once
+        blob_store = self.mem.blob_store
+        digests = []
+        for root, dirs, files in os.walk(blob_store.directory):
+            digests.extend(f for f in files if not f.endswith(".json"))
+        self.assertEqual(len(digests), 1)
+        self.assertEqual(blob_store.references(digests[0]), 2)
+        # the store size is maintained without walking the store
+        self.assertEqual(
+            blob_store.total_size(),
+            os.path.getsize(blob_store.blob_path(digests[0])))
+
+        # a cache hit restores the file
+        os.unlink(out1)
+        proxy_process(f=1., out=out1)
+        self.assertEqual(DummyFileProcess.runs, 2)
+        with open(out1) as open_file:
+            self.assertEqual(open_file.read(), "constant content\n")
+
+        # a stored file modified in place is not used
+        if os.path.samefile(out1, blob_store.blob_path(digests[0])):
+            with open(out1, "a") as open_file:
+                open_file.write("modified\n")
+            proxy_process(f=1., out=out1)
+            self.assertEqual(DummyFileProcess.runs, 3)
+
+        # blobs are removed with the last cache entry using them
+        self.mem.clear()
+        self.assertFalse(os.path.exists(blob_store.blob_path(digests[0])))
+        self.assertEqual(blob_store.total_size(), 0)
+        self.assertEqual(self.mem.statistics()["size"], 0)
+        self.mem.close()
+
+    def test_restored_outputs(self):
+        """ Test that restored outputs do not share their data.
+        """
+        for use_hardlinks in (False, True):
+            self.cachedir = tempfile.mkdtemp()
+            self.mem = Memory(self.cachedir, use_hardlinks=use_hardlinks)
+            DummyFileProcess.runs = 0
+            out1 = os.path.join(self.workspace_dir, "out1.txt")
+            out2 = os.path.join(self.workspace_dir, "out2.txt")
+            proxy_process = self.mem.cache(DummyFileProcess(), verbose=0)
+            proxy_process(f=1., out=out1)
+            proxy_process(f=2., out=out2)
+            os.unlink(out2)
+            proxy_process(f=2., out=out2)
+            self.assertEqual(DummyFileProcess.runs, 2)
+            self.assertFalse(os.path.samefile(out1, out2))
+
+            # editing a restored output modifies neither the other output
+            # nor the stored file
+            with open(out2, "a") as open_file:
+                open_file.write("user edit of out2\n")
+            blob_store = self.mem.blob_store
+            digests = []
+            for root, dirs, files in os.walk(blob_store.directory):
+                digests.extend(f for f in files if not f.endswith(".json"))
+            for path in (out1, blob_store.blob_path(digests[0])):
+                with open(path) as open_file:
+                    self.assertEqual(open_file.read(), "constant content\n")
+            self.mem.close()
+            shutil.rmtree(self.cachedir)
+            os.unlink(out1)
+            os.unlink(out2)
+
+    def test_content_fingerprint(self):
+        """ Test the identification of input files by their content.
+        """
+        self.cachedir = tempfile.mkdtemp()
+        self.mem = Memory(self.cachedir, fingerprint="content")
+        DummyInputFileProcess.runs = 0
+        input1 = os.path.join(self.workspace_dir, "input1.txt")
+        input2 = os.path.join(self.workspace_dir, "input2.txt")
+        with open(input1, "w") as open_file:
+            open_file.write("input content\n")
+        proxy_process = self.mem.cache(DummyInputFileProcess(), verbose=0)
+        proxy_process(i=input1)
+        self.assertEqual(DummyInputFileProcess.runs, 1)
+
+        # a copy of the input file gives a cache hit
+        shutil.copy(input1, input2)
+        proxy_process(i=input2)
+        self.assertEqual(DummyInputFileProcess.runs, 1)
+        self.assertEqual(proxy_process.res, "input content\n")
+
+        # each file is hashed once, until it is modified
+        digest = self.mem.digest_index.digest(input2)
+        with open(input2, "w") as open_file:
+            open_file.write("other content\n")
+        self.assertNotEqual(self.mem.digest_index.digest(input2), digest)
+        proxy_process(i=input2)
+        self.assertEqual(DummyInputFileProcess.runs, 2)
+        self.mem.close()
+        self.assertIsNone(self.mem.digest_index._connection)
+        self.assertIsNone(self.mem.cache_index._connection)
+
+    def test_eviction(self):
+        """ Test the cache size limits and statistics.
+        """
+        self.cachedir = tempfile.mkdtemp()
+        self.mem = Memory(self.cachedir, max_entries=2)
+        proxy_process = self.mem.cache(DummyProcess(), verbose=0)
+        for f in (1., 2., 1., 3.):
+            proxy_process(f=f, ff=2.)
+        # f=2. is the least recently used entry
+        statistics = self.mem.statistics()
+        self.assertEqual(statistics["hits"], 1)
+        self.assertEqual(statistics["misses"], 3)
+        self.assertEqual(statistics["evictions"], 1)
+        self.assertEqual(statistics["entries"], 2)
+        # the lock files of evicted entries are removed
+        self.assertEqual(len(self.entry_locks()), 2)
+        proxy_process(f=1., ff=2.)
+        proxy_process(f=2., ff=2.)
+        self.assertEqual(self.mem.statistics()["misses"], 4)
+
+        # size budget
+        self.mem.evict(max_size=self.mem.statistics()["size"] - 1)
+        self.assertEqual(self.mem.statistics()["entries"], 1)
+        self.mem.clear()
+        self.assertEqual(self.mem.statistics()["entries"], 0)
+        self.assertEqual(self.entry_locks(), [])
+        self.mem.cache_index.close()
+
+    def test_eviction_batches(self):
+        """ Test the eviction when candidates are read by batches.
+        """
+        self.cachedir = tempfile.mkdtemp()
+        self.mem = Memory(self.cachedir)
+        self.mem.cache_index.eviction_batch_size = 2
+        proxy_process = self.mem.cache(DummyProcess(), verbose=0)
+        for f in range(7):
+            proxy_process(f=float(f), ff=2.)
+        paths = [entry["path"] for entry in sorted(
+            self.mem.cache_index.entries(),
+            key=lambda entry: entry["last_hit_time"])]
+        # kept entries are passed over
+        evicted = self.mem.cache_index.enforce_limits(
+            max_entries=4, keep=paths[:2])
+        self.assertEqual(evicted, paths[2:5])
+        self.assertEqual(self.mem.statistics()["entries"], 4)
+        self.mem.cache_index.close()
+
+    def entry_locks(self):
+        """ Lock files of the cache entries.
+        """
+        return [name for root, dirs, files in os.walk(self.cachedir)
+                for name in files
+                if name.endswith(".lock") and name != "blob_store.lock"]
+
+    def test_cost_eviction(self):
+        """ Test that expensive results are kept by the cost policy.
+        """
+        self.cachedir = tempfile.mkdtemp()
+        self.mem = Memory(self.cachedir, eviction_policy="cost")
+        proxy_process = self.mem.cache(DummyProcess(), verbose=0)
+        proxy_process(f=1., ff=2.)
+        proxy_process(f=2., ff=2.)
+        entries = self.mem.cache_index.entries()
+        expensive = entries[0]["path"]
+        self.mem.cache_index.add_entry(expensive, entries[0]["size"], 0, 100.)
+        self.mem.evict(max_entries=1)
+        self.assertEqual(
+            [entry["path"] for entry in self.mem.cache_index.entries()],
+            [expensive])
+        self.mem.cache_index.close()
+
+    def test_concurrent_calls(self):
+        """ Test that concurrent identical calls compute the entry once.
+        """
+        self.cachedir = tempfile.mkdtemp()
+        self.mem = Memory(self.cachedir)
+        DummySlowProcess.runs = 0
+        proxy_processes = [self.mem.cache(DummySlowProcess(), verbose=0)
+                           for i in range(4)]
+        threads = [threading.Thread(target=proxy_process, kwargs={"f": 1.})
+                   for proxy_process in proxy_processes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(DummySlowProcess.runs, 1)
+        for proxy_process in proxy_processes:
+            self.assertEqual(proxy_process.res, 2.)
+        statistics = self.mem.statistics()
+        self.assertEqual(statistics["misses"], 1)
+        self.assertEqual(statistics["hits"], 3)
+        self.mem.cache_index.close()
+
+    def test_incomplete_entry(self):
+        """ Test the repair of entries left by an interrupted computation.
+        """
+        self.cachedir = tempfile.mkdtemp()
+        self.mem = Memory(self.cachedir)
+        DummySlowProcess.runs = 0
+        proxy_process = self.mem.cache(DummySlowProcess(), verbose=0)
+        proxy_process.process.f = 1.
+        process_dir = proxy_process._get_process_id()[0]
+
+        # a killed computation leaves a temporary directory, and an older
+        # version an entry directory without results
+        os.makedirs(process_dir + ".tmp-killed")
+        os.makedirs(process_dir)
+        proxy_process(f=1.)
+        self.assertEqual(DummySlowProcess.runs, 1)
+        self.assertFalse(os.path.exists(process_dir + ".tmp-killed"))
+        self.assertTrue(os.path.isfile(os.path.join(process_dir,
+                                                    "result.json")))
+        proxy_process(f=1.)
+        self.assertEqual(DummySlowProcess.runs, 1)
+        self.mem.cache_index.close()
+
+    def test_study_config_run(self):
+        """ Test a process using its StudyConfig smart-caching.
+        """
+        study_config = StudyConfig(modules=["SmartCachingConfig"],
+                                   use_smart_caching=True,
+                                   output_directory=self.workspace_dir)
+        DummySlowProcess.runs = 0
+        process = DummySlowProcess()
+        process.set_study_config(study_config)
+        process.f = 1.
+        # the cache entry lock must not be taken again by the process itself
+        study_config.run(process)
+        study_config.run(process)
+        self.assertEqual(DummySlowProcess.runs, 1)
+        self.assertEqual(process.res, 2.)
+
     def proxy_process(self):
         """ Test the proxy process behaviours.
         """
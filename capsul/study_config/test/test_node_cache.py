@@ -0,0 +1,164 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+from __future__ import print_function
+
+# System import
+import unittest
+import os
+import tempfile
+import shutil
+import time
+
+# Capsul import
+from capsul.api import Process, Pipeline
+from capsul.study_config.study_config import StudyConfig
+from capsul.study_config.node_cache import NodeCache
+from capsul.study_config.memory import DigestIndex
+
+# Trait import
+from traits.api import File, Int
+
+
+class Upper(Process):
+    """ Write the input file content in upper case.
+    """
+    input = File(output=False, desc="input file")
+    output = File(output=True, desc="output file")
+
+    def _run_process(self):
+        Upper.runs.append(os.path.basename(self.output))
+        with open(self.input) as f:
+            content = f.read()
+        with open(self.output, "w") as f:
+            f.write(content.upper())
+
+
+class Concat(Process):
+    """ Concatenate two files and count the characters.
+    """
+    input1 = File(output=False, desc="first input file")
+    input2 = File(output=False, desc="second input file")
+    output = File(output=True, desc="output file")
+    length = Int(output=True, desc="output file length")
+
+    def _run_process(self):
+        Upper.runs.append(os.path.basename(self.output))
+        content = ""
+        for fname in (self.input1, self.input2):
+            with open(fname) as f:
+                content += f.read()
+        with open(self.output, "w") as f:
+            f.write(content)
+        self.length = len(content)
+
+
+class TwoBranches(Pipeline):
+    """ Two independent Upper nodes followed by a Concat node. Executions
+    are recorded by their output file name.
+    """
+    def pipeline_definition(self):
+        self.add_process("upper_a", Upper)
+        self.add_process("upper_b", Upper)
+        self.add_process("concat", Concat)
+        self.add_link("upper_a.output->concat.input1")
+        self.add_link("upper_b.output->concat.input2")
+        self.export_parameter("upper_a", "input", "input_a")
+        self.export_parameter("upper_b", "input", "input_b")
+        self.export_parameter("upper_a", "output", "output_a")
+        self.export_parameter("upper_b", "output", "output_b")
+        self.export_parameter("concat", "output")
+        self.export_parameter("concat", "length")
+
+
+class TestNodeCache(unittest.TestCase):
+    """ Test the skipping of up to date pipeline nodes.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.study_config = StudyConfig(
+            modules=["SmartCachingConfig"],
+            use_smart_caching=True,
+            smart_caching_skip_up_to_date=True,
+            output_directory=os.path.join(self.tmpdir, "out"))
+        self.files = {}
+        for name in ("input_a", "input_b", "output_a", "output_b",
+                     "output"):
+            self.files[name] = os.path.join(self.tmpdir, name + ".txt")
+        for name in ("input_a", "input_b"):
+            with open(self.files[name], "w") as f:
+                f.write(name)
+        Upper.runs = []
+        self.all_outputs = ["output.txt", "output_a.txt", "output_b.txt"]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_pipeline(self):
+        pipeline = self.study_config.get_process_instance(TwoBranches)
+        Upper.runs = []
+        self.study_config.run(pipeline, **self.files)
+        return pipeline
+
+    def test_skip_up_to_date(self):
+        pipeline = self.run_pipeline()
+        self.assertEqual(sorted(Upper.runs), self.all_outputs)
+        self.assertEqual(self.study_config.caching_report["reused"], [])
+        self.assertEqual(pipeline.length, 14)
+
+        # nothing changed: no node is executed, outputs are not touched
+        mtime = os.stat(self.files["output"]).st_mtime
+        pipeline = self.run_pipeline()
+        self.assertEqual(Upper.runs, [])
+        self.assertEqual(sorted(self.study_config.caching_report["reused"]),
+                         ["concat", "upper_a", "upper_b"])
+        self.assertEqual(os.stat(self.files["output"]).st_mtime, mtime)
+        # non-file outputs are restored
+        self.assertEqual(pipeline.length, 14)
+
+        # only the changed branch and its dependent node are executed
+        time.sleep(0.01)
+        with open(self.files["input_b"], "w") as f:
+            f.write("input_b changed")
+        self.run_pipeline()
+        self.assertEqual(sorted(Upper.runs), ["output.txt", "output_b.txt"])
+        self.assertEqual(self.study_config.caching_report["reused"],
+                         ["upper_a"])
+
+        # a removed output file is produced again (here restored by the
+        # process-level cache)
+        os.unlink(self.files["output"])
+        self.run_pipeline()
+        self.assertEqual(self.study_config.caching_report["recomputed"],
+                         ["concat"])
+        with open(self.files["output"]) as f:
+            self.assertEqual(f.read(), "INPUT_AINPUT_B CHANGED")
+
+    def test_close(self):
+        digest_index = DigestIndex(os.path.join(self.tmpdir, "digests"))
+        node_cache = NodeCache(os.path.join(self.tmpdir, "nodes"),
+                               digest_index)
+        process = Upper()
+        process.input = self.files["input_a"]
+        process.output = self.files["output_a"]
+        node_cache.node_key(process)
+        self.assertIsNotNone(digest_index._connection)
+        node_cache.close()
+        self.assertIsNone(digest_index._connection)
+
+
+def test():
+    """ Function to execute unitest.
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestNodeCache)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("RETURNCODE: ", test())
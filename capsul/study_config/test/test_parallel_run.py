@@ -0,0 +1,109 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+from __future__ import print_function
+
+# System import
+import unittest
+import threading
+import time
+
+# Capsul import
+from capsul.api import Process, Pipeline
+from capsul.study_config.study_config import StudyConfig
+from capsul.study_config.run import ParallelExecutionError
+
+# Trait import
+from traits.api import Float, Bool
+
+
+class Increment(Process):
+    """ Add one to its input, after a short sleep.
+    """
+    a = Float(output=False, optional=False)
+    fail = Bool(False, output=False, optional=True)
+    b = Float(output=True)
+
+    def _run_process(self):
+        time.sleep(0.2)
+        if self.fail:
+            raise RuntimeError('failure requested')
+        Increment.threads.add(threading.current_thread())
+        self.b = self.a + 1
+
+Increment.threads = set()
+
+
+class BranchesPipeline(Pipeline):
+    """ Two independent branches of two processes each.
+    """
+    def pipeline_definition(self):
+        for branch in ('1', '2'):
+            self.add_process('first' + branch, Increment)
+            self.add_process('second' + branch, Increment)
+            self.add_link('first%s.b->second%s.a' % (branch, branch))
+            self.export_parameter('first' + branch, 'a', 'a' + branch)
+            self.export_parameter('first' + branch, 'fail', 'fail' + branch)
+            self.export_parameter('second' + branch, 'b', 'b' + branch)
+
+
+class TestParallelRun(unittest.TestCase):
+
+    def setUp(self):
+        Increment.threads = set()
+        self.study_config = StudyConfig(modules=[])
+        self.pipeline = self.study_config.get_process_instance(
+            BranchesPipeline)
+
+    def test_parallel_run(self):
+        self.study_config.local_parallel_workers = 2
+        t0 = time.time()
+        self.study_config.run(self.pipeline, a1=1., a2=10.)
+        duration = time.time() - t0
+        self.assertEqual(self.pipeline.b1, 3.)
+        self.assertEqual(self.pipeline.b2, 12.)
+        self.assertEqual(len(Increment.threads), 2)
+        # branches run at the same time
+        self.assertTrue(duration < 0.75)
+
+    def test_fail_fast(self):
+        self.study_config.local_parallel_workers = 2
+        self.assertRaises(RuntimeError, self.study_config.run, self.pipeline,
+                          a1=1., a2=10., fail1=True)
+        self.assertEqual(self.pipeline.nodes['second1'].process.a, 0.)
+
+    def test_continue_on_error(self):
+        self.study_config.local_parallel_workers = 2
+        self.study_config.local_failure_policy = 'continue_on_error'
+        try:
+            self.study_config.run(self.pipeline, a1=1., a2=10., fail1=True)
+        except ParallelExecutionError as e:
+            self.assertEqual([node.name for node in e.errors], ['first1'])
+            self.assertEqual([node.name for node in e.not_run], ['second1'])
+        else:
+            self.fail('ParallelExecutionError not raised')
+        self.assertEqual(self.pipeline.b2, 12.)
+
+    def test_sequential_continue_on_error(self):
+        self.study_config.local_failure_policy = 'continue_on_error'
+        self.assertRaises(ParallelExecutionError, self.study_config.run,
+                          self.pipeline, a1=1., a2=10., fail2=True)
+        self.assertEqual(self.pipeline.b1, 3.)
+        self.assertEqual(len(Increment.threads), 1)
+
+
+def test():
+    """ Function to execute unitest
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestParallelRun)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("RETURNCODE: ", test())
@@ -0,0 +1,149 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+from __future__ import print_function
+
+# System import
+import unittest
+import subprocess
+import sys
+import time
+
+# Capsul import
+from capsul.api import Process, Pipeline
+from capsul.study_config.study_config import StudyConfig
+
+# Trait import
+from traits.api import Float, Bool
+
+if sys.version_info[0] >= 3:
+    import asyncio
+    from capsul.subprocess import aio
+else:
+    asyncio = None
+
+
+class SleepCommand(Process):
+    """ Run the sleep command.
+    """
+    delay = Float(output=False)
+    fail = Bool(False, output=False, optional=True)
+
+    def get_commandline(self):
+        if self.fail:
+            return ['false']
+        return ['sleep', str(self.delay)]
+
+
+class Double(Process):
+    """ Python process.
+    """
+    a = Float(output=False)
+    b = Float(output=True)
+
+    def _run_process(self):
+        self.b = self.a * 2
+
+
+class SleepPipeline(Pipeline):
+    """ Four independent sleep commands.
+    """
+    def pipeline_definition(self):
+        for i in range(4):
+            self.add_process('sleep%d' % i, SleepCommand)
+            self.export_parameter('sleep%d' % i, 'delay', 'delay%d' % i)
+            self.export_parameter('sleep%d' % i, 'fail', 'fail%d' % i)
+
+
+@unittest.skipIf(asyncio is None, 'asyncio requires Python 3')
+class TestRunAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.study_config = StudyConfig(modules=[])
+        self.pipeline = self.study_config.get_process_instance(SleepPipeline)
+        for i in range(4):
+            setattr(self.pipeline, 'delay%d' % i, 0.3)
+
+    def run_coroutine(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_concurrency(self):
+        t0 = time.time()
+        self.run_coroutine(self.study_config.run_async(
+            self.pipeline, max_concurrency=4))
+        self.assertTrue(time.time() - t0 < 0.9)
+        t0 = time.time()
+        self.run_coroutine(self.study_config.run_async(
+            self.pipeline, max_concurrency=2))
+        self.assertTrue(time.time() - t0 >= 0.6)
+
+    def test_many_pipelines(self):
+        pipelines = [self.study_config.get_process_instance(SleepPipeline)
+                     for i in range(10)]
+        for pipeline in pipelines:
+            for i in range(4):
+                setattr(pipeline, 'delay%d' % i, 0.3)
+
+        async def run_all():
+            await asyncio.gather(*[
+                self.study_config.run_async(pipeline, max_concurrency=4)
+                for pipeline in pipelines])
+
+        t0 = time.time()
+        self.run_coroutine(run_all())
+        # 40 commands driven by a single thread
+        self.assertTrue(time.time() - t0 < 2.)
+
+    def test_failure(self):
+        self.assertRaises(subprocess.CalledProcessError, self.run_coroutine,
+                          self.study_config.run_async(self.pipeline,
+                                                      fail2=True))
+
+    def test_cancellation(self):
+        self.pipeline.delay0 = 10.
+
+        async def run_with_timeout():
+            await asyncio.wait_for(self.study_config.run_async(
+                self.pipeline, max_concurrency=4), 0.5)
+
+        t0 = time.time()
+        self.assertRaises(asyncio.TimeoutError, self.run_coroutine,
+                          run_with_timeout())
+        # the sleep command has been killed
+        self.assertTrue(time.time() - t0 < 3.)
+
+    def test_python_process(self):
+        process = self.study_config.get_process_instance(Double)
+        self.run_coroutine(process.run_async(a=2.))
+        self.assertEqual(process.b, 4.)
+
+    def test_command_result(self):
+        process = self.study_config.get_process_instance(SleepCommand)
+        process.delay = 0.
+        result = self.run_coroutine(process.run_async())
+        self.assertEqual(result, self.study_config.run(process))
+
+    def test_check_output(self):
+        output = self.run_coroutine(aio.check_output(['echo', 'capsul']))
+        self.assertEqual(output.strip(), b'capsul')
+
+
+def test():
+    """ Function to execute unitest
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestRunAsync)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("RETURNCODE: ", test())
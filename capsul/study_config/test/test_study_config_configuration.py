@@ -31,9 +31,16 @@ tests_no_files = [
         "generate_logging": False,
         'use_matlab': False,
         'use_smart_caching': False,
+        'smart_caching_fingerprint': 'stat',
+        'smart_caching_eviction_policy': 'lru',
+        'smart_caching_skip_up_to_date': False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['FSLConfig', 'MatlabConfig', 'SPMConfig', 'SmartCachingConfig',
         'SomaWorkflowConfig'],
@@ -49,9 +56,16 @@ tests_no_files = [
         "generate_logging": False,
         'use_matlab': False,
         'use_smart_caching': False,
+        'smart_caching_fingerprint': 'stat',
+        'smart_caching_eviction_policy': 'lru',
+        'smart_caching_skip_up_to_date': False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['FSLConfig', 'MatlabConfig', 'SPMConfig', 'SmartCachingConfig',
         'SomaWorkflowConfig'],
@@ -67,9 +81,16 @@ tests_no_files = [
         "generate_logging": False,
         'use_matlab': False,
         'use_smart_caching': False,
+        'smart_caching_fingerprint': 'stat',
+        'smart_caching_eviction_policy': 'lru',
+        'smart_caching_skip_up_to_date': False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['FSLConfig', 'MatlabConfig', 'SPMConfig', 'SmartCachingConfig',
         'SomaWorkflowConfig'],
@@ -92,7 +113,11 @@ tests_no_files = [
         "generate_logging": False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['SomaWorkflowConfig'], None, None]],
 
@@ -108,9 +133,16 @@ tests_no_files = [
         "use_freesurfer": False,
         "shared_directory": soma.config.BRAINVISA_SHARE,
         'use_smart_caching': False,
+        'smart_caching_fingerprint': 'stat',
+        'smart_caching_eviction_policy': 'lru',
+        'smart_caching_skip_up_to_date': False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['BrainVISAConfig', 'FSLConfig', 'FreeSurferConfig', 'MatlabConfig', 
      'SPMConfig', 'SmartCachingConfig', 'SomaWorkflowConfig'],
@@ -134,9 +166,16 @@ tests_standard_files = [
         "generate_logging": False,
         'use_matlab': False,
         'use_smart_caching': False,
+        'smart_caching_fingerprint': 'stat',
+        'smart_caching_eviction_policy': 'lru',
+        'smart_caching_skip_up_to_date': False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['FSLConfig', 'MatlabConfig', 'SPMConfig', 'SmartCachingConfig',
         'SomaWorkflowConfig'],
@@ -158,11 +197,15 @@ tests_standard_files = [
         'use_matlab': False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'attributes_schema_paths': [
             'capsul.attributes.completion_engine_factory'],
         'attributes_schemas': {},
         'process_completion': 'builtin',
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['AttributesConfig', 'BrainVISAConfig', 'FomConfig', 'MatlabConfig', 'SPMConfig', 'SomaWorkflowConfig'],
     'config.json',
@@ -177,9 +220,16 @@ tests_standard_files = [
         "generate_logging": False,
         'use_matlab': False,
         'use_smart_caching': False,
+        'smart_caching_fingerprint': 'stat',
+        'smart_caching_eviction_policy': 'lru',
+        'smart_caching_skip_up_to_date': False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['FSLConfig', 'MatlabConfig', 'SPMConfig', 'SmartCachingConfig',
         'SomaWorkflowConfig'],
@@ -191,7 +241,11 @@ tests_standard_files = [
     {
         "generate_logging": False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     [],
     None,
@@ -206,7 +260,11 @@ tests_standard_files = [
         "generate_logging": False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['SomaWorkflowConfig'],
     'config.json',
@@ -226,9 +284,16 @@ tests_custom_files = [
         "generate_logging": False,
         'use_matlab': False,
         'use_smart_caching': False,
+        'smart_caching_fingerprint': 'stat',
+        'smart_caching_eviction_policy': 'lru',
+        'smart_caching_skip_up_to_date': False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['FSLConfig', 'MatlabConfig', 'SPMConfig', 'SmartCachingConfig', 'SomaWorkflowConfig'],
     os.path.join('somewhere', 'config.json'),
@@ -249,11 +314,15 @@ tests_custom_files = [
         'use_matlab': False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'attributes_schema_paths': [
             'capsul.attributes.completion_engine_factory'],
         'attributes_schemas': {},
         'process_completion': 'builtin',
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['AttributesConfig', 'BrainVISAConfig', 'FomConfig', 'MatlabConfig', 'SPMConfig', 'SomaWorkflowConfig'],
     os.path.join('somewhere', 'config.json'),
@@ -268,9 +337,16 @@ tests_custom_files = [
         "generate_logging": False,
         'use_matlab': False,
         'use_smart_caching': False,
+        'smart_caching_fingerprint': 'stat',
+        'smart_caching_eviction_policy': 'lru',
+        'smart_caching_skip_up_to_date': False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['FSLConfig', 'MatlabConfig', 'SPMConfig', 'SmartCachingConfig', 'SomaWorkflowConfig'],
     os.path.join('somewhere', 'config.json'),
@@ -281,7 +357,11 @@ tests_custom_files = [
     {
         "generate_logging": False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     [],
     None,
@@ -296,7 +376,11 @@ tests_custom_files = [
         "generate_logging": False,
         'use_soma_workflow': False,
         'create_output_directories': True,
+        'record_runtime_history': True,
+        'fast_temporary_max_size': 256,
         'process_output_directory': False,
+        'local_parallel_workers': 1,
+        'local_failure_policy': 'fail_fast',
     },
     ['SomaWorkflowConfig'],
     os.path.join('somewhere', 'config.json'),
@@ -1,3 +1,5 @@
 '''
 The :mod:`capsul.subprocess` module provides interfaces similar to those of the standard :mod:`subprocess` module, specialized to call specific neuroimaging software such as FSL, SPM or FreeSurfer. It provides :class:`~subprocess.Popen`, :func:`~subprocess.call`, :func:`~subprocess.check_call` and :func:`~subprocess.check_outputs` replacement functions which work in the selected specific environment.
+
+The :mod:`capsul.subprocess.aio` module provides coroutine versions of these functions, running commands as asyncio subprocesses (Python 3 only).
 '''
\ No newline at end of file
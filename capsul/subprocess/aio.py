@@ -0,0 +1,169 @@
+'''
+asyncio counterparts of subprocess-like functions. Commands run as asyncio
+subprocesses, so a single event loop can drive many concurrent commands
+without using a thread for each of them. The number of commands running at
+the same time can be bounded with an :class:`asyncio.Semaphore`. If the
+calling task is cancelled, the running command is killed.
+
+This module requires Python 3.
+
+Functions
+=========
+:func:`call`
+------------
+:func:`check_call`
+------------------
+:func:`check_output`
+--------------------
+:func:`fsl_call`
+----------------
+:func:`fsl_check_call`
+----------------------
+:func:`fsl_check_output`
+------------------------
+:func:`spm_call`
+----------------
+:func:`spm_check_call`
+----------------------
+:func:`spm_check_output`
+------------------------
+'''
+
+from __future__ import absolute_import
+
+import asyncio
+import subprocess
+
+
+class _NoSemaphore(object):
+    ''' Do-nothing async context manager used when no semaphore is given.
+    '''
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+async def _run(command, semaphore=None, capture_output=False, **kwargs):
+    '''
+    Run a command as an asyncio subprocess and return (returncode, stdout).
+    '''
+    if semaphore is None:
+        semaphore = _NoSemaphore()
+    if capture_output:
+        kwargs.setdefault('stdout', subprocess.PIPE)
+    async with semaphore:
+        process = await asyncio.create_subprocess_exec(*command, **kwargs)
+        try:
+            stdout, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            # the command must not survive its task
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+    return process.returncode, stdout
+
+
+async def call(command, semaphore=None, **kwargs):
+    '''
+    Equivalent to Python subprocess.call as a coroutine.
+
+    Parameters
+    ----------
+    command: list of str (mandatory)
+        the command line
+    semaphore: asyncio.Semaphore (optional)
+        if given, the command is started only when the semaphore can be
+        acquired.
+    kwargs: dict
+        other parameters are passed to asyncio.create_subprocess_exec()
+    '''
+    returncode, stdout = await _run(command, semaphore, **kwargs)
+    return returncode
+
+
+async def check_call(command, semaphore=None, **kwargs):
+    '''
+    Equivalent to Python subprocess.check_call as a coroutine. See
+    :func:`call` for parameters.
+    '''
+    returncode, stdout = await _run(command, semaphore, **kwargs)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return 0
+
+
+async def check_output(command, semaphore=None, **kwargs):
+    '''
+    Equivalent to Python subprocess.check_output as a coroutine. See
+    :func:`call` for parameters.
+    '''
+    returncode, stdout = await _run(command, semaphore, capture_output=True,
+                                    **kwargs)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command,
+                                            output=stdout)
+    return stdout
+
+
+def _fsl_command(study_config, command):
+    from capsul.subprocess import fsl
+    fsl.check_fsl_configuration(study_config)
+    return fsl.fsl_command_with_environment(study_config, command)
+
+
+async def fsl_call(study_config, command, semaphore=None, **kwargs):
+    '''
+    Equivalent to :func:`capsul.subprocess.fsl.call` as a coroutine.
+    '''
+    return await call(_fsl_command(study_config, command), semaphore,
+                      **kwargs)
+
+
+async def fsl_check_call(study_config, command, semaphore=None, **kwargs):
+    '''
+    Equivalent to :func:`capsul.subprocess.fsl.check_call` as a coroutine.
+    '''
+    return await check_call(_fsl_command(study_config, command), semaphore,
+                            **kwargs)
+
+
+async def fsl_check_output(study_config, command, semaphore=None, **kwargs):
+    '''
+    Equivalent to :func:`capsul.subprocess.fsl.check_output` as a coroutine.
+    '''
+    return await check_output(_fsl_command(study_config, command), semaphore,
+                              **kwargs)
+
+
+def _spm_command(study_config, batch_file):
+    from capsul.subprocess import spm
+    spm.check_spm_configuration(study_config)
+    return spm.spm_command(study_config, batch_file)
+
+
+async def spm_call(study_config, batch_file, semaphore=None, **kwargs):
+    '''
+    Equivalent to :func:`capsul.subprocess.spm.call` as a coroutine.
+    '''
+    return await call(_spm_command(study_config, batch_file), semaphore,
+                      **kwargs)
+
+
+async def spm_check_call(study_config, batch_file, semaphore=None, **kwargs):
+    '''
+    Equivalent to :func:`capsul.subprocess.spm.check_call` as a coroutine.
+    '''
+    return await check_call(_spm_command(study_config, batch_file),
+                            semaphore, **kwargs)
+
+
+async def spm_check_output(study_config, batch_file, semaphore=None,
+                           **kwargs):
+    '''
+    Equivalent to :func:`capsul.subprocess.spm.check_output` as a coroutine.
+    '''
+    return await check_output(_spm_command(study_config, batch_file),
+                              semaphore, **kwargs)
@@ -231,7 +231,7 @@ def check_call(study_config, batch_file, **kwargs):
     return soma.subprocess.check_call(cmd, **kwargs)
 
 
-def check_output(study_config, command, **kwargs):
+def check_output(study_config, batch_file, **kwargs):
     '''
     Equivalent to Python soma.subprocess.check_output for SPM batch
     '''
@@ -0,0 +1,56 @@
+##########################################################################
+# CAPSUL - Copyright (C) CEA, 2013
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+'''
+Files utilities
+
+Functions
+=========
+:func:`reflink`
+---------------
+'''
+
+import os
+import shutil
+import errno
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+
+# Linux ioctl cloning a file (copy-on-write) on filesystems supporting it
+# (btrfs, xfs...)
+_FICLONE = 0x40049409
+
+
+def reflink(source, destination):
+    """ Create destination as a copy-on-write clone of source, sharing its
+    data, and copy its metadata. Raise an OSError or IOError if the
+    filesystem does not support it (destination is then removed).
+
+    Parameters
+    ----------
+    source: string
+        the file to copy.
+    destination: string
+        the copy file name.
+    """
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, "reflinks are not supported")
+    with open(source, "rb") as source_file:
+        try:
+            with open(destination, "wb") as destination_file:
+                fcntl.ioctl(destination_file.fileno(), _FICLONE,
+                            source_file.fileno())
+        except (IOError, OSError):
+            if os.path.exists(destination):
+                os.unlink(destination)
+            raise
+    shutil.copystat(source, destination)